@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+import asyncio
+import can
+import functools
+import re
+import signal
+import sys
+import traceback
+
+import socketcanopen
+
+# Server constants
+CAN_INTERFACES = ["vcan0", "vcan1"] # Must be a list, net 1 is the first interface
+TCP_SERVER_IP_ADDRESS = "" # Empty string for any address
+TCP_SERVER_PORT = 60000
+EDS_FILES = {} # (net, node-ID): EDS filename, for data types and block transfers of large objects
+MAX_CONNECTIONS = 4096 # Further connections are closed at once
+MAX_LINE_SIZE = 65536 # Bytes per command line
+MAX_PIPELINE = 256 # Commands per connection executing or waiting for their response to be sent
+
+# Gateway variables
+connections = 0
+
+TOKEN_PATTERN = re.compile(r'"((?:[^"]|"")*)"|(\S+)')
+
+NMT_COMMANDS = {
+    ('start',): socketcanopen.NMT_NODE_CONTROL_START,
+    ('stop',): socketcanopen.NMT_NODE_CONTROL_STOP,
+    ('preop',): socketcanopen.NMT_NODE_CONTROL_PREOPERATIONAL,
+    ('preoperational',): socketcanopen.NMT_NODE_CONTROL_PREOPERATIONAL,
+    ('reset', 'node'): socketcanopen.NMT_NODE_CONTROL_RESET_NODE,
+    ('reset', 'comm'): socketcanopen.NMT_NODE_CONTROL_RESET_COMMUNICATION,
+    ('reset', 'communication'): socketcanopen.NMT_NODE_CONTROL_RESET_COMMUNICATION,
+}
+
+
+class CommandError(Exception):
+    # CiA 309-3 error code: 100 request not supported, 101 syntax error, 103 time-out, 104 no default net set,
+    # 105 no default node set, 106 unsupported net, 107 unsupported node
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+def tokenize(line):
+    # Words separated by white space, or quoted with "" for a literal quote
+    return [m.group(1).replace('""', '"') if m.group(2) is None else m.group(2) for m in TOKEN_PATTERN.finditer(line)]
+
+
+def parse_int(value, max=sys.maxsize):
+    try:
+        value = int(value, 0)
+    except (TypeError, ValueError):
+        raise CommandError(101)
+    if not 0 <= value <= max:
+        raise CommandError(101)
+    return value
+
+
+def parse_net(gateway, net):
+    # Returns the net number
+    if net is None:
+        net = gateway.default_net
+        if net is None:
+            raise CommandError(104)
+    try:
+        gateway.network(net)
+    except (ValueError, TypeError):
+        raise CommandError(106)
+    return net
+
+
+def parse_node(gateway, node_id):
+    # Returns the node-ID, 0 for all nodes
+    if node_id == 0:
+        return 0
+    if node_id is None and gateway.default_node_id is None:
+        raise CommandError(105)
+    try:
+        return gateway.node_id(node_id)
+    except ValueError:
+        raise CommandError(107)
+
+
+def quote(value):
+    return '"' + value.replace('"', '""') + '"'
+
+
+async def execute(gateway, tokens):
+    """Executes one CiA 309-3 command, given as tokens without the sequence number, and returns the response"""
+    numbers = []
+    while tokens and len(numbers) < 2 and re.fullmatch(r'0x[0-9a-f]+|\d+', tokens[0], re.IGNORECASE):
+        numbers.append(parse_int(tokens.pop(0)))
+    if not tokens:
+        raise CommandError(101)
+    command = tokens[0].lower()
+    arguments = tokens[1:]
+
+    if command == 'set':
+        if len(arguments) != 2:
+            raise CommandError(101)
+        name = arguments[0].lower()
+        if name == 'network':
+            value = parse_int(arguments[1], len(gateway.networks))
+            if value == 0:
+                raise CommandError(106)
+            gateway.default_net = value
+        elif name == 'node':
+            value = parse_int(arguments[1], 127)
+            if value == 0:
+                raise CommandError(107)
+            gateway.default_node_id = value
+        elif name == 'sdo_timeout':
+            gateway.sdo_timeout = parse_int(arguments[1], 0xFFFF) / 1000
+        else:
+            raise CommandError(100)
+        return "OK"
+
+    net = parse_net(gateway, numbers[0] if len(numbers) == 2 else None)
+    node_id = parse_node(gateway, numbers[-1] if numbers else None)
+
+    nmt_command = tuple(token.lower() for token in tokens)
+    if nmt_command in NMT_COMMANDS:
+        gateway.nmt(net, NMT_COMMANDS[nmt_command], node_id)
+        return "OK"
+
+    if command not in ['r', 'read', 'w', 'write']:
+        raise CommandError(101)
+    if node_id == 0 or len(arguments) < 2:
+        raise CommandError(101)
+    index = parse_int(arguments[0], 0xFFFF)
+    subindex = parse_int(arguments[1], 0xFF)
+    if len(arguments) > 2:
+        data_type = socketcanopen.DATA_TYPE_NAMES.get(arguments[2].lower())
+        if data_type is None:
+            raise CommandError(101)
+    else:
+        data_type = gateway.data_type(net, node_id, index, subindex)
+
+    if command in ['r', 'read']:
+        if len(arguments) > 3:
+            raise CommandError(101)
+        data, eds_data_type = await gateway.read(net, node_id, index, subindex)
+        if data_type is None:
+            data_type = eds_data_type
+        try:
+            value = socketcanopen.format_value(data_type, data)
+        except ValueError:
+            return "ERROR:0x{:08X}".format(socketcanopen.SDO_ABORT_PARAMETER_LENGTH)
+        if data_type in [socketcanopen.ODI_DATA_TYPE_VISIBLE_STRING, socketcanopen.ODI_DATA_TYPE_UNICODE_STRING]:
+            value = quote(value)
+        return value
+
+    if data_type is None or len(arguments) < 4:
+        raise CommandError(101)
+    try:
+        data = socketcanopen.parse_value(data_type, " ".join(arguments[3:]))
+    except ValueError:
+        raise CommandError(101)
+    await gateway.write(net, node_id, index, subindex, data)
+    return "OK"
+
+
+async def execute_line(gateway, line):
+    # Returns the response line, with the sequence number of the command if it has one
+    tokens = tokenize(line)
+    sequence = None
+    if tokens and re.fullmatch(r'\[\d{1,10}\]', tokens[0]):
+        sequence = tokens.pop(0)
+    try:
+        response = await execute(gateway, tokens)
+    except CommandError as e:
+        response = "ERROR:" + str(e.code)
+    except socketcanopen.SdoTimeout:
+        response = "ERROR:103"
+    except socketcanopen.SdoAbort as e:
+        response = "ERROR:0x" + "{:08X}".format(e.code)
+    except Exception:
+        print("Unexpected error:", sys.exc_info()[0])
+        traceback.print_exc()
+        response = "ERROR:102"
+    return response if sequence is None else sequence + " " + response
+
+
+async def serve_connection(gateway, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Executes the command lines of one client
+
+    Commands are started in the order received, without waiting for the responses to earlier ones, and their
+    responses are sent in the same order.  Commands for the same node are executed one after the other, since
+    the gateway serializes SDO transfers per node.
+    """
+    global connections
+    if connections >= MAX_CONNECTIONS:
+        writer.close()
+        return
+    connections += 1
+    pending = asyncio.Queue(MAX_PIPELINE) # Tasks in command order, None after the last
+
+    async def respond():
+        connected = True
+        while True:
+            task = await pending.get()
+            if task is None:
+                break
+            response = await task
+            if not connected:
+                continue # Keeps consuming, so the reader is not blocked
+            writer.write((response + "\r\n").encode("utf-8"))
+            try:
+                if pending.empty():
+                    await writer.drain()
+            except ConnectionError:
+                connected = False
+                writer.close()
+
+    responder = asyncio.ensure_future(respond())
+    try:
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError: # Line too long
+                response = asyncio.get_running_loop().create_future()
+                response.set_result("ERROR:101")
+                await pending.put(response)
+                break
+            if not line:
+                break
+            line = line.decode("utf-8", "replace").strip()
+            if line:
+                await pending.put(asyncio.ensure_future(execute_line(gateway, line)))
+        await pending.put(None)
+        await responder
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        responder.cancel()
+        while not pending.empty():
+            task = pending.get_nowait()
+            if task is not None:
+                task.cancel()
+        connections -= 1
+        writer.close()
+
+
+async def main():
+    gateway = socketcanopen.Gateway([can.Bus(interface, interface="socketcan") for interface in CAN_INTERFACES])
+    for (net, node_id), filename in EDS_FILES.items():
+        gateway.load_eds(net, node_id, filename)
+    gateway.start()
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    server = await asyncio.start_server(
+        functools.partial(serve_connection, gateway),
+        TCP_SERVER_IP_ADDRESS or None,
+        TCP_SERVER_PORT,
+        limit=MAX_LINE_SIZE,
+        backlog=1024
+    )
+    async with server:
+        await stop.wait()
+    gateway.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,54 +1,51 @@
 #!/usr/bin/env python3
+import asyncio
 import can
-from datetime import datetime
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import functools
 import json
-from os import path
 import re
-from select import select
 import signal
-from socketserver import ThreadingMixIn
-import struct
 import sys
-from time import sleep, time
 import traceback
-from urllib.parse import parse_qsl, urlparse
+from urllib.parse import parse_qsl, urlsplit
 
 import socketcanopen
 
 # Server constants
-CAN_INTERFACES = ["vcan0", "vcan1"] # Must be a list
+CAN_INTERFACES = ["vcan0", "vcan1"] # Must be a list, net 1 is the first interface
 HTTP_SERVER_IP_ADDRESS = "" # Empty string for any address
 HTTP_SERVER_PORT = 8002
-WWW_DIR = path.dirname(path.realpath(__file__))
+EDS_FILES = {} # (net, node-ID): EDS filename, for data types and block transfers of large objects
+MAX_CONNECTIONS = 4096 # Further connections are refused with 503
+MAX_HEADER_SIZE = 16384 # Bytes, request line and headers
+MAX_BODY_SIZE = 65536 # Bytes
+MAX_BATCH_SIZE = 1024 # Commands per batch request
+KEEP_ALIVE_TIMEOUT = 30 # Seconds a connection may be idle between requests
+STREAM_HEARTBEAT_INTERVAL = 15 # Seconds between comments sent on idle event streams
 
-# Gateway variables (default value assignments)
-default_net = "vcan0" # When 'default' net is specified
-default_node_id = 0xFF # 0xFF = Invalid
-command_timeout = 1 # Default, in seconds (value sent in ms)
-sdo_timeout = 1 # Default, in seconds (value sent in ms)
-rpdos = {}
-tpdos = {}
+# Gateway variables
+connections = 0
 
-def sigterm_handler(signum, frame):
-    sys.exit()
+CORS_HEADERS = [
+    ("Access-Control-Allow-Origin", "*"),
+    ("Access-Control-Allow-Methods", "GET, POST, PUT, OPTIONS"),
+    ("Access-Control-Allow-Headers", "X-Requested-With, Content-type"),
+]
 
-def coerce(value, datatype):
-    if value is None:
-        return ValueError("Unable to coerce undefined value")
-    if datatype == "b": # Boolean
-        return bool(value)
-    if datatype in ["u8", "u16", "u24", "u32", "u40", "u48", "u56", "u64", "i8", "i16", "i24", "i32", "i40", "i48", "i56", "i64"]:
-        return int(value, 0)
-    if datatype in ["r32", "r64"]:
-        return float(value)
-    if datatype in ["t", "td", "vs", "os", "us", "d"]:
-        raise NotImplementedError
-    raise ValueError("Unknown datatype: " + str(datatype))
+
+class BadRequest(Exception):
+    pass
+
+
+class HttpError(Exception):
+    def __init__(self, status, reason, message=None):
+        super().__init__(reason if message is None else message)
+        self.status = status
+        self.reason = reason
 
 
 def parse_request(request):
-    match = re.match('/cia309-5/(\d+\.\d+)/(\d{1,10})/(0x[0-9a-f]{1,4}|\d{1,10}|default|none|all)/(0x[0-9a-f]{1,2}|\d{1,3}|default|none|all)/(.*)', request, re.IGNORECASE)
+    match = re.match(r'/cia309-5/(\d+\.\d+)/(\d{1,10})/(0x[0-9a-f]{1,4}|\d{1,10}|default|none|all)/(0x[0-9a-f]{1,2}|\d{1,3}|default|none|all)/(.*)', request, re.IGNORECASE)
     if match is None:
         raise ValueError("invalid syntax")
 
@@ -61,379 +58,452 @@ def parse_request(request):
     if sequence > 4294967295:
         raise ValueError("invalid sequence: " + str(sequence))
 
-    net = match.group(3)
-    if net[0] == '0' and net[1] == 'x':
-        net = int(net, 16)
-    else:
-        try:
-            net = int(net)
-        except ValueError:
-            pass
-    if type(net) == int and (net == 0 or net > 0xFFFF):
-        raise ValueError("invalid net: " + str(net))
+    net = match.group(3).lower()
+    if net not in ['default', 'none', 'all']:
+        net = int(net, 0)
+        if net == 0 or net > 0xFFFF:
+            raise ValueError("invalid net: " + str(net))
 
-    node = match.group(4)
-    if node[0] == '0' and node[1] == 'x':
-        node = int(node, 16)
-    else:
-        try:
-            node = int(node)
-        except ValueError:
-            pass
-    if type(node) == int and (node == 0 or (node > 127 and node != 255)):
-        raise ValueError("invalid node: " + str(node))
+    node = match.group(4).lower()
+    if node not in ['default', 'none', 'all']:
+        node = int(node, 0)
+        if node == 0 or (node > 127 and node != 255):
+            raise ValueError("invalid node: " + str(node))
 
     command = match.group(5)
-    #command = parse_command(command)
     return (sequence, net, node, command)
 
-def parse_net(net):
-    global default_net
-    if net == 'default':
-        net = default_net
-    else:
-        net = CAN_INTERFACES[int(net) - 1]
-    return can.Bus(net, interface="socketcan")
-
-def parse_command(command):
-    if command[0:2] == 'r/' or command[0:5] == 'read/':
-        command_specifier = 'r'
-    elif command[0:2] == 'w/' or command[0:6] == 'write/':
-        command_specifier = 'w'
-    elif command == 'start':
-        command_specifier = 'start'
-    elif command == 'stop':
-        command_specifier = 'stop'
-    elif command == 'preop' or command[0:11] == "preoperational":
-        command_specifier = 'preop'
-    elif command == 'reset/node':
-        command_specifier = 'reset/node'
-    elif command == 'reset/comm' or command[0:19] == 'reset/communication':
-        command_specifier = 'reset/comm'
-    elif command == 'set/sdo-timeout':
-        command_specifier = 'set/sdo-timeout'
-    elif command == 'set/rpdo':
-        command_specifier = 'set/rpdo'
-    elif command == 'set/tpdo':
-        command_specifier = 'set/tpdo'
-    elif command == 'set/tpdox':
-        command_specifier = 'set/tpdox'
-    elif command == 'set/heartbeat':
-        command_specifier = 'set/heartbeat'
-    elif command == 'set/id':
-        command_specifier = 'set/id'
-    elif command == 'set/command-timeout':
-        command_specifier = 'set/command-timeout'
-    elif command == 'set/network':
-        command_specifier = 'set/network'
-    elif command == 'set/node':
-        command_specifier = 'set/node'
-    elif command == 'set/command-size':
-        command_specifier = 'set/command-size' 
-    else:
-        raise ValueError("invalid command: " + command)
-    return command_specifier
 
 def parse_int(value, max=sys.maxsize):
+    if value is None:
+        raise ValueError("value required")
     int_value = int(value, 0)
     if int_value > max:
         raise ValueError("invalid integer value: " + str(value))
     return int_value
 
-def exec_sdo(bus: can.BusABC, request: socketcanopen.SdoRequest, timeout) -> socketcanopen.SdoResponse:
-    bus.send(request)
-    timeout_time = time() + timeout
-    dtimeout = timeout
-    while dtimeout > 0:
-        rlist, _, _ = select([bus], [], [], dtimeout)
-        if len(rlist) > 0:
-            bus = rlist[0]
-            response = socketcanopen.Message.factory(bus.recv())
-            if isinstance(response, socketcanopen.SdoResponse) and response.node_id == request.node_id and response.index == request.index and response.subindex == request.subindex:
-                if isinstance(response, socketcanopen.SdoAbortResponse):
-                    raise socketcanopen.SdoAbort(response.index, response.subindex, response.sdo_data)
-                if isinstance(request, socketcanopen.SdoUploadRequest) and isinstance(response, socketcanopen.SdoUploadResponse):
-                    return response
-                if isinstance(request, socketcanopen.SdoDownloadRequest) and isinstance(response, socketcanopen.SdoDownloadResponse):
-                    return response
-                # Unsupported socketcanopen.SdoResponse, ignore and keep listening
-            dtimeout = timeout_time - time()
-        else:
-            raise socketcanopen.SdoTimeout # Timeout from select
-    raise socketcanopen.SdoTimeout
-
-def read_pdo(bus: can.BusABC, nr, timeout):
-    global rpdos
-    rpdo = rpdos.get(nr)
-    if rpdo is None:
-        raise ValueError
-    cob = rpdo.get('cob')
-    if cob is None:
-        raise ValueError
-    datatypes = rpdo.get('datatypes')
-    if datatypes is None:
-        raise ValueError
-    timeout_time = time() + timeout
-    dtimeout = timeout
-    while dtimeout > 0:
-        rlist, _, _ = select([bus], [], [], dtimeout)
-        if len(rlist) > 0:
-            bus = rlist[0]
-            msg = bus.recv()
-            if msg.arbitration_id & 0x7FF == rpdos.get(nr).get('cob'):
-                return list(msg.data) # TODO: Unpack data based on data types
-            dtimeout = timeout_time - time()
-        else:
-            raise Exception # Timeout
-    return list(range(len(datatypes)))
-
-class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
-    pass
-
-class BadRequest(BaseException):
-    def __init__(self, arg):
-        self.args = arg
 
-class RequestHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        global sdo_timeout, rpdos, tpdos
-        request = urlparse(self.path).path
-
-        if request == "/favicon.ico":
-            self.send_response(204)
-            return
-
-        content_len = int(self.headers.get('content-length', 0)) # access POST/PUT body
-        if content_len == 0:
-            parameters = {}
-        else:
-            body = self.rfile.read(content_len) # read POST/PUT body
-            body = body.decode('utf-8')
-            parameters = dict(parse_qsl(body))
-
-        try: # excepts bad stuff
-            try: # excepts for HTTP 200
+def parse_net(gateway, net):
+    # Returns the net number
+    if net == 'default':
+        net = gateway.default_net
+    try:
+        gateway.network(net)
+    except (ValueError, TypeError):
+        raise BadRequest("invalid net: " + str(net))
+    return net
+
+
+def parse_node(gateway, node):
+    # Returns the node-ID, 0 for all nodes, or None for no node
+    if node == 'all':
+        return 0
+    if node == 'none':
+        return None
+    try:
+        return gateway.node_id(None if node == 'default' else node)
+    except ValueError as e:
+        raise BadRequest(str(e))
+
+
+NMT_COMMANDS = {
+    'start': socketcanopen.NMT_NODE_CONTROL_START,
+    'stop': socketcanopen.NMT_NODE_CONTROL_STOP,
+    'preop': socketcanopen.NMT_NODE_CONTROL_PREOPERATIONAL,
+    'preoperational': socketcanopen.NMT_NODE_CONTROL_PREOPERATIONAL,
+    'reset/node': socketcanopen.NMT_NODE_CONTROL_RESET_NODE,
+    'reset/comm': socketcanopen.NMT_NODE_CONTROL_RESET_COMMUNICATION,
+    'reset/communication': socketcanopen.NMT_NODE_CONTROL_RESET_COMMUNICATION,
+}
+
+
+async def execute(gateway, net, node, command, parameters):
+    """Executes one CiA 309-5 command and returns the response fields other than the sequence number"""
+    command_response = {}
+    try:
+        if command in NMT_COMMANDS:
+            net = parse_net(gateway, net)
+            node_id = parse_node(gateway, node)
+            if node_id is not None:
+                gateway.nmt(net, NMT_COMMANDS[command], node_id)
+            command_response["response"] = "OK"
+
+        elif command in ['set/sdo-timeout', 'set/command-timeout']:
+            try:
+                value = parse_int(parameters.get("value"), 0xFFFF)
+            except ValueError as e:
+                raise BadRequest(str(e))
+            if command == 'set/sdo-timeout':
+                gateway.sdo_timeout = value / 1000
+            else:
+                gateway.command_timeout = value / 1000
+            command_response["response"] = "OK"
+
+        elif command in ['set/network', 'set/node']:
+            try:
+                if command == 'set/network':
+                    value = parse_int(parameters.get("value"), len(gateway.networks))
+                    if value == 0:
+                        raise ValueError("invalid net: 0")
+                    gateway.default_net = value
+                else:
+                    value = parse_int(parameters.get("value"), 127)
+                    if value == 0:
+                        raise ValueError("invalid node: 0")
+                    gateway.default_node_id = value
+            except ValueError as e:
+                raise BadRequest(str(e))
+            command_response["response"] = "OK"
+
+        elif command == 'set/rpdo':
+            net = parse_net(gateway, net)
+            try:
+                nr = parse_int(parameters.get("nr"), 512)
+                cob = parse_int(parameters.get("COB"), 0xFFFFFFFF)
+                nr_of_data = parse_int(parameters.get("nr-of-data"), 0x40)
+                datatypes = []
+                for i in range(nr_of_data):
+                    datatype = parameters.get("map-obj" + str(i + 1))
+                    if datatype is None:
+                        raise ValueError("map-obj" + str(i + 1) + " required")
+                    if datatype not in socketcanopen.DATA_TYPE_NAMES:
+                        raise ValueError("invalid datatype: " + datatype)
+                    datatypes.append(socketcanopen.DATA_TYPE_NAMES[datatype])
+            except ValueError as e:
+                raise BadRequest(str(e))
+            gateway.pdo_cache(net).configure(nr, cob, datatypes)
+            command_response["response"] = "OK"
+
+        elif command in ['set/tpdo', 'set/tpdox', 'set/heartbeat', 'set/id', 'set/command-size']:
+            raise NotImplementedError
+
+        elif re.match('(r|read|w|write)/', command, re.IGNORECASE):
+            match = re.fullmatch(r'(r|read|w|write)/(p|pdo)/(0x[0-9a-f]{1,3}|\d{1,4})', command, re.IGNORECASE)
+            if match is not None:
+                net = parse_net(gateway, net)
+                nr = parse_int(match.group(3), 0x200)
+                cache = gateway.pdo_cache(net)
+                if nr not in cache or match.group(1).lower() in ['w', 'write']:
+                    raise NotImplementedError
                 try:
-                    sequence, net, node, command = parse_request(request)
-                except Exception as e:
-                    raise BadRequest(str(e))
-
-                command_response = {"sequence": str(sequence)}
-
+                    values, age = await cache.wait(nr, gateway.command_timeout)
+                except asyncio.TimeoutError:
+                    raise socketcanopen.SdoTimeout(None, None)
+                command_response["net"] = net
+                command_response["nr"] = nr
+                command_response["nr-of-data"] = len(values)
+                command_response["value"] = values
+                command_response["age"] = int(age * 1000) # Milliseconds since received
+                return command_response
+
+            match = re.fullmatch(r'(r|read|w|write)/(all|0x[0-9a-f]{1,4}|\d{1,5})/?(0x[0-9a-f]{1,2}|\d{1,3})?', command, re.IGNORECASE)
+            if match is None:
+                raise BadRequest("invalid command: " + command)
+            command_specifier = match.group(1).lower()
+            if match.group(2) == 'all':
+                raise NotImplementedError # "Resource", should use EDS
+            try:
+                index = parse_int(match.group(2), 0xFFFF)
+                subindex = parse_int(match.group(3) or "0", 0xFF)
+            except ValueError as e:
+                raise BadRequest(str(e))
+            net = parse_net(gateway, net)
+            node_id = parse_node(gateway, node)
+            if node_id == 0:
+                raise NotImplementedError # May not be a valid request
+            if node_id is None:
+                command_response["response"] = "OK"
+                return command_response
+
+            if command_specifier in ['r', 'read']:
+                data, data_type = await gateway.read(net, node_id, index, subindex)
+                command_response["data"] = socketcanopen.format_value(data_type, data)
+                command_response["length"] = socketcanopen.data_type_name(data_type, len(data))
+            else:
+                if 'value' not in parameters:
+                    raise BadRequest("value is required")
+                if 'datatype' in parameters:
+                    data_type = socketcanopen.DATA_TYPE_NAMES.get(parameters.get("datatype"))
+                    if data_type is None:
+                        raise BadRequest("invalid datatype: " + parameters.get("datatype"))
+                else:
+                    data_type = gateway.data_type(net, node_id, index, subindex)
+                    if data_type is None:
+                        raise BadRequest("datatype is required")
                 try:
-                    bus = parse_net(net)
-                except:
-                    raise BadRequest("invalid net: " + str(net))
-
-                if command in ['start', 'stop', 'preop', 'reset/node', 'reset/comm']:
-                    if command == 'start':
-                        cs = socketcanopen.NMT_NODE_CONTROL_START
-                    elif command == 'stop':
-                        cs = socketcanopen.NMT_NODE_CONTROL_STOP
-                    elif command == 'preop' or command == 'preoperational':
-                        cs = socketcanopen.NMT_NODE_CONTROL_PREOPERATIONAL
-                    elif command == 'reset/node':
-                        cs = socketcanopen.NMT_NODE_CONTROL_RESET_NODE
-                    elif command == 'reset/comm' or command == 'reset/communication':
-                        cs = socketcanopen.NMT_NODE_CONTROL_RESET_COMMUNICATION
-                    else:
-                        raise BadRequest("Invalid NMT Node Control command-specifier")
-
-                    if node == 'all':
-                        node_id = 0
-                    elif node == 'default':
-                        node_id = default_node_id
-                    elif node == 'none':
-                        node_id = None
-                    else:
-                        node_id = node
-
-                    if node_id is not None:
-                        msg = socketcanopen.NmtNodeControlMessage(cs, node_id)
-                        bus.send(msg)
-                    command_response["response"] = "OK"
-
-                elif command == 'set/sdo-timeout':
-                    if not 'value' in parameters:
-                        raise BadRequest("value required")
-                    value = parameters.get("value")
-                    try:
-                        value = int(value)
-                    except:
-                        raise BadRequest("invalid value: " + value)
-                    if value >= (2 ** 16):
-                        raise BadRequest("invalid value: " + value)
-                    sdo_timeout = value / 1000
-                    command_response["response"] = "OK"
-
-                elif command == 'set/rpdo':
-                    try:
-                        nr = parse_int(parameters.get("nr"), 512)
-                        cob = parse_int(parameters.get("COB"), 0xFFFFFFFF)
-                        nr_of_data = parse_int(parameters.get("nr-of-data"), 0x40)
-                        rpdo = rpdos.get(nr, {})
-                        rpdo['cob'] = cob
-                        mappings = []
-                        datatypes = []
-                        for i in range(nr_of_data):
-                            map_obj = parameters.get("map-obj" + str(i + 1))
-                            if map_obj is None:
-                                raise BadRequest
-                            if type(map_obj) is list:
-                                index = parse_int(map_obj[0], 0xFFFF)
-                                subindex = parse_int(map_obj[1], 0xFF)
-                                mapping = {'index': index, 'subindex': subindex}
-                                mappings.append(mapping)
-                            else:
-                                datatypes.append(map_obj)
-                        if len(mappings) == 0:
-                            rpdo['datatypes'] = datatypes
-                        else:
-                            rpdo['mappings'] = mappings
-                        rpdos.update({nr: rpdo})
-                    except ValueError as e:
-                        raise BadRequest(e)
-                    command_response["response"] = "OK"
-
-                elif command == 'set/tpdo':
-                    raise NotImplementedError
+                    data = socketcanopen.parse_value(data_type, parameters.get("value"))
+                except ValueError:
+                    raise BadRequest("invalid value/datatype")
+                await gateway.write(net, node_id, index, subindex, data)
+                command_response["response"] = "OK"
 
-                elif command[0:2] == 'r/' or command[0:5] == 'read/' or command[0:2] == 'w/' or command[0:6] == 'write/':
-                    match = re.match('(r|read|w|write)/(all|0x[0-9a-f]{1,4}|\d{1,5})/?(0x[0-9a-f]{1,2}|\d{1,3})?', command, re.IGNORECASE)
-                    if match is None:
-                        match = re.match('(r|read|w|write)/(p|pdo)/(0x[0-9a-f]{1,3}|\d{1,4})', command, re.IGNORECASE)
-
-                    command_specifier = match.group(1)
-                    index = match.group(2)
-
-                    if index == 'p' or index == 'pdo':
-                        nr = parse_int(match.group(3), 0x200)
-                        rpdo = rpdos.get(nr)
-                        if rpdo is None:
-                            command_response["response"] = "ERROR:100"
-                        else:
-                            mappings = rpdo.get('mappings')
-                            datatypes = rpdo.get('datatypes')
-                            print("reading pdo")
-                            values = read_pdo(bus, nr, 10)
-                            print(str(len(mappings)) + "," + str(len(datatypes)) + "," + str(len(values)))
-                            if mappings is None or datatypes is None or values is None or len(mappings) != len(datatypes) or len(mappings) != len(values):
-                                command_response["response"] = "ERROR:100"
-                            else:
-                                command_response["net"] = net
-                                command_response["nr"] = nr
-                                command_response["nr-of-data"] = len(mappings)
-                                command_response["value"] = values
-
-                    else:
-
-                        if index == 'all':
-                            raise NotImplementedError
-                        try:
-                            index = parse_int(index, 0xFFFF)
-                        except ValueError as e:
-                            raise BadRequest(e)
-
-                        subindex = match.group(3)
-                        try:
-                            subindex = parse_int(subindex, 0xFF)
-                        except ValueError as e:
-                            raise BadRequest(e)
-
-                        if command_specifier == 'r' or command_specifier == 'read':
-                            if node == 'all':
-                                raise NotImplementedError # May not be a valid request
-                            if node != 'none':
-                                if node == 'default':
-                                    node_id = default_node_id
-                                else:
-                                    node_id = node
-
-                                if index == 'all':
-                                    raise NotImplementedError # "Resource", should use EDS
-
-                                req = socketcanopen.SdoUploadRequest(node_id, index, subindex)
-                                res = exec_sdo(bus, req, sdo_timeout)
-                                command_response["data"] = "0x{:08X}".format(res.sdo_data)
-                                command_response["length"] = "u32" # Lookup data type in EDS?
-
-                        elif command_specifier == 'w' or command_specifier == 'write':
-                            if node == 'all':
-                                raise NotImplementedError # May not be a valid request
-                            if node != 'none':
-                                if node == 'default':
-                                    node_id = default_node_id
-                                else:
-                                    node_id = node
-
-                                if index == 'all':
-                                    raise BadRequest("invalid index: all")
-
-                                if not 'datatype' in parameters:
-                                    print(str(parameters))
-                                    raise BadRequest("datatype is required")
-                                datatype = parameters.get("datatype")
-                                if not 'value' in parameters:
-                                    raise BadRequest("value is required")
-
-                                try:
-                                    value = coerce(parameters.get("value"), parameters.get("datatype"))
-                                except:
-                                    raise BadRequest("invalid value/datatype")
-
-                                # TODO: Look these up based on datatype and validate value
-                                n = 0
-                                e = 1
-                                s = 1
-                                req = socketcanopen.SdoDownloadRequest(node_id, n, e, s, index, subindex, value)
-                                res = exec_sdo(bus, req, sdo_timeout)
-                                command_response["response"] = "OK"
-
-                else:
-                    raise BadRequest("invalid command: " + command)
-
-            except socketcanopen.SdoAbort as e:
-                command_response["response"] = "ERROR:0x" + "{:08X}".format(e.code)
-            except socketcanopen.SdoTimeout:
-                command_response["response"] = "ERROR:103"
-
-            self.send_response(200)
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, OPTIONS')
-            self.send_header('Access-Control-Allow-Headers', 'X-Requested-With')
-            self.send_header('Content-type', 'application/json; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(bytes(json.dumps(command_response) + "\n", 'utf-8'))
-
-        except BadRequest as e:
-            print("Bad Request: " + str(e))
-            self.send_response(400)
-            self.send_error(400, 'Bad Request: %s' % str(e.args))
-        except BrokenPipeError:
-            print('Connection closed.')
-        except:
-            print("Unexpected error:", sys.exc_info()[0])
-            traceback.print_exc()
-            self.send_response(500)
-            self.send_error(500, 'Unexpected Error')
-
-    def do_OPTIONS(self):
-        self.send_response(204)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'X-Requested-With')
-        self.send_header('Access-Control-Allow-Headers', 'Content-type')
-        self.end_headers()
-
-    def do_POST(self):
-        self.do_GET()
-
-    def do_PUT(self):
-        self.do_GET()
-
-    def log_message(self, format, *args):
-        return # Suppress logging
-
-signal.signal(signal.SIGTERM, sigterm_handler)
-srvr = ThreadedHTTPServer((HTTP_SERVER_IP_ADDRESS, HTTP_SERVER_PORT), RequestHandler)
-srvr.serve_forever()
+        else:
+            raise BadRequest("invalid command: " + command)
+
+    except socketcanopen.SdoTimeout:
+        command_response["response"] = "ERROR:103"
+    except socketcanopen.SdoAbort as e:
+        command_response["response"] = "ERROR:0x" + "{:08X}".format(e.code)
+    except NotImplementedError:
+        command_response["response"] = "ERROR:100"
+    return command_response
+
+
+async def execute_item(gateway, sequence, net, node, command, parameters):
+    command_response = {"sequence": str(sequence)}
+    try:
+        command_response.update(await execute(gateway, net, node, command, parameters))
+    except (BadRequest, ValueError):
+        command_response["response"] = "ERROR:101"
+    return command_response
+
+
+def batch_key(gateway, net, node, command):
+    # Commands with equal keys are executed in order; None for commands that may affect any other command
+    if command.startswith('set/') or net in ['all', 'none'] or node == 'all':
+        return None
+    return (gateway.default_net if net == 'default' else net, gateway.default_node_id if node == 'default' else node)
+
+
+async def execute_batch(gateway, items):
+    """Executes a list of CiA 309-5 commands and returns their responses in the same order
+
+    Each item is a request path, or an object with the request path as "path" and the command's parameters.
+    Commands for different nodes are executed concurrently and commands for the same node in order, so each
+    node's SDO server handles one transfer at a time.  set/ commands and commands for all nodes wait for the
+    preceding commands and hold back the following ones.
+    """
+    responses = [None] * len(items)
+    groups = {}
+
+    async def execute_group(group):
+        for i, request in group:
+            responses[i] = await execute_item(gateway, *request)
+
+    async def flush():
+        await asyncio.gather(*(execute_group(group) for group in groups.values()))
+        groups.clear()
+
+    for i, item in enumerate(items):
+        if isinstance(item, str):
+            path, parameters = item, {}
+        elif isinstance(item, dict) and isinstance(item.get("path"), str):
+            path = item["path"]
+            parameters = {name: str(value) for name, value in item.items() if name != "path"}
+        else:
+            responses[i] = {"sequence": None, "response": "ERROR:101"}
+            continue
+        try:
+            request = parse_request(path) + (parameters,)
+        except ValueError:
+            responses[i] = {"sequence": None, "response": "ERROR:101"}
+            continue
+        except NotImplementedError:
+            responses[i] = {"sequence": None, "response": "ERROR:100"}
+            continue
+        key = batch_key(gateway, *request[1:4])
+        if key is None:
+            await flush()
+            responses[i] = await execute_item(gateway, *request)
+        else:
+            groups.setdefault(key, []).append((i, request))
+    await flush()
+    return responses
+
+
+async def handle(gateway, method, target, headers, body):
+    # Returns (status, JSON-serializable content or None)
+    if method == "OPTIONS":
+        return 204, None
+    if method not in ["GET", "POST", "PUT"]:
+        raise HttpError(405, "Method Not Allowed")
+    url = urlsplit(target)
+    if url.path == "/favicon.ico":
+        return 204, None
+    if url.path == "/cia309-5/1.0/batch":
+        if method != "POST":
+            raise HttpError(405, "Method Not Allowed")
+        try:
+            items = json.loads(body.decode("utf-8"))
+        except ValueError:
+            raise HttpError(400, "Bad Request", "Bad Request: invalid JSON")
+        if not isinstance(items, list) or len(items) > MAX_BATCH_SIZE:
+            raise HttpError(400, "Bad Request", f"Bad Request: expected an array of at most {MAX_BATCH_SIZE} commands")
+        return 200, await execute_batch(gateway, items)
+    parameters = dict(parse_qsl(url.query))
+    if body:
+        parameters.update(parse_qsl(body.decode("utf-8")))
+    try:
+        sequence, net, node, command = parse_request(url.path)
+        command_response = {"sequence": str(sequence)}
+        command_response.update(await execute(gateway, net, node, command, parameters))
+    except (BadRequest, ValueError) as e:
+        raise HttpError(400, "Bad Request", "Bad Request: " + str(e))
+    except NotImplementedError:
+        raise HttpError(400, "Bad Request", "Bad Request: unsupported API version")
+    return 200, command_response
+
+
+async def read_request(reader: asyncio.StreamReader):
+    """Minimal HTTP/1.1 request parser
+
+    Returns (method, target, version, headers, body), or None if the connection was closed between requests.
+    Header names are lower case.  Chunked request bodies are not supported.
+    """
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if e.partial.strip():
+            raise HttpError(400, "Bad Request")
+        return None
+    except asyncio.LimitOverrunError:
+        raise HttpError(431, "Request Header Fields Too Large")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ")
+    except ValueError:
+        raise HttpError(400, "Bad Request")
+    if version not in ["HTTP/1.0", "HTTP/1.1"]:
+        raise HttpError(505, "HTTP Version Not Supported")
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, separator, value = line.partition(":")
+        if not separator:
+            raise HttpError(400, "Bad Request")
+        headers[name.strip().lower()] = value.strip()
+    if "transfer-encoding" in headers:
+        raise HttpError(501, "Not Implemented")
+    try:
+        content_length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HttpError(400, "Bad Request")
+    if not 0 <= content_length <= MAX_BODY_SIZE:
+        raise HttpError(413, "Content Too Large")
+    body = await reader.readexactly(content_length)
+    return method, target, version, headers, body
+
+
+def write_response(writer: asyncio.StreamWriter, version, status, reason, content=None, keep_alive=False):
+    if content is None:
+        body = b""
+        content_type = None
+    elif isinstance(content, str):
+        body = content.encode("utf-8")
+        content_type = "text/plain; charset=utf-8"
+    else:
+        body = bytes(json.dumps(content) + "\n", "utf-8")
+        content_type = "application/json; charset=utf-8"
+    lines = [f"{version} {status} {reason}"]
+    lines.extend(f"{name}: {value}" for name, value in CORS_HEADERS)
+    if content_type is not None:
+        lines.append("Content-type: " + content_type)
+    if status != 204:
+        lines.append("Content-Length: " + str(len(body)))
+    lines.append("Connection: " + ("keep-alive" if keep_alive else "close"))
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+
+
+async def stream_pdos(gateway, writer: asyncio.StreamWriter, version, target):
+    """Sends the RPDOs configured with set/rpdo as Server-Sent Events until the client disconnects
+
+    The query selects the net (default net if omitted) and a comma-separated list of PDO numbers (all if
+    omitted).  Each event has the fields of an r/p response; the current values are sent first.
+    """
+    parameters = dict(parse_qsl(urlsplit(target).query))
+    try:
+        net = parse_net(gateway, parameters.get("net", "default"))
+        nrs = None
+        if "nr" in parameters:
+            nrs = {parse_int(nr, 0x200) for nr in parameters["nr"].split(",")}
+    except (BadRequest, ValueError) as e:
+        raise HttpError(400, "Bad Request", "Bad Request: " + str(e))
+    cache = gateway.pdo_cache(net)
+
+    def write_event(nr, values):
+        data = {"net": net, "nr": nr, "nr-of-data": len(values), "value": values}
+        writer.write(("event: pdo\ndata: " + json.dumps(data) + "\n\n").encode("utf-8"))
+
+    lines = [f"{version} 200 OK"]
+    lines.extend(f"{name}: {value}" for name, value in CORS_HEADERS)
+    lines.extend(["Content-type: text/event-stream; charset=utf-8", "Cache-Control: no-cache", "Connection: close"])
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    with cache.subscribe(nrs) as queue:
+        for nr in cache:
+            current = cache.get(nr)
+            if current is not None and (nrs is None or nr in nrs):
+                write_event(nr, current[0])
+        while True:
+            await writer.drain()
+            try:
+                write_event(*await asyncio.wait_for(queue.get(), STREAM_HEARTBEAT_INTERVAL))
+            except asyncio.TimeoutError:
+                writer.write(b": heartbeat\n\n")
+
+
+async def serve_connection(gateway, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    # Requests on one connection are handled in order, so pipelined responses are sent in order
+    global connections
+    if connections >= MAX_CONNECTIONS:
+        write_response(writer, "HTTP/1.1", 503, "Service Unavailable")
+        writer.close()
+        return
+    connections += 1
+    try:
+        while True:
+            version = "HTTP/1.1"
+            try:
+                request = await asyncio.wait_for(read_request(reader), KEEP_ALIVE_TIMEOUT)
+                if request is None:
+                    break
+                method, target, version, headers, body = request
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+                if method == "GET" and urlsplit(target).path == "/cia309-5/1.0/stream":
+                    await stream_pdos(gateway, writer, version, target)
+                status, content = await handle(gateway, method, target, headers, body)
+                write_response(writer, version, status, "OK" if status == 200 else "No Content", content, keep_alive)
+            except asyncio.TimeoutError:
+                break
+            except HttpError as e:
+                keep_alive = e.status < 500 and e.status not in [413, 431] and version == "HTTP/1.1"
+                write_response(writer, version, e.status, e.reason, str(e), keep_alive)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                break
+            except Exception:
+                print("Unexpected error:", sys.exc_info()[0])
+                traceback.print_exc()
+                write_response(writer, version, 500, "Internal Server Error", "Unexpected Error")
+                keep_alive = False
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        connections -= 1
+        writer.close()
+
+
+async def main():
+    gateway = socketcanopen.Gateway([can.Bus(interface, interface="socketcan") for interface in CAN_INTERFACES])
+    for (net, node_id), filename in EDS_FILES.items():
+        gateway.load_eds(net, node_id, filename)
+    gateway.start()
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    server = await asyncio.start_server(
+        functools.partial(serve_connection, gateway),
+        HTTP_SERVER_IP_ADDRESS or None,
+        HTTP_SERVER_PORT,
+        limit=MAX_HEADER_SIZE,
+        backlog=1024
+    )
+    async with server:
+        await stop.wait()
+    gateway.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
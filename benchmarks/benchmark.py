@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""Benchmarks for the socketcanopen stack
+
+    python3 benchmarks/benchmark.py --output results.json
+    python3 benchmarks/benchmark.py --interface socketcan --channel vcan0 --only sdo
+    python3 benchmarks/benchmark.py --http-url http://localhost:8002/cia309-5/1.0/1/default/2/r/0x1000/0
+
+Metrics ending in _per_s are higher-is-better, all others lower-is-better; see compare.py.
+"""
+import argparse
+import asyncio
+import can
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # Run from a checkout
+
+from socketcanopen import *
+
+EDS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples", "node.eds")
+SERVER_ID = 0x02
+CLIENT_ID = 0x01
+
+
+def var(name, data_type, value, access_type=AccessType.RW, pdo_mapping=False):
+    return Object(parameter_name=name, object_type=ObjectType.VAR, access_type=access_type, data_type=data_type, default_value=value, pdo_mapping=pdo_mapping)
+
+
+def record(name, data_type, subs, access_type=AccessType.RW, pdo_mapping=False):
+    subobjs = {0: SubObject(parameter_name="Highest sub-index supported", access_type=AccessType.CONST, data_type=ODI_DATA_TYPE_UNSIGNED8, default_value=len(subs))}
+    for subindex, (sub_name, sub_data_type, value) in enumerate(subs, 1):
+        subobjs[subindex] = SubObject(parameter_name=sub_name, access_type=access_type, data_type=sub_data_type, default_value=value, pdo_mapping=pdo_mapping)
+    return Object(parameter_name=name, object_type=ObjectType.RECORD, data_type=data_type, sub_number=len(subs), subs=subobjs)
+
+
+def make_od(node_id, tpdos=1, rpdos=1, heartbeat_producers=0, domain_size=0):
+    od = {
+        ODI_DEVICE_TYPE: var("Device type", ODI_DATA_TYPE_UNSIGNED32, 0, AccessType.RO),
+        ODI_ERROR: var("Error register", ODI_DATA_TYPE_UNSIGNED8, 0, AccessType.RO),
+        ODI_SYNC: var("COB-ID SYNC", ODI_DATA_TYPE_UNSIGNED32, 0x80),
+        ODI_HEARTBEAT_PRODUCER_TIME: var("Producer heartbeat time", ODI_DATA_TYPE_UNSIGNED16, 0),
+        ODI_IDENTITY: record("Identity", ODI_DATA_TYPE_IDENTITY, [("Vendor-ID", ODI_DATA_TYPE_UNSIGNED32, 0)]),
+        ODI_SDO_SERVER: record("SDO server parameter", ODI_DATA_TYPE_SDO_PARAMETER, [
+            ("COB-ID client to server", ODI_DATA_TYPE_UNSIGNED32, 0x600 + node_id),
+            ("COB-ID server to client", ODI_DATA_TYPE_UNSIGNED32, 0x580 + node_id),
+        ]),
+        0x2000: var("Segmented", ODI_DATA_TYPE_VISIBLE_STRING, "socketcanopen benchmark"),
+        0x6000: record("Inputs", ODI_DATA_TYPE_UNSIGNED8, [(f"Input {i}", ODI_DATA_TYPE_UNSIGNED8, i) for i in range(1, 9)], pdo_mapping=True),
+        0x6200: record("Outputs", ODI_DATA_TYPE_UNSIGNED8, [(f"Output {i}", ODI_DATA_TYPE_UNSIGNED8, 0) for i in range(1, 9)], pdo_mapping=True),
+    }
+    if domain_size:
+        od[0x2001] = var("Block", ODI_DATA_TYPE_DOMAIN, bytes(range(256)) * (domain_size // 256))
+    if heartbeat_producers:
+        od[ODI_HEARTBEAT_CONSUMER_TIME] = record("Consumer heartbeat time", ODI_DATA_TYPE_UNSIGNED32, [
+            (f"Consumer heartbeat time {i}", ODI_DATA_TYPE_UNSIGNED32, ((0x10 + i) << 16) | 60000) for i in range(heartbeat_producers)
+        ])
+    for i in range(tpdos):
+        od[ODI_TPDO1_COMMUNICATION_PARAMETER + i] = record(f"TPDO{i + 1} communication parameter", ODI_DATA_TYPE_PDO_COMMUNICATION_PARAMETER, [
+            ("COB-ID", ODI_DATA_TYPE_UNSIGNED32, 0x40000180 + 0x100 * (i % 4) + node_id + 0x10 * (i // 4)),
+            ("Transmission type", ODI_DATA_TYPE_UNSIGNED8, 0x01),
+        ])
+        od[ODI_TPDO1_MAPPING_PARAMETER + i] = record(f"TPDO{i + 1} mapping parameter", ODI_DATA_TYPE_PDO_MAPPING_PARAMETER, [
+            (f"Mapped object {j}", ODI_DATA_TYPE_UNSIGNED32, 0x60000008 | (j << 8)) for j in range(1, 9)
+        ])
+    for i in range(rpdos):
+        od[ODI_RPDO1_COMMUNICATION_PARAMETER + i] = record(f"RPDO{i + 1} communication parameter", ODI_DATA_TYPE_PDO_COMMUNICATION_PARAMETER, [
+            ("COB-ID", ODI_DATA_TYPE_UNSIGNED32, 0x200 + 0x100 * (i % 4) + node_id),
+            ("Transmission type", ODI_DATA_TYPE_UNSIGNED8, 0xFF),
+        ])
+        od[ODI_RPDO1_MAPPING_PARAMETER + i] = record(f"RPDO{i + 1} mapping parameter", ODI_DATA_TYPE_PDO_MAPPING_PARAMETER, [
+            (f"Mapped object {j}", ODI_DATA_TYPE_UNSIGNED32, 0x62000008 | (j << 8)) for j in range(1, 9)
+        ])
+    return ObjectDictionary(od)
+
+
+def percentiles(samples, scale=1e3):
+    samples = sorted(samples)
+    return {
+        "p50": scale * samples[len(samples) // 2],
+        "p99": scale * samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+        "max": scale * samples[-1],
+    }
+
+
+class Benchmarks:
+
+    def __init__(self, args):
+        self.args = args
+
+    def bus(self):
+        return can.Bus(self.args.channel, interface=self.args.interface)
+
+    def operational_node(self, bus, node_id, od):
+        node = Node(bus, node_id, od)
+        node.nmt_state = (NMT_STATE_OPERATIONAL, bus.channel)
+        return node
+
+    def close_node(self, node):
+        node.__exit__(None, None, None)
+        node._notifier.stop() # Nodes do not stop their own Notifier; python-can allows one per bus
+
+    def bench_on_message(self):
+        n = self.args.frames
+        with self.bus() as bus:
+            node = self.operational_node(bus, SERVER_ID, make_od(SERVER_ID))
+            results = {}
+            frames = {
+                "rpdo": can.Message(arbitration_id=0x200 + SERVER_ID, data=bytes(8), is_extended_id=False, channel=bus.channel),
+                "unrelated": can.Message(arbitration_id=0x3FF, data=bytes(8), is_extended_id=False, channel=bus.channel),
+            }
+            for name, msg in frames.items():
+                start = time.perf_counter()
+                for _ in range(n):
+                    node._on_message(msg)
+                elapsed = time.perf_counter() - start
+                results[f"{name}_frames_per_s"] = n / elapsed
+                results[f"{name}_us_per_frame"] = 1e6 * elapsed / n
+            self.close_node(node)
+        return results
+
+    def bench_classify(self):
+        n = self.args.frames
+        results = {}
+        frames = {
+            "tpdo": can.Message(arbitration_id=0x180 + SERVER_ID, data=bytes(8), is_extended_id=False),
+            "sdo": can.Message(arbitration_id=0x580 + SERVER_ID, data=bytes([0x43, 0x00, 0x10, 0x00, 0x91, 0x01, 0x0F, 0x00]), is_extended_id=False),
+            "emcy": can.Message(arbitration_id=0x80 + SERVER_ID, data=bytes([0x00, 0x10, 0x01, 0, 0, 0, 0, 0]), is_extended_id=False),
+        }
+        for name, msg in frames.items():
+            for method, classify in [("factory", Message.factory), ("view", Message.view)]:
+                start = time.perf_counter()
+                for _ in range(n):
+                    classify(msg)
+                results[f"{name}_{method}_us_per_frame"] = 1e6 * (time.perf_counter() - start) / n
+        return results
+
+    def bench_sdo(self):
+        n = self.args.sdo_transfers
+        results = {}
+        with self.bus() as bus, NodeHost(bus) as host:
+            host.add_node(SERVER_ID, make_od(SERVER_ID, domain_size=self.args.block_size))
+            client = host.add_node(CLIENT_ID, make_od(CLIENT_ID, tpdos=0, rpdos=0))
+            transfers = {
+                "expedited_upload": lambda: client._sdo_upload_request(SERVER_ID, ODI_DEVICE_TYPE, 0),
+                "expedited_download": lambda: client._sdo_download_request(SERVER_ID, 0x6200, 1, b"\x01"),
+                "segmented_upload": lambda: client._sdo_upload_request(SERVER_ID, 0x2000, 0),
+                "block_upload": lambda: client._sdo_block_upload_request(SERVER_ID, 0x2001, 0),
+            }
+            for name, transfer in transfers.items():
+                if self.args.only_transfer and name not in self.args.only_transfer:
+                    continue
+                samples = []
+                size = 0
+                try:
+                    for _ in range(n):
+                        start = time.perf_counter()
+                        size = len(transfer())
+                        samples.append(time.perf_counter() - start)
+                except (SdoAbort, SdoTimeout) as e:
+                    results[f"{name}_error"] = repr(e)
+                    continue
+                elapsed = sum(samples)
+                results[f"{name}_transfers_per_s"] = n / elapsed
+                results[f"{name}_bytes_per_s"] = n * size / elapsed
+                results.update({f"{name}_latency_ms_{k}": v for k, v in percentiles(samples).items()})
+        return results
+
+    def bench_gateway_read(self):
+        # Identity object reads from a node described by the example EDS, which should be served from the cache
+        n = self.args.sdo_transfers
+        uploads = 0
+
+        def count_upload(msg):
+            nonlocal uploads
+            uploads += 1
+
+        async def read():
+            gateway.start()
+            try:
+                start = time.perf_counter()
+                for _ in range(n):
+                    await gateway.read(1, SERVER_ID, ODI_IDENTITY, ODSI_IDENTITY_VENDOR)
+                return time.perf_counter() - start
+            finally:
+                gateway.stop()
+
+        with self.bus() as bus, NodeHost(bus) as host, self.bus() as gateway_bus:
+            host.add_node(SERVER_ID, ObjectDictionary.from_eds(self.args.eds, SERVER_ID))
+            gateway = Gateway([gateway_bus])
+            gateway.load_eds(1, SERVER_ID, self.args.eds)
+            gateway.network(1).add_listener((FUNCTION_CODE_SDO_TX << FUNCTION_CODE_BITNUM) + SERVER_ID, count_upload) # One response per expedited upload
+            elapsed = asyncio.run(read())
+        results = {"identity_reads_per_s": n / elapsed, "identity_sdo_uploads": uploads}
+        if uploads != 1:
+            results["identity_error"] = f"{uploads} SDO uploads for {n} reads of a read-only object"
+        return results
+
+    def bench_tpdo_sync(self):
+        results = {}
+        with self.bus() as bus:
+            for count in self.args.tpdo_counts:
+                node = self.operational_node(bus, SERVER_ID, make_od(SERVER_ID, tpdos=count, rpdos=0))
+                samples = []
+                for _ in range(self.args.syncs):
+                    start = time.perf_counter()
+                    node._on_sync()
+                    samples.append(time.perf_counter() - start)
+                self.close_node(node)
+                results.update({f"{count}_tpdos_ms_{k}": v for k, v in percentiles(samples).items()})
+        return results
+
+    def bench_heartbeat_consumer(self):
+        results = {}
+        with self.bus() as bus:
+            for count in self.args.heartbeat_producers:
+                node = self.operational_node(bus, SERVER_ID, make_od(SERVER_ID, heartbeat_producers=count))
+                frames = [can.Message(arbitration_id=0x700 + 0x10 + i, data=[NMT_STATE_OPERATIONAL], is_extended_id=False, channel=bus.channel) for i in range(count)]
+                rounds = max(1, self.args.frames // count)
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    for msg in frames:
+                        node._on_message(msg)
+                elapsed = time.perf_counter() - start
+                self.close_node(node)
+                with node._heartbeat_consumer_timers_lock:
+                    for timer in node._heartbeat_consumer_timers.values():
+                        node._cancel_timer(timer)
+                results[f"{count}_producers_us_per_heartbeat"] = 1e6 * elapsed / (rounds * count)
+        return results
+
+    def bench_from_eds(self):
+        samples = []
+        for _ in range(self.args.eds_loads):
+            start = time.perf_counter()
+            ObjectDictionary.from_eds(self.args.eds, SERVER_ID)
+            samples.append(time.perf_counter() - start)
+        return {f"load_ms_{k}": v for k, v in percentiles(samples).items()}
+
+    def bench_http(self):
+        if self.args.http_url is None:
+            return {"skipped": "no --http-url"}
+        samples = []
+        errors = 0
+        lock = threading.Lock()
+        deadline = time.perf_counter() + self.args.http_duration
+
+        def client():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    with urllib.request.urlopen(self.args.http_url, timeout=5) as response:
+                        response.read()
+                except OSError:
+                    with lock:
+                        errors += 1
+                    continue
+                with lock:
+                    samples.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client) for _ in range(self.args.http_clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        results = {"requests_per_s": len(samples) / elapsed, "errors": errors}
+        if samples:
+            results.update({f"latency_ms_{k}": v for k, v in percentiles(samples).items()})
+        return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="socketcanopen benchmarks")
+    parser.add_argument("--interface", default="virtual", help="python-can interface, e.g. virtual or socketcan")
+    parser.add_argument("--channel", default="benchmark", help="CAN channel, e.g. vcan0")
+    parser.add_argument("--only", nargs="*", help="Run only these benchmarks")
+    parser.add_argument("--output", help="Write JSON results to this file")
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--sdo-transfers", type=int, default=100)
+    parser.add_argument("--only-transfer", nargs="*", help="Run only these SDO transfer types")
+    parser.add_argument("--block-size", type=int, default=4096, help="DOMAIN size for block upload, in bytes")
+    parser.add_argument("--tpdo-counts", type=int, nargs="*", default=[1, 4, 16, 64])
+    parser.add_argument("--syncs", type=int, default=200)
+    parser.add_argument("--heartbeat-producers", type=int, nargs="*", default=[1, 16, 127])
+    parser.add_argument("--eds", default=EDS_PATH)
+    parser.add_argument("--eds-loads", type=int, default=50)
+    parser.add_argument("--http-url", help="CiA 309-5 URL to request for the HTTP gateway benchmark")
+    parser.add_argument("--http-clients", type=int, default=8)
+    parser.add_argument("--http-duration", type=float, default=5)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    benchmarks = Benchmarks(args)
+    names = [name[len("bench_"):] for name in dir(Benchmarks) if name.startswith("bench_")]
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "python_can": can.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "interface": args.interface,
+        "channel": args.channel,
+        "results": {},
+    }
+    for name in names:
+        if args.only and name not in args.only:
+            continue
+        print(f"{name}...", file=sys.stderr, flush=True)
+        try:
+            report["results"][name] = getattr(benchmarks, "bench_" + name)()
+        except Exception as e:
+            logging.exception(f"Benchmark {name} failed")
+            report["results"][name] = {"error": repr(e)}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Compares two benchmark.py results files and exits non-zero on regressions
+
+New errors and metrics of the baseline missing from the results count as regressions, as do counters that
+rise from zero.  Benchmarks not in the results, e.g. left out with --only, are not compared.
+
+    python3 benchmarks/compare.py baseline.json results.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+
+def higher_is_better(metric):
+    return metric.endswith("_per_s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare socketcanopen benchmark results")
+    parser.add_argument("baseline")
+    parser.add_argument("results")
+    parser.add_argument("--threshold", type=float, default=10, help="Regression threshold, in percent")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.results) as f:
+        results = json.load(f)
+
+    print(f"Baseline {baseline.get('revision')} ({baseline.get('timestamp')}), results {results.get('revision')} ({results.get('timestamp')})")
+    regressions = 0
+    for benchmark, metrics in sorted(results["results"].items()):
+        baseline_metrics = baseline["results"].get(benchmark, {})
+        if "skipped" in metrics:
+            print(f"  {benchmark}: skipped, {metrics['skipped']}")
+            continue
+        for metric in sorted(set(metrics) | set(baseline_metrics)):
+            value = metrics.get(metric)
+            old = baseline_metrics.get(metric)
+            if metric == "error" or metric.endswith("_error"):
+                regressed = value is not None and old is None # A benchmark that starts failing
+                if regressed:
+                    regressions += 1
+                if value is not None:
+                    print(f"{'!' if regressed else ' '} {benchmark}.{metric}: {value}")
+                continue
+            if value is None:
+                regressions += 1 # E.g. a throughput not reported because the transfer failed
+                print(f"! {benchmark}.{metric}: {old} -> missing")
+                continue
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)):
+                continue
+            if old == 0:
+                regressed = value < 0 if higher_is_better(metric) else value > 0 # E.g. errors going from 0 to N
+                change = ""
+            else:
+                percent = 100 * (value - old) / old
+                regressed = percent < -args.threshold if higher_is_better(metric) else percent > args.threshold
+                change = f" ({percent:+.1f}%)"
+            if regressed:
+                regressions += 1
+            print(f"{'!' if regressed else ' '} {benchmark}.{metric}: {old:.4g} -> {value:.4g}{change}")
+    if regressions:
+        print(f"{regressions} regression(s), threshold {args.threshold}%")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,16 @@
 from .constants import *
+from .decoder import *
+from .error_history import *
+from .gateway import *
+from .host import *
 from .indicators import *
 from .messages import *
+from .metrics import *
 from .node import *
 from .object_dictionary import *
+from .pdo import *
+from .process_image import *
+from .recorder import *
+from .scheduler import *
+from .trace import *
+from .transmit import *
@@ -48,6 +48,7 @@ NMT_STATE_PREOPERATIONAL = 127
 EMCY_RESET = 0x0000
 EMCY_NONE = 0x0000
 EMCY_GENERIC = 0x1000
+EMCY_RPDO_TIMEOUT = 0x8250
 EMCY_HEARTBEAT_BY_NODE = 0x8F00
 
 # Object dictionary structure
@@ -140,14 +141,16 @@ ODI_SDO_CLIENT = 0x1280
 ODSI_SDO_CLIENT_TX = 0x01
 ODSI_SDO_CLIENT_RX = 0x02
 ODSI_SDO_CLIENT_NODE_ID = 0x03
-ODI_RPDO1_COMMUNICATION_PARAMTER = 0x1400
+ODI_RPDO1_COMMUNICATION_PARAMETER = 0x1400
+ODI_RPDO1_COMMUNICATION_PARAMTER = ODI_RPDO1_COMMUNICATION_PARAMETER # Deprecated misspelling
 ODSI_PDO_COMM_PARAM_ID = 0x01
 ODSI_PDO_COMM_PARAM_TYPE = 0x02
 ODSI_PDO_COMM_PARAM_INHIBIT_TIME = 0x03
 ODSI_PDO_COMM_PARAM_COMPATIBILITY_ENTRY = 0x04
 ODSI_PDO_COMM_PARAM_EVENT_TIMER = 0x05
 ODSI_PDO_COMM_PARAM_SYNC_START_VALUE = 0x06
-ODI_RPDO1_MAPPDING_PARAMETER = 0x1600
+ODI_RPDO1_MAPPING_PARAMETER = 0x1600
+ODI_RPDO1_MAPPDING_PARAMETER = ODI_RPDO1_MAPPING_PARAMETER # Deprecated misspelling
 ODI_TPDO1_COMMUNICATION_PARAMETER = 0x1800
 ODI_TPDO1_MAPPING_PARAMETER = 0x1A00
 ODI_STORE_DCF = 0x1F20
@@ -192,6 +195,8 @@ ODI_SELF_STARTING_NODES_TIMING_PARAMETERS = 0x1F91
 ODSI_SELF_STARTING_NODES_TIMING_PARAMS_TIMEOUT = 0x01
 ODSI_SELF_STARTING_NODES_TIMING_PARAMS_DELAY = 0x02
 ODSI_SELF_STARTING_NODES_TIMING_PARAMS_TIME_SLOT = 0x03
+ODI_OBJECT_SCANNER_LIST = 0x1FA0 # To 0x1FCF
+ODI_OBJECT_DISPATCHING_LIST = 0x1FD0 # To 0x1FFF
 
 # TIME
 EPOCH = datetime.datetime(1984, 1, 1, tzinfo=datetime.timezone.utc)
@@ -251,7 +256,8 @@ SDO_ABORT_RO = 0x06010002
 SDO_ABORT_OBJECT_DNE = 0x06020000
 SDO_ABORT_PARAMETER_LENGTH = 0x06070010
 SDO_ABORT_SUBINDEX_DNE = 0x06090011
-SOD_ABORT_INVALID_VALUE = 0x06090030
+SDO_ABORT_INVALID_VALUE = 0x06090030
+SOD_ABORT_INVALID_VALUE = SDO_ABORT_INVALID_VALUE # Deprecated misspelling
 SDO_ABORT_CONNECTION = 0x060A0023
 SDO_ABORT_GENERAL = 0x08000000
 SDO_ABORT_NO_DATA = 0x08000024
@@ -260,9 +266,29 @@ SDO_BLOCK_SUBCOMMAND_END = 1
 SDO_BLOCK_SUBCOMMAND_RESPONSE = 2
 SDO_BLOCK_SUBCOMMAND_START = 3
 
+# FD SDO: socketcanopen's own SDO framing for CAN FD frames on the SDO COB-IDs, with expedited and segmented
+# transfers.  It is not the CiA 1301 USDO, so it is only used between nodes that opt in: servers created with
+# Node(fd_sdo_server=True), and clients for the servers listed in Node(fd_sdo_servers=...)
+FD_SDO_CS_DOWNLOAD_EXPEDITED = 0x01 # cs, session ID, index, sub-index, size, data
+FD_SDO_CS_DOWNLOAD_INITIATE = 0x02 # cs, session ID, index, sub-index, total size (UNSIGNED32)
+FD_SDO_CS_DOWNLOAD_SEGMENT = 0x03 # cs, session ID, sequence number, size, data
+FD_SDO_CS_UPLOAD_EXPEDITED = 0x11 # Request: cs, session ID, index, sub-index; response as expedited download
+FD_SDO_CS_UPLOAD_INITIATE = 0x12 # Response to FD_SDO_CS_UPLOAD_EXPEDITED if segmented, as download initiate
+FD_SDO_CS_UPLOAD_SEGMENT = 0x13 # Request: cs, session ID, sequence number; response as download segment
+FD_SDO_CS_ABORT = 0x0F # cs, session ID, index, sub-index, abort code (UNSIGNED32)
+FD_SDO_CS_RESPONSE = 0x80 # Set in responses, and echoed with the session ID and sequence number
+FD_SDO_CS_LAST_SEGMENT = 0x40 # Set in the last segment
+FD_SDO_HEADER_FORMAT = "<BBHB"
+FD_SDO_SEGMENT_HEADER_FORMAT = "<BBBB"
+FD_SDO_MAX_EXPEDITED_SIZE = 58
+FD_SDO_MAX_SEGMENT_SIZE = 60
+
 # PDO
 TPDO_COMM_PARAM_ID_VALID_BITNUM = 31
 TPDO_COMM_PARAM_ID_RTR_BITNUM = 30
+PDO_MAPPING_DAM_MPDO = 0xFE # Number of mapped objects (sub-index 0) of a destination address mode MPDO
+PDO_MAPPING_SAM_MPDO = 0xFF # Source address mode
+MPDO_ADDRESS_TYPE_BITNUM = 7 # In the first data byte, set for destination address mode
 
 # NMT
 NMT_ERROR_STATUS = {
@@ -0,0 +1,312 @@
+from array import array
+from collections import namedtuple
+import can
+import datetime
+import struct
+
+from .constants import *
+from .messages import *
+from .object_dictionary import *
+from .recorder import MAGIC, RecordReader
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NmtEvent = namedtuple("NmtEvent", ["timestamp", "channel", "message"]) # message is from Message.factory(), e.g. NmtNodeControlMessage
+SyncEvent = namedtuple("SyncEvent", ["timestamp", "channel", "counter"])
+TimeEvent = namedtuple("TimeEvent", ["timestamp", "channel", "time"])
+EmcyEvent = namedtuple("EmcyEvent", ["timestamp", "channel", "node_id", "eec", "er", "msef"])
+HeartbeatEvent = namedtuple("HeartbeatEvent", ["timestamp", "channel", "node_id", "state"])
+SdoEvent = namedtuple("SdoEvent", ["timestamp", "channel", "node_id", "index", "subindex", "upload", "value"])
+SdoAbortEvent = namedtuple("SdoAbortEvent", ["timestamp", "channel", "node_id", "index", "subindex", "code"])
+PdoEvent = namedtuple("PdoEvent", ["timestamp", "channel", "cob_id", "node_id", "signals"])
+UnknownEvent = namedtuple("UnknownEvent", ["timestamp", "channel", "message"])
+
+
+class _SdoTransfer:
+    __slots__ = ["index", "subindex", "upload", "block", "data", "expedited", "complete", "segments"]
+
+    def __init__(self, index, subindex, upload, block=False):
+        self.index = index
+        self.subindex = subindex
+        self.upload = upload
+        self.block = block
+        self.data = bytearray()
+        self.expedited = False
+        self.complete = False # Last segment seen, waiting for confirmation
+        self.segments = None # Frames of the sub-block in progress
+
+
+class Decoder:
+    """Decodes captured CAN frames into CANopen events, using the object dictionaries of the nodes:
+
+            decoder = Decoder.from_eds({0x02: "drive.eds", 0x03: "io.eds"})
+            for event in decoder.decode(read_log("capture.log")):
+                if isinstance(event, PdoEvent):
+                    print(event.timestamp, event.signals)
+
+    Events are yielded as frames are consumed and only SDO transfers in progress are buffered, so logs of
+    any size are decoded in constant memory.  SDO transfers (expedited, segmented and block) are yielded
+    once confirmed by the server, with values typed by the server's object dictionary.  Confirmed writes to
+    PDO communication or mapping parameters are applied to the object dictionaries so later PDOs are
+    decoded with the new configuration.
+    """
+
+    def __init__(self, ods):
+        self.ods = ods
+        self._transfers = {}
+        self._pdos = None
+        self._sdos = None
+
+    @classmethod
+    def from_eds(cls, filenames):
+        return cls({node_id: ObjectDictionary.from_eds(filename, node_id) for node_id, filename in filenames.items()})
+
+    def invalidate(self):
+        # Call after changing an object dictionary in ods
+        self._pdos = None
+        self._sdos = None
+
+    def _build_cob_ids(self):
+        self._pdos = {} # COB-ID: (producer node-ID or None, [(name, subobj, offset, size), ...])
+        self._sdos = {} # COB-ID: (server node-ID, True if client to server)
+        for node_id in range(1, 0x80):
+            self._sdos[(FUNCTION_CODE_SDO_RX << FUNCTION_CODE_BITNUM) + node_id] = (node_id, True)
+            self._sdos[(FUNCTION_CODE_SDO_TX << FUNCTION_CODE_BITNUM) + node_id] = (node_id, False)
+        for node_id, od in self.ods.items():
+            sdo_server = od.get(ODI_SDO_SERVER)
+            if sdo_server is not None:
+                for odsi, request in [(ODSI_SDO_SERVER_DEFAULT_CSID, True), (ODSI_SDO_SERVER_DEFAULT_SCID, False)]:
+                    subobj = sdo_server.get(odsi)
+                    if subobj is not None and subobj.value is not None:
+                        self._sdos[subobj.value & 0x3FFFFFFF] = (node_id, request)
+            for comm_base, map_base, tpdo in [(ODI_RPDO1_COMMUNICATION_PARAMETER, ODI_RPDO1_MAPPING_PARAMETER, False), (ODI_TPDO1_COMMUNICATION_PARAMETER, ODI_TPDO1_MAPPING_PARAMETER, True)]:
+                for i in range(0x200):
+                    comm_obj = od.get(comm_base + i)
+                    map_obj = od.get(map_base + i)
+                    if comm_obj is None or map_obj is None or comm_obj.get(ODSI_PDO_COMM_PARAM_ID) is None:
+                        continue
+                    cob_id = comm_obj.get(ODSI_PDO_COMM_PARAM_ID).value
+                    if cob_id is None or cob_id & 0x80000000:
+                        continue
+                    signals = self._pdo_signals(od, map_obj)
+                    if signals is None:
+                        continue
+                    cob_id &= 0x3FFFFFFF
+                    if tpdo:
+                        self._pdos[cob_id] = (node_id, signals)
+                    else:
+                        self._pdos.setdefault(cob_id, (None, signals))
+
+    @staticmethod
+    def _pdo_signals(od, map_obj):
+        signals = []
+        offset = 0
+        count = map_obj.get(ODSI_VALUE)
+        if count is None or not count.value:
+            return None
+        for odsi in range(1, count.value + 1):
+            subobj = map_obj.get(odsi)
+            if subobj is None or subobj.value is None:
+                return None
+            mapped_index, mapped_subindex, length = subobj.value >> 16, (subobj.value >> 8) & 0xFF, subobj.value & 0xFF
+            if length % 8:
+                return None # Bit-wise mapping is not supported
+            mapped_obj = od.get(mapped_index)
+            mapped_subobj = None if mapped_obj is None else mapped_obj.get(mapped_subindex)
+            if mapped_subobj is not None and mapped_index >= 0x1000: # Indices below 0x1000 are dummy entries
+                name = mapped_obj.parameter_name if mapped_subindex == ODSI_VALUE else f"{mapped_obj.parameter_name}.{mapped_subobj.parameter_name}"
+                signals.append((name, mapped_subobj, offset, length // 8))
+            offset += length // 8
+        return signals
+
+    def _sdo_event(self, msg, node_id, transfer, data):
+        data = bytes(data)
+        value = data
+        od = self.ods.get(node_id)
+        obj = None if od is None else od.get(transfer.index)
+        subobj = None if obj is None else obj.get(transfer.subindex)
+        if subobj is not None:
+            try:
+                value = subobj.from_bytes(data)
+            except (struct.error, IndexError, UnicodeDecodeError):
+                pass
+            if not transfer.upload and ODI_RPDO1_COMMUNICATION_PARAMETER <= transfer.index < ODI_TPDO1_MAPPING_PARAMETER + 0x200 and not isinstance(value, bytes):
+                subobj.value = value
+                self._pdos = None
+        return SdoEvent(msg.timestamp, msg.channel, node_id, transfer.index, transfer.subindex, transfer.upload, value)
+
+    @staticmethod
+    def _acknowledge(transfer, ackseq):
+        # Keeps segments up to ackseq; the client or server repeats the rest in the next sub-block
+        for segment in transfer.segments[:ackseq]:
+            transfer.data += segment[1:8]
+            if segment[0] & SDO_BLOCK_C_MASK:
+                transfer.complete = True
+        transfer.segments = None if transfer.complete else []
+
+    def _decode_sdo(self, msg, node_id, request):
+        key = (msg.channel, node_id)
+        data = msg.data
+        transfer = self._transfers.get(key)
+        if transfer is not None and transfer.segments is not None and request != transfer.upload and len(data) and data[0] & SDO_BLOCK_SEQNO_MASK:
+            transfer.segments.append(bytes(data))
+            return None
+        if len(data) < 8:
+            return None
+        cs = data[0] >> SDO_CS_BITNUM
+        index, subindex = struct.unpack_from("<HB", data, 1)
+        if cs == SDO_CS_ABORT:
+            self._transfers.pop(key, None)
+            return SdoAbortEvent(msg.timestamp, msg.channel, node_id, index, subindex, int.from_bytes(data[4:8], byteorder="little"))
+        if request:
+            if cs == SDO_CCS_DOWNLOAD_INITIATE:
+                transfer = self._transfers[key] = _SdoTransfer(index, subindex, False)
+                if data[0] & SDO_E_MASK:
+                    n = (data[0] & SDO_INITIATE_N_MASK) >> SDO_INITIATE_N_BITNUM if data[0] & SDO_S_MASK else 0
+                    transfer.data += data[4:8 - n]
+                    transfer.expedited = True
+            elif cs == SDO_CCS_DOWNLOAD_SEGMENT and transfer is not None and not transfer.upload:
+                n = (data[0] & SDO_SEGMENT_N_MASK) >> SDO_SEGMENT_N_BITNUM
+                transfer.data += data[1:8 - n]
+                transfer.complete = bool(data[0] & SDO_C_MASK)
+            elif cs == SDO_CCS_UPLOAD_INITIATE:
+                self._transfers[key] = _SdoTransfer(index, subindex, True)
+            elif cs == SDO_CCS_BLOCK_DOWNLOAD:
+                if data[0] & SDO_BLOCK_SS_MASK == SDO_BLOCK_SUBCOMMAND_INITIATE:
+                    self._transfers[key] = _SdoTransfer(index, subindex, False, True)
+                elif transfer is not None and transfer.block and not transfer.upload: # End
+                    n = (data[0] & SDO_BLOCK_N_MASK) >> SDO_BLOCK_N_BITNUM
+                    del transfer.data[len(transfer.data) - n:]
+            elif cs == SDO_CCS_BLOCK_UPLOAD:
+                subcommand = data[0] & SDO_BLOCK_CS_MASK
+                if subcommand == SDO_BLOCK_SUBCOMMAND_INITIATE:
+                    self._transfers[key] = _SdoTransfer(index, subindex, True, True)
+                elif transfer is not None and transfer.block and transfer.upload:
+                    if subcommand == SDO_BLOCK_SUBCOMMAND_START:
+                        transfer.segments = []
+                    elif subcommand == SDO_BLOCK_SUBCOMMAND_RESPONSE and transfer.segments is not None:
+                        self._acknowledge(transfer, data[1])
+            return None
+        if transfer is None:
+            return None
+        if cs == SDO_SCS_DOWNLOAD_INITIATE and not transfer.upload and not transfer.block:
+            if transfer.expedited:
+                del self._transfers[key]
+                return self._sdo_event(msg, node_id, transfer, transfer.data)
+        elif cs == SDO_SCS_DOWNLOAD_SEGMENT and not transfer.upload:
+            if transfer.complete:
+                del self._transfers[key]
+                return self._sdo_event(msg, node_id, transfer, transfer.data)
+        elif cs == SDO_SCS_UPLOAD_INITIATE and transfer.upload: # Also a server switching from block to segmented upload
+            transfer.block = False
+            if data[0] & SDO_E_MASK:
+                n = (data[0] & SDO_INITIATE_N_MASK) >> SDO_INITIATE_N_BITNUM if data[0] & SDO_S_MASK else 0
+                del self._transfers[key]
+                return self._sdo_event(msg, node_id, transfer, data[4:8 - n])
+        elif cs == SDO_SCS_UPLOAD_SEGMENT and transfer.upload:
+            n = (data[0] & SDO_SEGMENT_N_MASK) >> SDO_SEGMENT_N_BITNUM
+            transfer.data += data[1:8 - n]
+            if data[0] & SDO_C_MASK:
+                del self._transfers[key]
+                return self._sdo_event(msg, node_id, transfer, transfer.data)
+        elif cs == SDO_SCS_BLOCK_DOWNLOAD and transfer.block and not transfer.upload:
+            subcommand = data[0] & SDO_BLOCK_CS_MASK
+            if subcommand == SDO_BLOCK_SUBCOMMAND_INITIATE:
+                transfer.segments = []
+            elif subcommand == SDO_BLOCK_SUBCOMMAND_RESPONSE and transfer.segments is not None:
+                self._acknowledge(transfer, data[1])
+            elif subcommand == SDO_BLOCK_SUBCOMMAND_END:
+                del self._transfers[key]
+                return self._sdo_event(msg, node_id, transfer, transfer.data)
+        elif cs == SDO_SCS_BLOCK_UPLOAD and transfer.block and transfer.upload:
+            if data[0] & SDO_BLOCK_SS_MASK == SDO_BLOCK_SUBCOMMAND_END:
+                n = (data[0] & SDO_BLOCK_N_MASK) >> SDO_BLOCK_N_BITNUM
+                del self._transfers[key]
+                return self._sdo_event(msg, node_id, transfer, transfer.data[:len(transfer.data) - n])
+        return None
+
+    def _decode_pdo(self, msg, cob_id):
+        node_id, signals = self._pdos[cob_id]
+        data = msg.data
+        values = {}
+        for name, subobj, offset, size in signals:
+            if offset + size <= len(data):
+                values[name] = subobj.from_bytes(bytes(data[offset:offset + size]))
+        return PdoEvent(msg.timestamp, msg.channel, cob_id, node_id, values)
+
+    def feed(self, msg: can.Message):
+        # Returns the event for msg, or None if msg is part of an SDO transfer in progress
+        if msg.is_error_frame or msg.is_remote_frame:
+            return UnknownEvent(msg.timestamp, msg.channel, msg)
+        if self._pdos is None or self._sdos is None:
+            self._build_cob_ids()
+        cob_id = msg.arbitration_id | (0x20000000 if msg.is_extended_id else 0)
+        if cob_id in self._pdos:
+            return self._decode_pdo(msg, cob_id)
+        if cob_id in self._sdos:
+            return self._decode_sdo(msg, *self._sdos[cob_id])
+        if not msg.is_extended_id:
+            fc = (cob_id & FUNCTION_CODE_MASK) >> FUNCTION_CODE_BITNUM
+            node_id = cob_id & 0x7F
+            data = msg.data
+            if fc == FUNCTION_CODE_NMT:
+                try:
+                    return NmtEvent(msg.timestamp, msg.channel, Message.factory(msg))
+                except (NotImplementedError, struct.error):
+                    pass
+            elif fc == FUNCTION_CODE_SYNC and node_id == 0:
+                return SyncEvent(msg.timestamp, msg.channel, data[0] if len(data) else None)
+            elif fc == FUNCTION_CODE_EMCY and len(data) == 8:
+                eec, er = struct.unpack_from("<HB", data)
+                return EmcyEvent(msg.timestamp, msg.channel, node_id, eec, er, int.from_bytes(data[3:8], byteorder="little"))
+            elif fc == FUNCTION_CODE_TIME_STAMP and node_id == 0 and len(data) == 6:
+                ms, d = struct.unpack("<IH", data)
+                return TimeEvent(msg.timestamp, msg.channel, EPOCH + datetime.timedelta(days=d, milliseconds=ms & 0x0FFFFFFF))
+            elif fc == FUNCTION_CODE_NMT_ERROR_CONTROL and node_id and len(data) == 1:
+                return HeartbeatEvent(msg.timestamp, msg.channel, node_id, data[0] & 0x7F)
+        return UnknownEvent(msg.timestamp, msg.channel, msg)
+
+    def decode(self, messages):
+        for msg in messages:
+            event = self.feed(msg)
+            if event is not None:
+                yield event
+
+
+def read_log(filename):
+    """Yields can.Message from a Recorder file, or any log format can.LogReader supports (.asc, .blf, .log, ...)"""
+    with open(filename, "rb") as f:
+        recording = f.read(len(MAGIC)) == MAGIC
+    if recording:
+        with RecordReader(filename) as reader:
+            yield from reader
+    else:
+        yield from can.LogReader(filename)
+
+
+def pdo_columns(events, names=None):
+    """Collects PDO signals into {(node_id, name): (timestamps, values)}, as NumPy arrays if NumPy is installed
+
+    Signals of PDOs without a producer node (RPDOs not sent by a decoded node) are keyed by (cob_id, name).
+    names filters on the same keys.
+    """
+    columns = {}
+    for event in events:
+        if not isinstance(event, PdoEvent):
+            continue
+        source = event.cob_id if event.node_id is None else event.node_id
+        for name, value in event.signals.items():
+            key = (source, name)
+            if names is not None and key not in names:
+                continue
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = (array("d"), array("d") if isinstance(value, float) else [])
+            column[0].append(event.timestamp)
+            column[1].append(value)
+    if numpy is None:
+        return columns
+    return {key: (numpy.asarray(timestamps), numpy.asarray(values)) for key, (timestamps, values) in columns.items()}
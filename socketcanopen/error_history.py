@@ -0,0 +1,85 @@
+from contextlib import contextmanager
+import struct
+import threading
+
+from .constants import *
+from .object_dictionary import *
+
+ERROR_HISTORY_ENTRY_SIZE = 4 # UNSIGNED32: error code, then manufacturer-specific additional information
+
+
+class ErrorHistory:
+    """Fixed-size ring buffer backing the pre-defined error field (0x1003):
+
+            history = ErrorHistory(od.get(ODI_PREDEFINED_ERROR_FIELD))
+            history.push(eec, msef)
+            history.errors()    # Newest first
+
+    Sub-indices 1 to capacity are bound to the buffer like ProcessImage entries, at offsets relative to the
+    newest entry, so sub-index 1 is always the newest error.  Pushing an error writes one entry and moves
+    the head instead of shifting the others, and an SDO upload of a sub-index reads its four bytes from the
+    buffer.  Sub-index 0 holds the number of errors; the capacity is the number of consecutive sub-indices
+    from 1 in the object.
+    """
+
+    def __init__(self, obj):
+        self._count_subobj = obj.get(ODSI_VALUE)
+        self.capacity = 0
+        while self.capacity < 0xFE and obj.get(self.capacity + 1) is not None:
+            self.capacity += 1
+        self.count = 0
+        self._buffer = bytearray(self.capacity * ERROR_HISTORY_ENTRY_SIZE)
+        self._head = 0 # Slot of the next entry
+        self._lock = threading.RLock()
+        for odsi in range(1, self.capacity + 1):
+            obj.get(odsi).bind(self, (odsi - 1) * ERROR_HISTORY_ENTRY_SIZE)
+        self.clear()
+
+    def _position(self, offset):
+        # Buffer position of byte offset, relative to the newest entry
+        slot = (self._head - 1 - offset // ERROR_HISTORY_ENTRY_SIZE) % self.capacity
+        return slot * ERROR_HISTORY_ENTRY_SIZE + offset % ERROR_HISTORY_ENTRY_SIZE
+
+    def read(self, offset, size):
+        with self._lock:
+            if size == ERROR_HISTORY_ENTRY_SIZE and offset % ERROR_HISTORY_ENTRY_SIZE == 0:
+                position = self._position(offset)
+                return bytes(self._buffer[position:position + ERROR_HISTORY_ENTRY_SIZE])
+            return bytes(self._buffer[self._position(i)] for i in range(offset, offset + size))
+
+    def write(self, offset, data):
+        with self._lock:
+            for i, b in enumerate(data):
+                self._buffer[self._position(offset + i)] = b
+
+    def consistent(self, function):
+        with self._lock:
+            return function()
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            yield self
+
+    def push(self, eec, msef=0):
+        if self.capacity == 0:
+            return
+        with self._lock:
+            struct.pack_into("<HH", self._buffer, self._head * ERROR_HISTORY_ENTRY_SIZE, eec, msef & 0xFFFF)
+            self._head = (self._head + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+            if self._count_subobj is not None:
+                self._count_subobj.value = self.count
+
+    def clear(self):
+        with self._lock:
+            self._buffer[:] = bytes(len(self._buffer))
+            self._head = 0
+            self.count = 0
+            if self._count_subobj is not None:
+                self._count_subobj.value = 0
+
+    def errors(self):
+        # Sub-indices 1 to count as UNSIGNED32 values, newest first
+        with self._lock:
+            return [struct.unpack_from("<I", self._buffer, self._position(i * ERROR_HISTORY_ENTRY_SIZE))[0] for i in range(self.count)]
@@ -0,0 +1,639 @@
+import asyncio
+import base64
+from binascii import crc_hqx
+import can
+from contextlib import contextmanager
+import datetime
+import functools
+import struct
+
+from .constants import *
+from .messages import *
+from .node import *
+from .object_dictionary import *
+
+# CiA 309 data type names
+DATA_TYPE_NAMES = {
+    "b": ODI_DATA_TYPE_BOOLEAN,
+    "i8": ODI_DATA_TYPE_INTEGER8,
+    "i16": ODI_DATA_TYPE_INTEGER16,
+    "i24": ODI_DATA_TYPE_INTEGER24,
+    "i32": ODI_DATA_TYPE_INTEGER32,
+    "i40": ODI_DATA_TYPE_INTEGER40,
+    "i48": ODI_DATA_TYPE_INTEGER48,
+    "i56": ODI_DATA_TYPE_INTEGER56,
+    "i64": ODI_DATA_TYPE_INTEGER64,
+    "u8": ODI_DATA_TYPE_UNSIGNED8,
+    "u16": ODI_DATA_TYPE_UNSIGNED16,
+    "u24": ODI_DATA_TYPE_UNSIGNED24,
+    "u32": ODI_DATA_TYPE_UNSIGNED32,
+    "u40": ODI_DATA_TYPE_UNSIGNED40,
+    "u48": ODI_DATA_TYPE_UNSIGNED48,
+    "u56": ODI_DATA_TYPE_UNSIGNED56,
+    "u64": ODI_DATA_TYPE_UNSIGNED64,
+    "r32": ODI_DATA_TYPE_REAL32,
+    "r64": ODI_DATA_TYPE_REAL64,
+    "t": ODI_DATA_TYPE_TIME_OF_DAY,
+    "td": ODI_DATA_TYPE_TIME_DIFFERENCE,
+    "vs": ODI_DATA_TYPE_VISIBLE_STRING,
+    "os": ODI_DATA_TYPE_OCTET_STRING,
+    "us": ODI_DATA_TYPE_UNICODE_STRING,
+    "d": ODI_DATA_TYPE_DOMAIN,
+}
+DATA_TYPE_NAMES_BY_INDEX = {data_type: name for name, data_type in DATA_TYPE_NAMES.items()}
+
+SDO_BLOCK_THRESHOLD = 64 # Bytes; larger downloads, and uploads of objects without fixed size, use block transfer
+SDO_BLOCK_SIZE = 0x7F # Segments per block requested by the gateway
+SDO_CACHE_TTLS = { # Seconds SDO reads are cached by access type, None until the node boots or is reset
+    AccessType.CONST: None,
+    AccessType.RO: 60,
+}
+PDO_QUEUE_SIZE = 256 # Updates held per PDO subscriber; the oldest are dropped for slow subscribers
+
+_CODECS = {data_type: SubObject(parameter_name=None, access_type=AccessType.RW, data_type=data_type) for data_type in DATA_TYPE_NAMES.values()}
+
+
+def data_type_name(data_type, size=None):
+    """CiA 309 name of data_type, or of unsigned data of size bytes if data_type is None"""
+    if data_type is None:
+        return "u" + str(8 * size) if size is not None and 0 < size <= 8 else "d"
+    return DATA_TYPE_NAMES_BY_INDEX.get(data_type, "d")
+
+
+def format_value(data_type, data):
+    """Text representation of uploaded data, as used in CiA 309 responses
+
+    Unsigned integers are hexadecimal, octet strings are hexadecimal digits, domains are Base64, times of day
+    are ISO 8601 and time differences are milliseconds.  Without data type, data of up to 8 bytes is formatted
+    as an unsigned integer and longer data as a domain.
+    """
+    data = bytes(data)
+    if data_type is None:
+        data_type = DATA_TYPE_NAMES.get(data_type_name(None, len(data)))
+    if data_type == ODI_DATA_TYPE_DOMAIN or data_type not in _CODECS:
+        return base64.b64encode(data).decode("ascii")
+    if data_type == ODI_DATA_TYPE_OCTET_STRING:
+        return data.hex()
+    size = DATA_TYPE_SIZES.get(data_type)
+    if size is not None and len(data) != size:
+        raise ValueError(f"{len(data)} bytes of data for data type {data_type_name(data_type)}")
+    value = _CODECS[data_type].from_bytes(data)
+    if data_type == ODI_DATA_TYPE_BOOLEAN:
+        return str(int(value))
+    if data_type_name(data_type)[0] == "u":
+        return "0x{:0{}X}".format(value, 2 * size)
+    if data_type == ODI_DATA_TYPE_TIME_OF_DAY:
+        return value.isoformat()
+    if data_type == ODI_DATA_TYPE_TIME_DIFFERENCE:
+        return str(value // datetime.timedelta(milliseconds=1))
+    return str(value)
+
+
+def parse_value(data_type, text):
+    """Data to download for the text representation of a value, see format_value(); raises ValueError if invalid"""
+    try:
+        if data_type == ODI_DATA_TYPE_BOOLEAN:
+            if text.lower() not in ["0", "1", "false", "true"]:
+                raise ValueError(f"invalid value: {text}")
+            return bytes([text.lower() in ["1", "true"]])
+        if data_type in [ODI_DATA_TYPE_REAL32, ODI_DATA_TYPE_REAL64]:
+            return _CODECS[data_type].to_bytes(float(text))
+        if data_type in [ODI_DATA_TYPE_VISIBLE_STRING, ODI_DATA_TYPE_UNICODE_STRING]:
+            return _CODECS[data_type].to_bytes(text)
+        if data_type == ODI_DATA_TYPE_OCTET_STRING:
+            return bytes.fromhex(text)
+        if data_type == ODI_DATA_TYPE_DOMAIN:
+            return base64.b64decode(text, validate=True)
+        if data_type == ODI_DATA_TYPE_TIME_OF_DAY:
+            value = datetime.datetime.fromisoformat(text)
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=datetime.timezone.utc)
+            if value < EPOCH:
+                raise ValueError(f"invalid value: {text}")
+            return _CODECS[data_type].to_bytes(value)
+        if data_type == ODI_DATA_TYPE_TIME_DIFFERENCE:
+            return _CODECS[data_type].to_bytes(datetime.timedelta(milliseconds=int(text, 0)))
+        if data_type in _CODECS:
+            return _CODECS[data_type].to_bytes(int(text, 0))
+    except (OverflowError, UnicodeError, struct.error) as e:
+        raise ValueError(f"invalid value: {text}") from e
+    raise ValueError(f"unsupported data type: {data_type}")
+
+
+class GatewayNetwork:
+    """One CAN interface of a gateway, read by a single receive loop shared by all pending requests:
+
+            network = GatewayNetwork(can.Bus("vcan0", interface="socketcan"))
+            network.start()    # From within the running event loop
+            data = await network.sdo_upload(node_id, index, subindex, timeout)
+
+    Received frames are dispatched by CAN-ID to the futures of the requests waiting for them, so any number of
+    requests can wait concurrently on one thread without a socket each.  Frames nobody waits for are dropped.
+    SDO transfers to the same node are serialized, since an SDO server handles one transfer at a time.
+    """
+
+    def __init__(self, bus: can.BusABC):
+        self.bus = bus
+        self._notifier = None
+        self._waiters = {} # CAN-ID: list of [match, future]
+        self._subscriptions = {} # CAN-ID: list of asyncio.Queue
+        self._listeners = {} # CAN-ID: list of functions called with each frame
+        self._sdo_locks = {} # Node-ID: asyncio.Lock
+
+    def start(self):
+        self._notifier = can.Notifier(self.bus, [self._on_message], loop=asyncio.get_running_loop())
+
+    def stop(self):
+        if self._notifier is not None:
+            self._notifier.stop()
+            self._notifier = None
+        for waiters in self._waiters.values():
+            for _, future in waiters:
+                future.cancel()
+        self._waiters.clear()
+
+    def _on_message(self, msg: can.Message):
+        # Called on the event loop thread by the notifier
+        if msg.is_error_frame or msg.is_remote_frame:
+            return
+        for listener in self._listeners.get(msg.arbitration_id, []):
+            listener(msg)
+        queues = self._subscriptions.get(msg.arbitration_id)
+        if queues is not None:
+            for queue in queues:
+                queue.put_nowait(msg)
+        waiters = self._waiters.get(msg.arbitration_id)
+        if waiters is None:
+            return
+        for waiter in list(waiters):
+            match, future = waiter
+            if not future.done() and (match is None or match(msg)):
+                future.set_result(msg)
+                waiters.remove(waiter)
+        if not waiters:
+            del self._waiters[msg.arbitration_id]
+
+    def send(self, msg: can.Message):
+        self.bus.send(msg)
+
+    async def request(self, msg: can.Message, can_id, match=None, timeout=None):
+        """Sends msg, if not None, and returns the next frame with can_id for which match(frame) is true
+
+        Raises asyncio.TimeoutError if no such frame is received within timeout seconds.
+        """
+        waiter = [match, asyncio.get_running_loop().create_future()]
+        self._waiters.setdefault(can_id, []).append(waiter)
+        try:
+            if msg is not None:
+                self.send(msg)
+            return await asyncio.wait_for(waiter[1], timeout)
+        finally:
+            waiters = self._waiters.get(can_id)
+            if waiters is not None and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._waiters[can_id]
+
+    @contextmanager
+    def subscribe(self, can_id):
+        """Queues every frame with can_id received while in the context, for exchanges of several frames"""
+        queue = asyncio.Queue()
+        self._subscriptions.setdefault(can_id, []).append(queue)
+        try:
+            yield queue
+        finally:
+            queues = self._subscriptions[can_id]
+            queues.remove(queue)
+            if not queues:
+                del self._subscriptions[can_id]
+
+    def add_listener(self, can_id, listener):
+        # listener(frame) is called on the event loop thread for every frame with can_id, and should return quickly
+        self._listeners.setdefault(can_id, []).append(listener)
+
+    def remove_listener(self, can_id, listener):
+        listeners = self._listeners.get(can_id, [])
+        if listener in listeners:
+            listeners.remove(listener)
+            if not listeners:
+                del self._listeners[can_id]
+
+    def nmt(self, cs, node_id):
+        # node_id 0 addresses all nodes
+        self.send(NmtNodeControlMessage(cs, node_id))
+
+    def sdo_lock(self, node_id):
+        lock = self._sdo_locks.get(node_id)
+        if lock is None:
+            lock = self._sdo_locks[node_id] = asyncio.Lock()
+        return lock
+
+    def _sdo_responses(self, node_id):
+        return self.subscribe((FUNCTION_CODE_SDO_TX << FUNCTION_CODE_BITNUM) + node_id)
+
+    def _sdo_error(self, node_id, index, subindex, code):
+        # Aborts the transfer and returns the exception to raise
+        self.send(SdoRequest(node_id, SDO_CS_ABORT << SDO_CS_BITNUM, struct.pack("<HBI", index, subindex, code)))
+        return SdoAbort(index, subindex, code)
+
+    async def _sdo_response(self, responses, node_id, request: SdoRequest, index, subindex, timeout, segment=False):
+        # Sends request, if not None, and returns a view of the server's next response; block segments have no command specifier
+        if request is not None:
+            self.send(request)
+        while True:
+            try:
+                response = await asyncio.wait_for(responses.get(), timeout)
+            except asyncio.TimeoutError:
+                self._sdo_error(node_id, index, subindex, SDO_ABORT_TIMEOUT)
+                raise SdoTimeout(index, subindex)
+            if len(response.data) == 8:
+                break
+        view = SdoResponseView(response)
+        if view.cs == SDO_CS_ABORT and not segment:
+            raise SdoAbort(view.index, view.subindex, view.abort_code)
+        return view
+
+    async def sdo_upload(self, node_id, index, subindex, timeout, block=False, size=None):
+        """Uploads a value of any size and returns it as bytes
+
+        With block, block transfer is requested, and the server may switch to an expedited or segmented one.
+        If the server does not support block transfer, the upload is retried without.  size, if known, is used
+        for expedited responses that do not indicate it.
+        """
+        async with self.sdo_lock(node_id):
+            if block:
+                try:
+                    with self._sdo_responses(node_id) as responses:
+                        return await self._sdo_block_upload(responses, node_id, index, subindex, timeout, size)
+                except SdoTimeout:
+                    raise
+                except SdoAbort as e:
+                    if e.code != SDO_ABORT_INVALID_CS:
+                        raise
+            with self._sdo_responses(node_id) as responses:
+                view = await self._sdo_response(responses, node_id, SdoUploadInitiateRequest(node_id, index, subindex), index, subindex, timeout)
+                return await self._sdo_segmented_upload(responses, view, node_id, index, subindex, timeout, size)
+
+    async def _sdo_segmented_upload(self, responses, view, node_id, index, subindex, timeout, size=None):
+        # Continues an upload from the server's initiate response
+        if view.cs != SDO_SCS_UPLOAD_INITIATE or view.index != index or view.subindex != subindex:
+            raise self._sdo_error(node_id, index, subindex, SDO_ABORT_INVALID_CS)
+        if view.header & SDO_E_MASK:
+            if view.header & SDO_S_MASK:
+                return bytes(view.data[4:8 - ((view.header & SDO_INITIATE_N_MASK) >> SDO_INITIATE_N_BITNUM)])
+            return bytes(view.data[4:4 + min(size or 4, 4)])
+        size = int.from_bytes(view.data[4:8], byteorder="little") if view.header & SDO_S_MASK else None
+        data = bytearray()
+        toggle = 0
+        while True:
+            view = await self._sdo_response(responses, node_id, SdoUploadSegmentRequest(node_id, toggle), index, subindex, timeout)
+            if view.cs != SDO_SCS_UPLOAD_SEGMENT:
+                raise self._sdo_error(node_id, index, subindex, SDO_ABORT_INVALID_CS)
+            if (view.header & SDO_T_MASK) >> SDO_T_BITNUM != toggle:
+                raise self._sdo_error(node_id, index, subindex, SDO_ABORT_TOGGLE)
+            n = (view.header & SDO_SEGMENT_N_MASK) >> SDO_SEGMENT_N_BITNUM
+            data += view.data[1:8 - n]
+            if view.header & SDO_C_MASK:
+                break
+            toggle ^= 1
+        if size is not None and len(data) != size:
+            raise SdoAbort(index, subindex, SDO_ABORT_PARAMETER_LENGTH)
+        return bytes(data)
+
+    async def _sdo_block_upload(self, responses, node_id, index, subindex, timeout, size=None):
+        request = SdoBlockUploadInitiateRequest(node_id, index, subindex, blk_size=SDO_BLOCK_SIZE)
+        view = await self._sdo_response(responses, node_id, request, index, subindex, timeout)
+        if view.cs == SDO_SCS_UPLOAD_INITIATE: # Protocol switch
+            return await self._sdo_segmented_upload(responses, view, node_id, index, subindex, timeout, size)
+        if view.cs != SDO_SCS_BLOCK_UPLOAD or (view.header & SDO_BLOCK_SS_MASK) >> SDO_BLOCK_SS_BITNUM != SDO_BLOCK_SUBCOMMAND_INITIATE:
+            raise self._sdo_error(node_id, index, subindex, SDO_ABORT_INVALID_CS)
+        crc = bool(view.header & SDO_BLOCK_SC_MASK)
+        size = int.from_bytes(view.data[4:8], byteorder="little") if view.header & SDO_BLOCK_S_MASK else None
+        data = bytearray()
+        request = SdoBlockUploadStartRequest(node_id)
+        complete = False
+        while not complete:
+            ackseq = 0
+            while not complete and ackseq < SDO_BLOCK_SIZE:
+                view = await self._sdo_response(responses, node_id, request, index, subindex, timeout, segment=True)
+                request = None
+                seqno = view.header & SDO_BLOCK_SEQNO_MASK
+                if seqno != ackseq + 1:
+                    raise self._sdo_error(node_id, index, subindex, SDO_ABORT_INVALID_SEQNO)
+                data += view.data[1:8]
+                ackseq = seqno
+                complete = bool(view.header & SDO_BLOCK_C_MASK)
+            request = SdoBlockUploadResponse(node_id, ackseq, SDO_BLOCK_SIZE)
+        view = await self._sdo_response(responses, node_id, request, index, subindex, timeout)
+        if view.cs != SDO_SCS_BLOCK_UPLOAD or (view.header & SDO_BLOCK_SS_MASK) >> SDO_BLOCK_SS_BITNUM != SDO_BLOCK_SUBCOMMAND_END:
+            raise self._sdo_error(node_id, index, subindex, SDO_ABORT_INVALID_CS)
+        n = (view.header & SDO_BLOCK_N_MASK) >> SDO_BLOCK_N_BITNUM
+        del data[len(data) - n:]
+        if size is not None and len(data) != size:
+            raise self._sdo_error(node_id, index, subindex, SDO_ABORT_PARAMETER_LENGTH)
+        if crc and view.data[1] + (view.data[2] << 8) != crc_hqx(bytes(data), 0):
+            raise self._sdo_error(node_id, index, subindex, SDO_ABORT_CRC_ERROR)
+        self.send(SdoBlockUploadEndResponse(node_id))
+        return bytes(data)
+
+    async def sdo_download(self, node_id, index, subindex, data, timeout, block=None):
+        """Downloads data of any size, expedited if up to 4 bytes, otherwise segmented or in blocks
+
+        By default, block transfer is used for more than SDO_BLOCK_THRESHOLD bytes.  If the server does not
+        support block transfer, the download is retried segmented.
+        """
+        data = bytes(data)
+        if not data:
+            raise SdoAbort(index, subindex, SDO_ABORT_PARAMETER_LENGTH)
+        if block is None:
+            block = len(data) > SDO_BLOCK_THRESHOLD
+        async with self.sdo_lock(node_id):
+            if block:
+                try:
+                    with self._sdo_responses(node_id) as responses:
+                        return await self._sdo_block_download(responses, node_id, index, subindex, data, timeout)
+                except SdoTimeout:
+                    raise
+                except SdoAbort as e:
+                    if e.code != SDO_ABORT_INVALID_CS:
+                        raise
+            with self._sdo_responses(node_id) as responses:
+                if len(data) <= 4:
+                    request = SdoDownloadInitiateRequest(node_id, 4 - len(data), 1, 1, index, subindex, data.ljust(4, b"\x00"))
+                else:
+                    request = SdoDownloadInitiateRequest(node_id, 0, 0, 1, index, subindex, struct.pack("<I", len(data)))
+                view = await self._sdo_response(responses, node_id, request, index, subindex, timeout)
+                if view.cs != SDO_SCS_DOWNLOAD_INITIATE or view.index != index or view.subindex != subindex:
+                    raise self._sdo_error(node_id, index, subindex, SDO_ABORT_INVALID_CS)
+                if len(data) <= 4:
+                    return
+                toggle = 0
+                for offset in range(0, len(data), 7):
+                    segment = data[offset:offset + 7]
+                    c = int(offset + 7 >= len(data))
+                    request = SdoDownloadSegmentRequest(node_id, toggle, 7 - len(segment), c, segment.ljust(7, b"\x00"))
+                    view = await self._sdo_response(responses, node_id, request, index, subindex, timeout)
+                    if view.cs != SDO_SCS_DOWNLOAD_SEGMENT:
+                        raise self._sdo_error(node_id, index, subindex, SDO_ABORT_INVALID_CS)
+                    if (view.header & SDO_T_MASK) >> SDO_T_BITNUM != toggle:
+                        raise self._sdo_error(node_id, index, subindex, SDO_ABORT_TOGGLE)
+                    toggle ^= 1
+
+    async def _sdo_block_download(self, responses, node_id, index, subindex, data, timeout):
+        header = (SDO_CCS_BLOCK_DOWNLOAD << SDO_CS_BITNUM) + (1 << SDO_BLOCK_CC_BITNUM) + (1 << SDO_BLOCK_S_BITNUM) + SDO_BLOCK_SUBCOMMAND_INITIATE
+        request = SdoRequest(node_id, header, struct.pack("<HBI", index, subindex, len(data)))
+        view = await self._sdo_response(responses, node_id, request, index, subindex, timeout)
+        if view.cs != SDO_SCS_BLOCK_DOWNLOAD or view.header & SDO_BLOCK_SS_MASK != SDO_BLOCK_SUBCOMMAND_INITIATE or view.index != index or view.subindex != subindex:
+            raise self._sdo_error(node_id, index, subindex, SDO_ABORT_INVALID_CS)
+        crc = bool(view.header & SDO_BLOCK_SC_MASK)
+        blksize = view.data[4]
+        offset = 0
+        while offset < len(data):
+            if not 0 < blksize < 0x80:
+                raise self._sdo_error(node_id, index, subindex, SDO_ABORT_INVALID_BLKSIZE)
+            start = offset
+            for seqno in range(1, blksize + 1):
+                segment = data[offset:offset + 7]
+                offset += 7
+                c = int(offset >= len(data))
+                self.send(SdoRequest(node_id, (c << SDO_BLOCK_C_BITNUM) + seqno, segment.ljust(7, b"\x00")))
+                if c:
+                    break
+            view = await self._sdo_response(responses, node_id, None, index, subindex, timeout)
+            if view.cs != SDO_SCS_BLOCK_DOWNLOAD or view.header & SDO_BLOCK_CS_MASK != SDO_BLOCK_SUBCOMMAND_RESPONSE:
+                raise self._sdo_error(node_id, index, subindex, SDO_ABORT_INVALID_CS)
+            offset = min(start + 7 * view.data[1], offset) # Segments after ackseq are sent again
+            blksize = view.data[2]
+        n = -len(data) % 7
+        header = (SDO_CCS_BLOCK_DOWNLOAD << SDO_CS_BITNUM) + (n << SDO_BLOCK_N_BITNUM) + SDO_BLOCK_SUBCOMMAND_END
+        request = SdoRequest(node_id, header, struct.pack("<H5x", crc_hqx(data, 0) if crc else 0))
+        view = await self._sdo_response(responses, node_id, request, index, subindex, timeout)
+        if view.cs != SDO_SCS_BLOCK_DOWNLOAD or view.header & SDO_BLOCK_SS_MASK != SDO_BLOCK_SUBCOMMAND_END:
+            raise self._sdo_error(node_id, index, subindex, SDO_ABORT_INVALID_CS)
+
+
+def decode_pdo(data_types, data):
+    """Text representations, see format_value(), of the values mapped in PDO data; raises ValueError if too short
+
+    Values are mapped in order and byte-aligned.  A data type without fixed size takes the remaining data.
+    """
+    values = []
+    offset = 0
+    for data_type in data_types:
+        size = DATA_TYPE_SIZES.get(data_type, len(data) - offset)
+        if offset + size > len(data):
+            raise ValueError(f"{len(data)} bytes of PDO data for {len(data_types)} values")
+        values.append(format_value(data_type, data[offset:offset + size]))
+        offset += size
+    return values
+
+
+class PdoCache:
+    """Last value of each PDO received on a GatewayNetwork, kept by the network's receive loop:
+
+            cache = PdoCache(network)
+            cache.configure(nr, cob_id, [ODI_DATA_TYPE_UNSIGNED8, ODI_DATA_TYPE_INTEGER16])
+            values, age = cache.get(nr)    # Decoded values and seconds since received, or None
+            with cache.subscribe() as queue:
+                nr, values = await queue.get()
+
+    Each frame is decoded once when received, so reads return the current values without waiting for the next
+    PDO, and any number of subscribers are served from one decode.
+    """
+
+    def __init__(self, network: GatewayNetwork):
+        self.network = network
+        self._pdos = {} # PDO number: dict with cob_id, data_types, values and time
+        self._listeners = {} # PDO number: listener registered with the network
+        self._subscriptions = [] # [set of PDO numbers or None for all, asyncio.Queue]
+
+    def configure(self, nr, cob_id, data_types):
+        self.remove(nr)
+        can_id = cob_id & 0x1FFFFFFF
+        self._pdos[nr] = {"cob_id": can_id, "data_types": list(data_types), "values": None, "time": None}
+        self._listeners[nr] = lambda msg: self._on_pdo(nr, msg)
+        self.network.add_listener(can_id, self._listeners[nr])
+
+    def remove(self, nr):
+        if nr in self._pdos:
+            self.network.remove_listener(self._pdos.pop(nr)["cob_id"], self._listeners.pop(nr))
+
+    def __contains__(self, nr):
+        return nr in self._pdos
+
+    def __iter__(self):
+        # Configured PDO numbers, in order
+        return iter(sorted(self._pdos))
+
+    def data_types(self, nr):
+        return self._pdos[nr]["data_types"]
+
+    def _on_pdo(self, nr, msg: can.Message):
+        pdo = self._pdos[nr]
+        try:
+            values = decode_pdo(pdo["data_types"], bytes(msg.data))
+        except ValueError:
+            return
+        pdo["values"] = values
+        pdo["time"] = asyncio.get_running_loop().time()
+        for nrs, queue in self._subscriptions:
+            if nrs is None or nr in nrs:
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait((nr, values))
+
+    def get(self, nr):
+        # Returns (values, age in seconds), or None if the PDO was not received since it was configured
+        pdo = self._pdos[nr]
+        if pdo["values"] is None:
+            return None
+        return pdo["values"], asyncio.get_running_loop().time() - pdo["time"]
+
+    async def wait(self, nr, timeout):
+        """Like get(), but waits up to timeout seconds for the first PDO; raises asyncio.TimeoutError"""
+        if self.get(nr) is None:
+            pdo = self._pdos[nr]
+            await self.network.request(None, pdo["cob_id"], lambda msg: pdo["values"] is not None, timeout)
+        return self.get(nr)
+
+    @contextmanager
+    def subscribe(self, nrs=None):
+        """Queues (PDO number, values) for every PDO in nrs, or every PDO, received while in the context"""
+        subscription = [None if nrs is None else set(nrs), asyncio.Queue(PDO_QUEUE_SIZE)]
+        self._subscriptions.append(subscription)
+        try:
+            yield subscription[1]
+        finally:
+            self._subscriptions.remove(subscription)
+
+
+class Gateway:
+    """State shared by the CiA 309 gateway front ends, for one or more CAN interfaces numbered from 1:
+
+            gateway = Gateway([can.Bus("vcan0", interface="socketcan")])
+            gateway.load_eds(1, node_id, "node.eds")
+            gateway.start()    # From within the running event loop
+            data, data_type = await gateway.read(net, node_id, index, subindex)
+
+    net and node_id may be None for the defaults, which the front ends set with set/network and set/node.  With
+    an EDS loaded for a node, reads of objects without a fixed size use block transfer, and data types are
+    taken from the EDS.
+
+    Reads of objects the EDS declares constant or read-only, other than PDO-mappable ones, are cached for the
+    time in cache_ttls for their access type.  A node's entries are dropped when it sends its bootup message or
+    an NMT reset is requested through nmt(), and an entry when it is written.
+    """
+
+    def __init__(self, buses, default_net=1, default_node_id=None, sdo_timeout=1, command_timeout=1, cache_ttls=SDO_CACHE_TTLS):
+        self.networks = [GatewayNetwork(bus) for bus in buses]
+        self.pdo_caches = [PdoCache(network) for network in self.networks]
+        self.default_net = default_net
+        self.default_node_id = default_node_id
+        self.sdo_timeout = sdo_timeout # Seconds
+        self.command_timeout = command_timeout # Seconds
+        self.object_dictionaries = {} # (net, node-ID): ObjectDictionary from EDS
+        self.cache_ttls = dict(cache_ttls)
+        self._cache = {} # (net, node-ID, index, subindex): (data, data type, expiry time or None)
+        self._cache_generation = 0 # Incremented when entries are dropped, so reads in progress are not cached
+        self._bootup_listeners = {} # (net, node-ID): listener registered with the network
+
+    def start(self):
+        for network in self.networks:
+            network.start()
+
+    def stop(self):
+        for network in self.networks:
+            network.stop()
+        for (net, node_id), listener in self._bootup_listeners.items():
+            self.network(net).remove_listener((FUNCTION_CODE_NMT_ERROR_CONTROL << FUNCTION_CODE_BITNUM) + node_id, listener)
+        self._bootup_listeners.clear()
+        self._cache.clear()
+
+    def network(self, net=None):
+        if net is None:
+            net = self.default_net
+        if not 1 <= net <= len(self.networks):
+            raise ValueError(f"invalid net: {net}")
+        return self.networks[net - 1]
+
+    def pdo_cache(self, net=None):
+        self.network(net)
+        return self.pdo_caches[(self.default_net if net is None else net) - 1]
+
+    def node_id(self, node_id=None):
+        if node_id is None:
+            node_id = self.default_node_id
+        if node_id is None or not 1 <= node_id <= 127:
+            raise ValueError(f"invalid node: {node_id}")
+        return node_id
+
+    def load_eds(self, net, node_id, filename):
+        self.object_dictionaries[(net, node_id)] = ObjectDictionary.from_eds(filename, node_id)
+
+    def data_type(self, net, node_id, index, subindex):
+        # From the node's EDS, or None if unknown
+        od = self.object_dictionaries.get((self.default_net if net is None else net, self.node_id(node_id)))
+        obj = None if od is None else od.get(index)
+        if obj is None:
+            return None
+        subobj = obj.get(subindex)
+        if subobj is not None and subobj.data_type is not None:
+            return subobj.data_type
+        return obj.data_type
+
+    def cache_ttl(self, net, node_id, index, subindex):
+        # Seconds a read is cached, None until invalidated, or 0 if not cached
+        od = self.object_dictionaries.get((net, node_id))
+        obj = None if od is None else od.get(index)
+        subobj = None if obj is None else obj.get(subindex)
+        if subobj is None or subobj.pdo_mapping:
+            return 0
+        return self.cache_ttls.get(subobj.access_type, 0)
+
+    def invalidate(self, net=None, node_id=None):
+        """Drops the cached reads of a node, or of all nodes of net if node_id is None or 0"""
+        net = self.default_net if net is None else net
+        for key in list(self._cache):
+            if key[0] == net and (not node_id or key[1] == node_id):
+                del self._cache[key]
+        self._cache_generation += 1
+
+    def _on_bootup(self, net, node_id, msg: can.Message):
+        if len(msg.data) == 1 and msg.data[0] == NMT_STATE_INITIALISATION:
+            self.invalidate(net, node_id)
+
+    def nmt(self, net, cs, node_id):
+        # node_id 0 addresses all nodes
+        if cs in [NMT_NODE_CONTROL_RESET_NODE, NMT_NODE_CONTROL_RESET_COMMUNICATION]:
+            self.invalidate(net, node_id)
+        self.network(net).nmt(cs, node_id)
+
+    async def read(self, net, node_id, index, subindex):
+        """Uploads a value, or returns it from the cache; returns (data, data type from the node's EDS or None)"""
+        net = self.default_net if net is None else net
+        node_id = self.node_id(node_id)
+        key = (net, node_id, index, subindex)
+        now = asyncio.get_running_loop().time()
+        entry = self._cache.get(key)
+        if entry is not None and (entry[2] is None or now < entry[2]):
+            return entry[0], entry[1]
+        generation = self._cache_generation
+        data_type = self.data_type(net, node_id, index, subindex)
+        size = DATA_TYPE_SIZES.get(data_type)
+        data = await self.network(net).sdo_upload(node_id, index, subindex, self.sdo_timeout, data_type is not None and size is None, size)
+        if size is not None and len(data) != size:
+            data_type = None # EDS does not match the device
+        ttl = self.cache_ttl(net, node_id, index, subindex)
+        if ttl != 0 and generation == self._cache_generation:
+            if (net, node_id) not in self._bootup_listeners:
+                listener = functools.partial(self._on_bootup, net, node_id)
+                self.network(net).add_listener((FUNCTION_CODE_NMT_ERROR_CONTROL << FUNCTION_CODE_BITNUM) + node_id, listener)
+                self._bootup_listeners[(net, node_id)] = listener
+            self._cache[key] = (data, data_type, None if ttl is None else now + ttl)
+        return data, data_type
+
+    async def write(self, net, node_id, index, subindex, data):
+        net = self.default_net if net is None else net
+        node_id = self.node_id(node_id)
+        self._cache.pop((net, node_id, index, subindex), None)
+        await self.network(net).sdo_download(node_id, index, subindex, data, self.sdo_timeout)
@@ -0,0 +1,451 @@
+import can
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from .constants import *
+from .node import *
+
+logger = logging.getLogger(__name__)
+
+
+class HostedBus(can.BusABC):
+    """Bus handed to a hosted node: transmissions go to the host's bus and are delivered locally to the other hosted nodes"""
+
+    def __init__(self, host, bus: can.BusABC, node_id):
+        self._host = host
+        self._bus = bus
+        self._node_id = node_id
+        super().__init__(bus.channel)
+        self.channel = bus.channel
+        self.channel_info = f"Hosted on {bus.channel_info}"
+
+    def send(self, msg: can.Message, timeout=None):
+        self._host._transmit(self._bus, msg, timeout, self._node_id)
+
+    def _recv_internal(self, timeout):
+        raise NotImplementedError("Hosted nodes receive through their NodeHost")
+
+    @property
+    def state(self):
+        return self._bus.state
+
+    @property
+    def protocol(self):
+        return self._bus.protocol
+
+    def shutdown(self):
+        self._is_shutdown = True # Do not shut down the shared bus
+
+
+class HostedNotifier:
+    """Stands in for a can.Notifier of one hosted node on one channel"""
+
+    def __init__(self, host, bus: can.BusABC, node_id):
+        self._host = host
+        self._bus = bus
+        self._node_id = node_id
+
+    def add_listener(self, listener: can.Listener):
+        self._host._attach(self._bus, self._node_id, listener)
+
+    def remove_listener(self, listener: can.Listener):
+        self._host._detach(self._bus, self._node_id, listener)
+
+    def invalidate(self):
+        self._host.invalidate_routes()
+
+    def stop(self, timeout=5):
+        pass
+
+
+class _BusListener(can.Listener):
+
+    def __init__(self, host, bus: can.BusABC):
+        self.host = host
+        self.bus = bus
+
+    def on_message_received(self, msg: can.Message):
+        self.host._queue.put((self.bus, msg, None))
+
+    def on_error(self, exc: Exception):
+        for listener in list(self.host._listeners[self.bus].values()):
+            listener.on_error(exc)
+
+
+class NodeHost:
+    """Runs many nodes over one bus (and optional redundant bus) with a single receive loop:
+
+            host = NodeHost(bus)
+            nodes = [host.add_node(node_id, ObjectDictionary.from_eds("node.eds", node_id)) for node_id in range(1, 101)]
+            ...
+            host.stop()
+
+    Received frames are demultiplexed by CAN-ID to the nodes whose object dictionaries consume them.
+    Frames sent by a hosted node are also delivered to the other hosted nodes without a kernel round trip.
+    Hosted nodes' on_message() callbacks only see frames routed to them, and share one Scheduler thread for
+    delayed transmissions.
+    """
+
+    def __init__(self, bus: can.BusABC, redundant_bus: can.BusABC = None):
+        self.bus = bus
+        self.redundant_bus = redundant_bus
+        self.nodes = {}
+        self.stats = {"received": 0, "local": 0, "dispatched": 0}
+        buses = [bus] if redundant_bus is None else [bus, redundant_bus]
+        # Keyed by bus rather than channel, which need not be hashable
+        self._listeners = {b: {} for b in buses}
+        self._routes = {b: {} for b in buses}
+        self._lock = threading.Lock()
+        self._queue = queue.SimpleQueue()
+        self._notifiers = [can.Notifier(b, [_BusListener(self, b)]) for b in buses]
+        self.scheduler = Scheduler("NodeHost scheduler")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _attach(self, bus, node_id, listener):
+        with self._lock:
+            self._listeners[bus][node_id] = listener
+            self._routes[bus] = {}
+
+    def _detach(self, bus, node_id, listener):
+        with self._lock:
+            if self._listeners[bus].get(node_id) is not listener:
+                raise ValueError("Listener is not attached")
+            del self._listeners[bus][node_id]
+            self._routes[bus] = {}
+
+    def _route(self, bus, msg: can.Message):
+        can_id = msg.arbitration_id
+        listeners = self._listeners[bus]
+        if msg.is_remote_frame or (not msg.is_extended_id and can_id == 0): # RTR and NMT node control go to every node
+            return list(listeners.items())
+        if not msg.is_extended_id and (can_id >> FUNCTION_CODE_BITNUM) == FUNCTION_CODE_SDO_TX:
+            # SDO responses are routed to the nodes waiting for one
+            return [(node_id, listener) for node_id, listener in listeners.items() if node_id not in self.nodes or len(self.nodes[node_id]._sdo_requests) > 0]
+        key = (can_id, msg.is_extended_id)
+        routes = self._routes[bus].get(key)
+        if routes is None:
+            routes = []
+            cacheable = True
+            for node_id, listener in list(listeners.items()):
+                node = self.nodes.get(node_id)
+                if node is None: # Still booting
+                    cacheable = False
+                    routes.append((node_id, listener))
+                elif node._accepts(can_id, msg.is_extended_id):
+                    routes.append((node_id, listener))
+            if cacheable:
+                self._routes[bus][key] = routes
+        return routes
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            bus, msg, source_id = item
+            if source_id is None:
+                self.stats["received"] += 1
+            else:
+                self.stats["local"] += 1
+            for node_id, listener in self._route(bus, msg):
+                if node_id == source_id:
+                    continue
+                self.stats["dispatched"] += 1
+                try:
+                    listener.on_message_received(msg)
+                except Exception:
+                    logger.exception(f"Unhandled exception in hosted node-ID {node_id}")
+
+    def _transmit(self, bus: can.BusABC, msg: can.Message, timeout, source_id):
+        bus.send(msg, timeout)
+        # Copy, since the sender may reuse the message object
+        local_msg = can.Message(
+            timestamp=time.time(),
+            arbitration_id=msg.arbitration_id,
+            is_extended_id=msg.is_extended_id,
+            is_remote_frame=msg.is_remote_frame,
+            is_fd=msg.is_fd,
+            bitrate_switch=msg.bitrate_switch,
+            dlc=msg.dlc,
+            data=bytearray(msg.data),
+            channel=bus.channel
+        )
+        self._queue.put((bus, local_msg, source_id))
+
+    def add_node(self, node_id, od: ObjectDictionary, node_class=Node, **kwargs):
+        if node_id in self.nodes:
+            raise ValueError(f"Node-ID {node_id} is already hosted")
+        kwargs["notifier"] = HostedNotifier(self, self.bus, node_id)
+        kwargs.setdefault("scheduler", self.scheduler)
+        if self.redundant_bus is not None:
+            kwargs["redundant_bus"] = HostedBus(self, self.redundant_bus, node_id)
+            kwargs["redundant_notifier"] = HostedNotifier(self, self.redundant_bus, node_id)
+        node = node_class(HostedBus(self, self.bus, node_id), node_id, od, **kwargs)
+        with self._lock:
+            self.nodes[node_id] = node
+        self.invalidate_routes()
+        return node
+
+    def remove_node(self, node_id):
+        node = self.nodes.pop(node_id)
+        node._stop_listening()
+        node.__exit__(None, None, None)
+        node.default_bus.shutdown()
+        if node.redundant_bus is not None:
+            node.redundant_bus.shutdown()
+        self.invalidate_routes()
+        return node
+
+    def invalidate_routes(self):
+        with self._lock:
+            for bus in self._routes:
+                self._routes[bus] = {}
+
+    def stop(self):
+        for node_id in list(self.nodes):
+            self.remove_node(node_id)
+        for notifier in self._notifiers:
+            notifier.stop()
+        self._queue.put(None)
+        self._thread.join()
+        self.scheduler.stop()
+
+
+SHARD_EVENTS = ["on_active_nmt_master_lost", "on_active_nmt_master_won", "on_emcy", "on_error", "on_node_bootup", "on_sdo_download", "on_sync"]
+
+
+class _ShardHost(NodeHost):
+    # NodeHost inside a worker process; keeps the kernel filters of its buses in step with the hosted nodes
+
+    def __init__(self, bus, redundant_bus=None):
+        self._filters_dirty = False
+        super().__init__(bus, redundant_bus)
+
+    def invalidate_routes(self):
+        super().invalidate_routes()
+        self._filters_dirty = True
+
+    def can_filters(self):
+        filters = [{"can_id": 0x000, "can_mask": 0x780, "extended": False}, # NMT
+                   {"can_id": 0x580, "can_mask": 0x780, "extended": False}] # Pre-defined SDO responses
+        cob_ids = set()
+        heartbeats = set()
+        for node_id, node in list(self.nodes.items()):
+            cob_ids |= node._consumed_cob_ids()
+            cob_ids |= node._remote_cob_ids() # The filters match data and remote frames alike
+            producers = node._consumed_heartbeats()
+            heartbeats = None if producers is None or heartbeats is None else heartbeats | producers
+            if heartbeats is not None:
+                heartbeats.add(node_id) # Node guarding RTR
+        if heartbeats is None:
+            filters.append({"can_id": 0x700, "can_mask": 0x780, "extended": False})
+        else:
+            cob_ids |= {0x700 + node_id for node_id in heartbeats}
+        for cob_id in sorted(cob_ids):
+            if cob_id & 0x20000000:
+                filters.append({"can_id": cob_id & 0x1FFFFFFF, "can_mask": 0x1FFFFFFF, "extended": True})
+            elif (cob_id & FUNCTION_CODE_MASK) >> FUNCTION_CODE_BITNUM not in [FUNCTION_CODE_NMT, FUNCTION_CODE_SDO_TX]:
+                filters.append({"can_id": cob_id, "can_mask": 0x7FF, "extended": False})
+        return filters
+
+    def update_filters(self):
+        if not self._filters_dirty:
+            return
+        self._filters_dirty = False
+        filters = self.can_filters()
+        self.bus.set_filters(filters)
+        if self.redundant_bus is not None:
+            self.redundant_bus.set_filters(filters)
+
+
+def _shard_worker(shard, conn, bus_kwargs, redundant_bus_kwargs, events, stats_interval):
+    conn_lock = threading.Lock()
+
+    def send(item):
+        with conn_lock:
+            conn.send(item)
+
+    def forward(node_id, name, callback):
+        def forwarder(*args):
+            callback(*args)
+            try:
+                send(("event", node_id, name, args))
+            except Exception:
+                logger.exception(f"Unable to forward {name} of node-ID {node_id} from shard {shard}")
+        return forwarder
+
+    bus = can.Bus(**bus_kwargs)
+    redundant_bus = None if redundant_bus_kwargs is None else can.Bus(**redundant_bus_kwargs)
+    host = _ShardHost(bus, redundant_bus)
+    next_stats = time.monotonic()
+    try:
+        while True:
+            if conn.poll(min(stats_interval, 0.1)):
+                command, *args = conn.recv()
+                if command == "stop":
+                    break
+                try:
+                    if command == "add":
+                        node_id, od, node_class, kwargs = args
+                        node = host.add_node(node_id, od, node_class, **kwargs)
+                        for name in events:
+                            setattr(node, name, forward(node_id, name, getattr(node, name)))
+                        result = None
+                    elif command == "remove":
+                        host.remove_node(args[0])
+                        result = None
+                    elif command == "call": # Run a node method in the shard, e.g. ("call", node_id, "emcy", args)
+                        node_id, name, call_args = args
+                        result = getattr(host.nodes[node_id], name)(*call_args)
+                    else:
+                        raise ValueError(f"Unknown shard command {command}")
+                    send(("result", None, result))
+                except Exception as e:
+                    send(("result", e, None))
+            host.update_filters()
+            if time.monotonic() >= next_stats:
+                next_stats += stats_interval
+                send(("stats", dict(host.stats, nodes=len(host.nodes), cpu_time=time.process_time())))
+    finally:
+        host.stop()
+        bus.shutdown()
+        if redundant_bus is not None:
+            redundant_bus.shutdown()
+        conn.close()
+
+
+class ShardedNodeHost:
+    """Spreads hosted nodes over worker processes, each running a NodeHost on its own bus:
+
+            host = ShardedNodeHost({"interface": "socketcan", "channel": "can0"}, shards=4)
+            for node_id in range(1, 101):
+                host.add_node(node_id, ObjectDictionary.from_eds("node.eds", node_id))
+            ...
+            host.stop()
+
+    Pass a list of bus keyword argument dicts instead to run one shard per CAN channel.  Each worker sets its
+    bus filters to the CAN-IDs its nodes consume.  Object dictionaries, node classes and keyword arguments
+    must be picklable; file values, such as the EDS that from_eds() stores, are reopened by filename in the
+    worker.  A process image cannot be shared with a worker, so pass process_image=True to have the worker
+    build its own, and do not bind the object dictionary to one.  Node callbacks named in events run in the
+    worker and are then forwarded to on_event() in the parent; per-shard NodeHost counters are aggregated in
+    stats.
+    """
+
+    def __init__(self, bus_kwargs, shards=None, redundant_bus_kwargs=None, events=SHARD_EVENTS, stats_interval=1.0, context=None):
+        if isinstance(bus_kwargs, dict):
+            bus_kwargs = [bus_kwargs] * (shards or os.cpu_count() or 1)
+        context = multiprocessing.get_context(context)
+        self.shard_stats = [{} for _ in bus_kwargs]
+        self.shard_nodes = [set() for _ in bus_kwargs]
+        self._conns = []
+        self._processes = []
+        self._results = []
+        self._locks = []
+        self._threads = []
+        for shard, kwargs in enumerate(bus_kwargs):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_shard_worker, args=(shard, child_conn, kwargs, redundant_bus_kwargs, list(events), stats_interval), daemon=True)
+            process.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._processes.append(process)
+            self._results.append(queue.SimpleQueue())
+            self._locks.append(threading.Lock())
+            thread = threading.Thread(target=self._receive, args=(shard,), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _receive(self, shard):
+        conn = self._conns[shard]
+        while True:
+            try:
+                kind, *args = conn.recv()
+            except (EOFError, OSError):
+                self._results[shard].put((ConnectionError(f"Shard {shard} exited"), None))
+                break
+            if kind == "result":
+                self._results[shard].put(tuple(args))
+            elif kind == "stats":
+                self.shard_stats[shard] = args[0]
+            elif kind == "event":
+                node_id, name, event_args = args
+                try:
+                    self.on_event(node_id, name, *event_args)
+                except Exception:
+                    logger.exception(f"Unhandled exception in on_event for node-ID {node_id}")
+
+    def _request(self, shard, *command):
+        with self._locks[shard]:
+            self._conns[shard].send(command)
+            error, result = self._results[shard].get()
+        if error is not None:
+            raise error
+        return result
+
+    def shard_of(self, node_id):
+        for shard, node_ids in enumerate(self.shard_nodes):
+            if node_id in node_ids:
+                return shard
+        raise KeyError(node_id)
+
+    def add_node(self, node_id, od: ObjectDictionary, node_class=Node, shard=None, **kwargs):
+        if any(node_id in node_ids for node_ids in self.shard_nodes):
+            raise ValueError(f"Node-ID {node_id} is already hosted")
+        if isinstance(kwargs.get("process_image"), ProcessImage):
+            raise ValueError("A process image cannot be passed to a shard, use process_image=True")
+        if shard is None:
+            shard = min(range(len(self.shard_nodes)), key=lambda s: len(self.shard_nodes[s]))
+        self._request(shard, "add", node_id, od, node_class, kwargs)
+        self.shard_nodes[shard].add(node_id)
+        return shard
+
+    def remove_node(self, node_id):
+        shard = self.shard_of(node_id)
+        self._request(shard, "remove", node_id)
+        self.shard_nodes[shard].discard(node_id)
+
+    def call(self, node_id, name, *args):
+        return self._request(self.shard_of(node_id), "call", node_id, name, args)
+
+    @property
+    def stats(self):
+        totals = {}
+        for shard_stats in self.shard_stats:
+            for key, value in shard_stats.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def on_event(self, node_id, name, *args):
+        pass
+
+    def stop(self, timeout=5):
+        for shard, conn in enumerate(self._conns):
+            with self._locks[shard]:
+                try:
+                    conn.send(("stop",))
+                except (BrokenPipeError, OSError):
+                    pass
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        for conn in self._conns:
+            conn.close()
@@ -20,30 +20,20 @@ class Message(can.Message):
 
     @classmethod
     def factory(cls, msg: can.Message):
+        factory = MESSAGE_FACTORIES.get((msg.arbitration_id & FUNCTION_CODE_MASK) >> FUNCTION_CODE_BITNUM)
+        if factory is None:
+            raise NotImplementedError
+        return factory(msg.arbitration_id & 0x7F, msg.data)
+
+    @staticmethod
+    def view(msg: can.Message):
+        """Returns a FrameView of msg, which parses fields on access instead of building a Message"""
         fc = (msg.arbitration_id & FUNCTION_CODE_MASK) >> FUNCTION_CODE_BITNUM
-        node_id = msg.arbitration_id & 0x7F
-        if fc == FUNCTION_CODE_NMT:
-            return NmtMessage.factory(node_id, msg.data)
-        if fc == FUNCTION_CODE_SYNC:
-            if node_id == 0x00:
-                return SyncMessage()
-            else:
-                return EmcyMessage.factory(node_id, msg.data)
-        if fc == FUNCTION_CODE_TPDO1:
-            return PdoMessage(fc, node_id, msg.data)
-        if fc == FUNCTION_CODE_TPDO2:
-            return PdoMessage(fc, node_id, msg.data)
-        if fc == FUNCTION_CODE_TPDO3:
-            return PdoMessage(fc, node_id, msg.data)
-        if fc == FUNCTION_CODE_TPDO4:
-            return PdoMessage(fc, node_id, msg.data)
-        if fc == FUNCTION_CODE_SDO_TX:
-            return SdoResponse.factory(node_id, msg.data)
-        if fc == FUNCTION_CODE_SDO_RX:
-            return SdoRequest.factory(node_id, msg.data)
-        if fc == FUNCTION_CODE_NMT_ERROR_CONTROL:
-            return NmtErrorControlMessage.factory(node_id, msg.data)
-        raise NotImplementedError
+        if msg.is_extended_id:
+            return FrameView(msg)
+        if fc == FUNCTION_CODE_SYNC and msg.arbitration_id & 0x7F:
+            return EmcyView(msg)
+        return FRAME_VIEWS.get(fc, FrameView)(msg)
 
 
 class NmtMessage(Message):
@@ -142,8 +132,11 @@ class EmcyMessage(Message):
 
     @classmethod
     def factory(cls, id, data):
-        eec, er, msef0, msef1 = struct.unpack("<HBBI", data)
-        return cls(id, eec, er, (msef1 << 8) + msef0)
+        if len(data) != 8:
+            raise struct.error("EMCY data must be 8 bytes")
+        msg = cls.__new__(cls) # Data is already packed
+        Message.__init__(msg, FUNCTION_CODE_EMCY, id, data)
+        return msg
 
 
 class PdoMessage(Message):
@@ -151,10 +144,16 @@ class PdoMessage(Message):
         super().__init__(fc, node_id, data)
 
 
+class MpdoMessage(PdoMessage):
+    def __init__(self, cob_id, node_id, index, subindex, data, dam=False):
+        # node_id is the producer's in source address mode, or the consumer's (0 for all) in destination address mode
+        address = (dam << MPDO_ADDRESS_TYPE_BITNUM) | node_id
+        super().__init__(cob_id >> FUNCTION_CODE_BITNUM, cob_id & 0x7F, struct.pack("<BHB4s", address, index, subindex, bytes(data)))
+
+
 class SdoMessage(Message):
     def __init__(self, fc, node_id, header, sdo_data):
-        data = [header] + list(sdo_data)
-        super().__init__(fc, node_id, data)
+        super().__init__(fc, node_id, bytes((header,)) + bytes(sdo_data))
 
     @property
     def node_id(self):
@@ -176,7 +175,7 @@ class SdoRequest(SdoMessage):
 
     @classmethod
     def factory(cls, node_id, data):
-        cmd, index, subindex, sdo_data = struct.unpack("<BHBI", data.ljust(8, b'\x00'))
+        cmd, index, subindex, sdo_data = struct.unpack("<BHB4s", bytes(data).ljust(8, b'\x00'))
         ccs = (cmd & SDO_CS_MASK) >> SDO_CS_BITNUM
         if ccs == SDO_CCS_DOWNLOAD_INITIATE:
             n = (cmd & SDO_INITIATE_N_MASK) >> SDO_INITIATE_N_BITNUM
@@ -207,10 +206,10 @@ class SdoResponse(SdoMessage):
 
     @classmethod
     def factory(cls, node_id, data):
-        cmd, index, subindex, data = struct.unpack("<BHBI", data.ljust(8, b'\x00'))
+        cmd, index, subindex, sdo_data = struct.unpack("<BHB4s", bytes(data).ljust(8, b'\x00'))
         cs = (cmd & SDO_CS_MASK) >> SDO_CS_BITNUM
         if cs == SDO_CS_ABORT:
-            return SdoAbortResponse(node_id, index, subindex, data)
+            return SdoAbortResponse(node_id, index, subindex, int.from_bytes(sdo_data, byteorder="little"))
         if cs == SDO_SCS_DOWNLOAD_INITIATE:
             n = (cmd & SDO_INITIATE_N_MASK) >> SDO_INITIATE_N_BITNUM
             e = (cmd >> SDO_E_BITNUM) & 1
@@ -223,7 +222,7 @@ class SdoResponse(SdoMessage):
             n = (cmd & SDO_INITIATE_N_MASK) >> SDO_INITIATE_N_BITNUM
             e = (cmd >> SDO_E_BITNUM) & 1
             s = (cmd >> SDO_S_BITNUM) & 1
-            return SdoUploadInitiateResponse(node_id, n, e, s, index, subindex, data)
+            return SdoUploadInitiateResponse(node_id, n, e, s, index, subindex, sdo_data)
         if cs == SDO_SCS_UPLOAD_SEGMENT:
             t = (cmd >> SDO_T_BITNUM) & 1
             n = (cmd & SDO_SEGMENT_N_MASK) >> SDO_SEGMENT_N_BITNUM
@@ -240,7 +239,7 @@ class SdoAbortResponse(SdoResponse):
         super().__init__(node_id, header, sdo_data)
 
 
-class SdoBlockUploadEndResponse(SdoResponse):
+class SdoBlockUploadEndResponse(SdoRequest):
     def __init__(self, node_id):
         header = (SDO_CCS_BLOCK_UPLOAD << SDO_CS_BITNUM) + SDO_BLOCK_SUBCOMMAND_END
         super().__init__(node_id, header, bytes(7))
@@ -310,7 +309,7 @@ class SdoUploadInitiateResponse(SdoResponse):
     def __init__(self, node_id, n, e, s, index, subindex, data):
         header = (SDO_SCS_UPLOAD_INITIATE << SDO_CS_BITNUM) + (n << SDO_INITIATE_N_BITNUM) + (e << SDO_E_BITNUM) + (s << SDO_S_BITNUM)
         sdo_data = struct.pack("<HB", index, subindex) + data
-        super().__init__(node_id, SDO_SCS_UPLOAD_INITIATE, n, e, s, index, subindex, data)
+        super().__init__(node_id, header, sdo_data)
 
 
 class SdoUploadSegmentRequest(SdoRequest):
@@ -325,6 +324,49 @@ class SdoUploadSegmentResponse(SdoResponse):
         super().__init__(node_id, header, data)
 
 
+def fd_length(length):
+    # Smallest CAN FD data length of at least length bytes
+    return can.util.dlc2len(can.util.len2dlc(length))
+
+
+class FdSdoRequest(Message):
+    def __init__(self, node_id, data):
+        super().__init__(FUNCTION_CODE_SDO_RX, node_id, bytes(data).ljust(fd_length(len(data)), b"\x00"))
+        self.is_fd = True
+        self.bitrate_switch = True
+
+
+class FdSdoAbortRequest(FdSdoRequest):
+    def __init__(self, node_id, session, index, subindex, abort_code):
+        super().__init__(node_id, struct.pack(FD_SDO_HEADER_FORMAT + "I", FD_SDO_CS_ABORT, session, index, subindex, abort_code))
+
+
+class FdSdoDownloadExpeditedRequest(FdSdoRequest):
+    def __init__(self, node_id, session, index, subindex, data):
+        super().__init__(node_id, struct.pack(FD_SDO_HEADER_FORMAT + "B", FD_SDO_CS_DOWNLOAD_EXPEDITED, session, index, subindex, len(data)) + bytes(data))
+
+
+class FdSdoDownloadInitiateRequest(FdSdoRequest):
+    def __init__(self, node_id, session, index, subindex, size):
+        super().__init__(node_id, struct.pack(FD_SDO_HEADER_FORMAT + "I", FD_SDO_CS_DOWNLOAD_INITIATE, session, index, subindex, size))
+
+
+class FdSdoDownloadSegmentRequest(FdSdoRequest):
+    def __init__(self, node_id, session, seqno, data, last):
+        cs = FD_SDO_CS_DOWNLOAD_SEGMENT | (FD_SDO_CS_LAST_SEGMENT if last else 0)
+        super().__init__(node_id, struct.pack(FD_SDO_SEGMENT_HEADER_FORMAT, cs, session, seqno, len(data)) + bytes(data))
+
+
+class FdSdoUploadRequest(FdSdoRequest):
+    def __init__(self, node_id, session, index, subindex):
+        super().__init__(node_id, struct.pack(FD_SDO_HEADER_FORMAT, FD_SDO_CS_UPLOAD_EXPEDITED, session, index, subindex))
+
+
+class FdSdoUploadSegmentRequest(FdSdoRequest):
+    def __init__(self, node_id, session, seqno):
+        super().__init__(node_id, struct.pack(FD_SDO_SEGMENT_HEADER_FORMAT, FD_SDO_CS_UPLOAD_SEGMENT, session, seqno, 0))
+
+
 class NmtErrorControlMessage(Message):
     def __init__(self, node_id, data):
         super().__init__(FUNCTION_CODE_NMT_ERROR_CONTROL, node_id, data)
@@ -345,3 +387,215 @@ class BootupMessage(NmtErrorControlMessage):
 class HeartbeatMessage(NmtErrorControlMessage):
     def __init__(self, node_id, nmt_state):
         super().__init__(node_id, bytearray([nmt_state]))
+
+
+PDO_FUNCTION_CODES = [FUNCTION_CODE_TPDO1, FUNCTION_CODE_RPDO1, FUNCTION_CODE_TPDO2, FUNCTION_CODE_RPDO2, FUNCTION_CODE_TPDO3, FUNCTION_CODE_RPDO3, FUNCTION_CODE_TPDO4, FUNCTION_CODE_RPDO4]
+
+
+def _sync_or_emcy_factory(node_id, data):
+    if node_id == 0x00:
+        return SyncMessage()
+    return EmcyMessage.factory(node_id, data)
+
+
+def _pdo_factory(fc):
+    return lambda node_id, data: PdoMessage(fc, node_id, data)
+
+
+MESSAGE_FACTORIES = {
+    FUNCTION_CODE_NMT: NmtMessage.factory,
+    FUNCTION_CODE_SYNC: _sync_or_emcy_factory,
+    FUNCTION_CODE_SDO_TX: SdoResponse.factory,
+    FUNCTION_CODE_SDO_RX: SdoRequest.factory,
+    FUNCTION_CODE_NMT_ERROR_CONTROL: NmtErrorControlMessage.factory,
+}
+MESSAGE_FACTORIES.update({fc: _pdo_factory(fc) for fc in PDO_FUNCTION_CODES})
+
+
+class FrameView:
+    """Read-only view of a received frame, for classifying frames without allocating a Message:
+
+            view = Message.view(msg)
+            if isinstance(view, SdoView) and view.cs == SDO_CS_ABORT:
+                print(view.node_id, hex(view.index), view.abort_code)
+
+    Fields are parsed from the frame's data on access.  Properties returning memoryviews keep the frame's
+    data from being resized while referenced.
+    """
+    __slots__ = ("frame",)
+
+    def __init__(self, frame: can.Message):
+        self.frame = frame
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.frame!r})"
+
+    @property
+    def arbitration_id(self):
+        return self.frame.arbitration_id
+
+    @property
+    def data(self):
+        return self.frame.data
+
+    @property
+    def timestamp(self):
+        return self.frame.timestamp
+
+    @property
+    def channel(self):
+        return self.frame.channel
+
+    @property
+    def function_code(self):
+        return (self.frame.arbitration_id & FUNCTION_CODE_MASK) >> FUNCTION_CODE_BITNUM
+
+    @property
+    def node_id(self):
+        return self.frame.arbitration_id & 0x7F
+
+
+class NmtView(FrameView):
+    __slots__ = ()
+
+    @property
+    def command(self):
+        return self.frame.arbitration_id & 0x7F
+
+    @property
+    def cs(self):
+        # NMT node control command specifier
+        return self.frame.data[0]
+
+    @property
+    def target_id(self):
+        return self.frame.data[1]
+
+
+class SyncView(FrameView):
+    __slots__ = ()
+
+    @property
+    def counter(self):
+        data = self.frame.data
+        return data[0] if len(data) else None
+
+
+class EmcyView(FrameView):
+    __slots__ = ()
+
+    @property
+    def eec(self):
+        data = self.frame.data
+        return data[0] + (data[1] << 8)
+
+    @property
+    def er(self):
+        return self.frame.data[2]
+
+    @property
+    def msef(self):
+        return int.from_bytes(self.frame.data[3:8], byteorder="little")
+
+
+class TimeView(FrameView):
+    __slots__ = ()
+
+    @property
+    def ms(self):
+        return int.from_bytes(self.frame.data[0:4], byteorder="little") & 0x0FFFFFFF
+
+    @property
+    def days(self):
+        return int.from_bytes(self.frame.data[4:6], byteorder="little")
+
+
+class PdoView(FrameView):
+    __slots__ = ()
+
+
+class MpdoView(PdoView):
+    # Not returned by Message.view(), since MPDOs are only distinguished by PDO mapping
+    __slots__ = ()
+
+    @property
+    def dam(self):
+        return bool(self.frame.data[0] >> MPDO_ADDRESS_TYPE_BITNUM)
+
+    @property
+    def address(self):
+        # Producer node-ID, or consumer node-ID (0 for all) if dam
+        return self.frame.data[0] & 0x7F
+
+    @property
+    def index(self):
+        data = self.frame.data
+        return data[1] + (data[2] << 8)
+
+    @property
+    def subindex(self):
+        return self.frame.data[3]
+
+    @property
+    def mpdo_data(self):
+        return memoryview(self.frame.data)[4:8]
+
+
+class SdoView(FrameView):
+    __slots__ = ()
+
+    @property
+    def header(self):
+        return self.frame.data[0]
+
+    @property
+    def cs(self):
+        return self.frame.data[0] >> SDO_CS_BITNUM
+
+    @property
+    def index(self):
+        data = self.frame.data
+        return data[1] + (data[2] << 8)
+
+    @property
+    def subindex(self):
+        return self.frame.data[3]
+
+    @property
+    def sdo_data(self):
+        return memoryview(self.frame.data)[1:]
+
+    @property
+    def abort_code(self):
+        return int.from_bytes(self.frame.data[4:8], byteorder="little")
+
+
+class SdoRequestView(SdoView):
+    __slots__ = ()
+
+
+class SdoResponseView(SdoView):
+    __slots__ = ()
+
+
+class NmtErrorControlView(FrameView):
+    __slots__ = ()
+
+    @property
+    def state(self):
+        return self.frame.data[0] & 0x7F
+
+    @property
+    def toggle(self):
+        return self.frame.data[0] >> 7
+
+
+FRAME_VIEWS = {
+    FUNCTION_CODE_NMT: NmtView,
+    FUNCTION_CODE_SYNC: SyncView,
+    FUNCTION_CODE_TIME_STAMP: TimeView,
+    FUNCTION_CODE_SDO_TX: SdoResponseView,
+    FUNCTION_CODE_SDO_RX: SdoRequestView,
+    FUNCTION_CODE_NMT_ERROR_CONTROL: NmtErrorControlView,
+}
+FRAME_VIEWS.update({fc: PdoView for fc in PDO_FUNCTION_CODES})
@@ -0,0 +1,187 @@
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+
+from .constants import *
+
+FUNCTION_CODE_NAMES = {
+    FUNCTION_CODE_NMT: "nmt",
+    FUNCTION_CODE_SYNC: "sync_emcy",
+    FUNCTION_CODE_TIME_STAMP: "time",
+    FUNCTION_CODE_TPDO1: "tpdo1",
+    FUNCTION_CODE_RPDO1: "rpdo1",
+    FUNCTION_CODE_TPDO2: "tpdo2",
+    FUNCTION_CODE_RPDO2: "rpdo2",
+    FUNCTION_CODE_TPDO3: "tpdo3",
+    FUNCTION_CODE_RPDO3: "rpdo3",
+    FUNCTION_CODE_TPDO4: "tpdo4",
+    FUNCTION_CODE_RPDO4: "rpdo4",
+    FUNCTION_CODE_SDO_TX: "sdo_tx",
+    FUNCTION_CODE_SDO_RX: "sdo_rx",
+    FUNCTION_CODE_NMT_ERROR_CONTROL: "nmt_error_control",
+}
+
+# Seconds
+LATENCY_BUCKETS = (10e-6, 25e-6, 50e-6, 100e-6, 250e-6, 500e-6, 1e-3, 2.5e-3, 5e-3, 10e-3, 25e-3, 50e-3, 100e-3, 250e-3, 500e-3, 1)
+INTERVAL_BUCKETS = (1e-3, 5e-3, 10e-3, 50e-3, 100e-3, 250e-3, 500e-3, 1, 2.5, 5, 10, 30, 60)
+
+
+class Counter:
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(zip(self.labels, label_values)), value) for label_values, value in self._values.items()]
+
+    def to_dict(self):
+        with self._lock:
+            return {"/".join(str(v) for v in label_values): value for label_values, value in self._values.items()}
+
+
+class Histogram:
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {} # label values: [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                counts = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            counts[i] += 1
+            counts[-1] += value
+
+    def get(self, *label_values):
+        # Returns (count, sum)
+        counts = self._values.get(label_values)
+        if counts is None:
+            return 0, 0
+        return sum(counts[:-1]), counts[-1]
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            values = {label_values: list(counts) for label_values, counts in self._values.items()}
+        for label_values, counts in values.items():
+            labels = dict(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts[:-1]):
+                cumulative += count
+                samples.append((self.name + "_bucket", dict(labels, le=str(bound)), cumulative))
+            samples.append((self.name + "_count", labels, cumulative))
+            samples.append((self.name + "_sum", labels, counts[-1]))
+        return samples
+
+    def to_dict(self):
+        with self._lock:
+            values = {label_values: list(counts) for label_values, counts in self._values.items()}
+        result = {}
+        for label_values, counts in values.items():
+            count = sum(counts[:-1])
+            result["/".join(str(v) for v in label_values)] = {
+                "count": count,
+                "sum": counts[-1],
+                "mean": counts[-1] / count if count else None,
+                "buckets": dict(zip([str(b) for b in self.buckets + ("+Inf",)], counts[:-1])),
+            }
+        return result
+
+
+class Metrics:
+    """Counters and histograms of a Node, or of several nodes when shared:
+
+            metrics = Metrics()
+            node = Node(bus, node_id, od, metrics=metrics)
+            metrics.serve(9100)    # Optional; GET /metrics for Prometheus text, /metrics.json for JSON
+            metrics.frames_received.get(node_id, "sdo_rx")
+
+    Durations are in seconds.
+    """
+
+    def __init__(self):
+        self.frames_received = Counter("canopen_frames_received_total", "Frames received, by function code", ("node", "function"))
+        self.frames_sent = Counter("canopen_frames_sent_total", "Frames sent, by function code", ("node", "function"))
+        self.send_errors = Counter("canopen_send_errors_total", "Frames that failed to send", ("node",))
+        self.sdo_aborts = Counter("canopen_sdo_aborts_total", "SDO aborts, by direction and abort code", ("node", "direction", "code"))
+        self.message_time = Histogram("canopen_message_handling_seconds", "Time spent handling a received frame", ("node", "function"))
+        self.sdo_round_trip_time = Histogram("canopen_sdo_round_trip_seconds", "SDO client request to response time, by server node-ID", ("node", "server"))
+        self.tpdo_build_time = Histogram("canopen_tpdo_build_seconds", "Time to build a TPDO", ("node", "tpdo"))
+        self.sync_jitter = Histogram("canopen_sync_jitter_seconds", "Deviation of received SYNC intervals from the communication cycle period", ("node",))
+        self.heartbeat_interval = Histogram("canopen_heartbeat_interval_seconds", "Time between heartbeats, by producer node-ID", ("node", "producer"), INTERVAL_BUCKETS)
+        self.timer_lag = Histogram("canopen_timer_lag_seconds", "Lateness of periodic timers", ("node", "timer"))
+        self._server = None
+
+    @property
+    def metrics(self):
+        return [value for value in vars(self).values() if isinstance(value, (Counter, Histogram))]
+
+    @staticmethod
+    def function_name(can_id):
+        return FUNCTION_CODE_NAMES.get((can_id & FUNCTION_CODE_MASK) >> FUNCTION_CODE_BITNUM)
+
+    def to_dict(self):
+        return {metric.name: metric.to_dict() for metric in self.metrics}
+
+    def to_prometheus(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {'counter' if isinstance(metric, Counter) else 'histogram'}")
+            for name, labels, value in metric.samples():
+                label_str = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_str}}} {value}" if label_str else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, address=""):
+        metrics = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = metrics.to_prometheus().encode()
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(metrics.to_dict()).encode()
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                return # Suppress logging
+
+        self._server = ThreadingHTTPServer((address, port), MetricsRequestHandler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
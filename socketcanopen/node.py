@@ -3,6 +3,7 @@
 # TODO: Check for BUS-OFF before attempting to send
 # TODO: NMT error handler (CiA302-2)
 from binascii import crc_hqx
+from collections import deque
 import can
 import copy
 import datetime
@@ -15,9 +16,15 @@ import threading
 import time
 
 from .constants import *
+from .error_history import *
 from .indicators import *
 from .messages import *
+from .metrics import *
 from .object_dictionary import *
+from .pdo import *
+from .process_image import *
+from .scheduler import *
+from .transmit import *
 
 logger = logging.getLogger(__name__)
 
@@ -29,12 +36,13 @@ class IntervalTimer(threading.Thread):
             t.cancel()    # stop the timer's action if it's still running
     """
 
-    def __init__(self, interval, function, args=None, kwargs=None):
+    def __init__(self, interval, function, args=None, kwargs=None, on_lag=None):
         super().__init__(args=args, kwargs=kwargs, daemon=True)
         self.interval = interval
         self.function = function
         self.args = args if args is not None else []
         self.kwargs = kwargs if kwargs is not None else {}
+        self.on_lag = on_lag
         self.finished = threading.Event()
 
     def cancel(self):
@@ -45,6 +53,8 @@ class IntervalTimer(threading.Thread):
         while not self.finished.wait(next_run - time.time()):
             if self.finished.is_set():
                 break
+            if self.on_lag is not None:
+                self.on_lag(time.time() - next_run)
             threading.Thread(target=self.function, args=self.args, kwargs=self.kwargs, daemon=True).start()
             next_run += self.interval
 
@@ -64,20 +74,32 @@ class SdoAbort(Exception):
 
 
 class SdoRequestEvent(threading.Event):
+    # Responses are queued, so a block upload can wait on one event for all segments the server sends back to back
 
     def __init__(self, index, subindex):
         super().__init__()
         self.index = index
         self.subindex = subindex
-        self._response = None
+        self._responses = deque()
 
     def respond(self, data):
-        self._response = data
+        # None resolves the request without a response
+        self._responses.append(data)
         self.set()
 
+    def next_response(self, timeout):
+        # Removes and returns the oldest response, or None on timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            self.clear()
+            if self._responses:
+                return self._responses.popleft()
+            if not self.wait(max(0, deadline - time.monotonic())):
+                return None
+
     @property
     def response(self):
-        return self._response
+        return self._responses[0] if self._responses else None
 
 
 class SdoTimeout(SdoAbort):
@@ -107,13 +129,55 @@ class Node:
 
     def __init__(self, bus: can.BusABC, id, od: ObjectDictionary, *args, **kwargs):
         self.default_bus = bus
-        self._notifier = can.Notifier(self.default_bus, [])
+        self._notifier = kwargs.get("notifier") or can.Notifier(self.default_bus, [])
         self._listener = Listener(self._on_message, self._on_can_error, self.default_bus.channel)
 
         if id > 0x7F or id <= 0:
             raise ValueError("Invalid Node ID")
         self.id = id
         self.od = od
+        self.fd = getattr(bus, "protocol", None) in [can.CanProtocol.CAN_FD, can.CanProtocol.CAN_FD_NON_ISO] # PDOs up to 64 bytes
+        self.fd_sdo_server = bool(kwargs.get("fd_sdo_server")) # Whether the SDO server also serves FD SDO, see constants.py
+        self.fd_sdo_servers = set(kwargs.get("fd_sdo_servers") or []) # Node-IDs of the SDO servers the client uses FD SDO with
+        self.error_history = ErrorHistory(od.get(ODI_PREDEFINED_ERROR_FIELD)) if ODI_PREDEFINED_ERROR_FIELD in od else None
+
+        if "metrics" in kwargs and kwargs["metrics"] is not None:
+            if kwargs["metrics"] is True:
+                self.metrics = Metrics()
+            elif isinstance(kwargs["metrics"], Metrics):
+                self.metrics = kwargs["metrics"]
+            else:
+                raise TypeError
+            self._listener.msg_handler = self._on_message_measured
+            self._last_sync_time = None
+            self._last_heartbeat_times = {}
+        else:
+            self.metrics = None
+
+        if "transmit_scheduler" in kwargs and kwargs["transmit_scheduler"] not in [None, False]:
+            if kwargs["transmit_scheduler"] is True:
+                self.transmit_scheduler = TransmitScheduler()
+                self._own_transmit_scheduler = True
+            elif isinstance(kwargs["transmit_scheduler"], TransmitScheduler):
+                self.transmit_scheduler = kwargs["transmit_scheduler"]
+                self._own_transmit_scheduler = False
+            else:
+                raise TypeError
+        else:
+            self.transmit_scheduler = None
+            self._own_transmit_scheduler = False
+
+        if "scheduler" in kwargs and kwargs["scheduler"] is not None:
+            if not isinstance(kwargs["scheduler"], Scheduler):
+                raise TypeError
+            self.scheduler = kwargs["scheduler"]
+            self._own_scheduler = False
+        else:
+            self.scheduler = Scheduler(f"Node {id} scheduler")
+            self._own_scheduler = True
+        self._inhibit = InhibitEngine(self.scheduler)
+        self.tpdo_events = TpdoEventEngine(self, kwargs.get("tpdo_scan_interval", 0.01))
+        self.rpdo_deadlines = RpdoDeadlineMonitor(self)
 
         if "err_indicator" in kwargs:
             if not isinstance(kwargs["err_indicator"], ErrorIndicator):
@@ -125,7 +189,7 @@ class Node:
                 self._redundant_err_indicator = kwargs["redundant_err_indicator"]
             # TODO: Move this to reset()
             self._process_err_indicator()
-            self._err_indicator_timer = IntervalTimer(self._err_indicator.interval , self._process_err_indicator)
+            self._err_indicator_timer = IntervalTimer(self._err_indicator.interval, self._process_err_indicator, on_lag=self._timer_lag_handler("err_indicator"))
             self._err_indicator_timer.start()
         else:
             self._err_indicator = None
@@ -147,7 +211,6 @@ class Node:
             self._redundant_run_indicator = None
 
         self._default_bus_heartbeat_disabled = False
-        self._emcy_inhibit_time = 0
         self._first_boot = True
         self._heartbeat_consumer_timers = {}
         self._heartbeat_consumer_timers_lock = threading.Lock()
@@ -158,8 +221,6 @@ class Node:
         self._heartbeat_evaluation_reset_communication_timer_lock = threading.Lock()
         self._heartbeat_producer_timer = None
         self._heartbeat_producer_timer_lock = threading.Lock()
-        self._message_timers = []
-        self._message_timers_lock = threading.Lock()
         self._nmt_active_master = False
         self._nmt_active_master_id = None
         self._nmt_active_master_timer = None
@@ -169,11 +230,12 @@ class Node:
         self._nmt_boot_time_expired = True
         self._nmt_flying_master_timer = None
         self._nmt_flying_master_timer_lock = threading.Lock()
-        self._nmt_inhibit_time = 0
         self._nmt_multiple_master_timer = None
         self._nmt_multiple_master_timer_lock = threading.Lock()
         self._nmt_slave_booters = {}
         self._nmt_slave_states = {}
+        self._emcy_consumers = None
+        self._pdo_mappings = {}
         self._pending_emcy_msgs = []
         self._redundant_nmt_state = None
         self._redundant_reset_communication_thread = None
@@ -189,18 +251,35 @@ class Node:
         self._sdo_t = None
         self._sync_counter = 0
         self._sync_producer_counter = 1
+        self._fd_sdo_data = None
+        self._fd_sdo_len = None
+        self._fd_sdo_odi = None
+        self._fd_sdo_odsi = None
+        self._fd_sdo_seqno = None
+        self._fd_sdo_session = None
+        self._fd_sdo_client_session = 0
         self._sync_timer = None
         self._sync_timer_lock = threading.Lock()
         self._timedelta = datetime.timedelta()
-        self._tpdo_inhibit_times = {}
         self._tpdo_triggers = {}
+        self._tx_templates = {}
+
+        if "process_image" in kwargs and kwargs["process_image"] not in [None, False]:
+            if kwargs["process_image"] is True:
+                self.process_image = ProcessImage(od)
+            elif isinstance(kwargs["process_image"], ProcessImage):
+                self.process_image = kwargs["process_image"]
+            else:
+                raise TypeError
+        else:
+            self.process_image = None
 
         if od.get(ODI_REDUNDANCY_CONFIGURATION) is not None and "redundant_bus" in kwargs:
             if not isinstance(kwargs["redundant_bus"], can.BusABC):
                 raise TypeError
             self.redundant_bus = kwargs["redundant_bus"]
-            self._redundant_notifier = can.Notifier(self.redundant_bus, [])
-            self._redundant_listener = Listener(self._on_message, self._on_can_error, self.redundant_bus.channel)
+            self._redundant_notifier = kwargs.get("redundant_notifier") or can.Notifier(self.redundant_bus, [])
+            self._redundant_listener = Listener(self._on_message if self.metrics is None else self._on_message_measured, self._on_can_error, self.redundant_bus.channel)
         else:
             self.redundant_bus = None
             self._redundant_notifier = None
@@ -214,25 +293,21 @@ class Node:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self._cancel_timer(self._heartbeat_evaluation_power_on_timer)
         self._reset_timers()
+        self.tpdo_events.stop()
+        self.rpdo_deadlines.stop()
+        if self._own_transmit_scheduler:
+            self.transmit_scheduler.stop()
+        if self._own_scheduler:
+            self.scheduler.stop()
 
     def _activate_rpdo(self, rpdo, rpdo_data):
-        mp_odi = ODI_RPDO1_COMMUNICATON_PARAMETER + rpdo - 1
+        mp_odi = ODI_RPDO1_MAPPING_PARAMETER + rpdo - 1
         if mp_odi not in self.od:
             return
-        rpdo_mp = self.get(mp_odi)
-        rpdo_mp_length = rpdo_mp.get(ODSI_VALUE).value
-        byte_counter = 0
-        for odsi in range(1, rpdo_mp_length + 1):
-            rpdo_mapping = rpdo_mp.get(odsi)
-            index = rpdo_mapping >> 16
-            subindex = (rpdo_mapping >> 8) & 0xFF
-            data_length = rpdo_mapping & 0xFF
-            o = self.od.get(index)
-            so = o.get(subindex)
-            so.value = so.from_bytes(rpdo_data[byte_counter:byte_counter + data_length])
-            byte_counter += data_length
-            o.update({subindex: so})
-            self.od.update({index: o})
+        if self.od.get(mp_odi).get(ODSI_VALUE).value in [PDO_MAPPING_DAM_MPDO, PDO_MAPPING_SAM_MPDO]:
+            self._receive_mpdo(rpdo_data)
+            return
+        self._get_pdo_mapping(mp_odi).unpack(rpdo_data)
 
     def _boot(self, channel):
         logger.info(f"Booting on {channel} with node-ID of {self.id}")
@@ -254,6 +329,48 @@ class Node:
             return True
         return False
 
+    def _tx_template(self, key, cob_id, length):
+        # Returns (msg, lock) for a periodic transmission, reused while its COB-ID and length are unchanged.
+        # Hold the lock while updating msg.data in place and sending.
+        arbitration_id = cob_id & 0x1FFFFFFF
+        is_extended_id = bool(cob_id & 0x20000000)
+        is_fd = length > 8
+        if is_fd:
+            length = fd_length(length)
+        template = self._tx_templates.get(key)
+        if template is not None:
+            msg = template[0]
+            if msg.arbitration_id == arbitration_id and msg.is_extended_id == is_extended_id and len(msg.data) == length:
+                return template
+        template = self._tx_templates[key] = (can.Message(arbitration_id=arbitration_id, is_extended_id=is_extended_id, is_fd=is_fd, bitrate_switch=is_fd, data=bytearray(length)), threading.Lock())
+        return template
+
+    def _get_pdo_mapping(self, mp_odi):
+        # Compiled mappings are invalidated when mapping parameters are written via SDO or communication is reset
+        mapping = self._pdo_mappings.get(mp_odi)
+        if mapping is None:
+            mapping = PdoMapping(self.od, mp_odi, 64 if self.fd else 8)
+            self._pdo_mappings[mp_odi] = mapping
+        return mapping
+
+    def _get_mpdo_scanner(self):
+        scanner = self._pdo_mappings.get(ODI_OBJECT_SCANNER_LIST)
+        if scanner is None:
+            scanner = MpdoScanner(self.od, self.id)
+            self._pdo_mappings[ODI_OBJECT_SCANNER_LIST] = scanner
+        return scanner
+
+    def _get_mpdo_dispatcher(self):
+        dispatcher = self._pdo_mappings.get(ODI_OBJECT_DISPATCHING_LIST)
+        if dispatcher is None:
+            try:
+                dispatcher = MpdoDispatcher(self.od)
+            except ValueError as e: # Cached empty until the list is changed, so it is not compiled for every MPDO
+                logger.error("Object dispatching list ignored: %s", e)
+                dispatcher = MpdoDispatcher(ObjectDictionary({}))
+            self._pdo_mappings[ODI_OBJECT_DISPATCHING_LIST] = dispatcher
+        return dispatcher
+
     def _heartbeat_consumer_timeout(self, id):
         logger.warning(f"Heartbeat consumer timeout for node-ID {id}")
         self._heartbeat_evaluation_counters[id] = 0 # For start service error control during NMT slave boot
@@ -308,7 +425,7 @@ class Node:
         nmt_multiple_master_detect_time = nmt_flying_master_timing_params.get(ODSI_NMT_FLYING_MASTER_TIMING_PARAMS_DETECT_TIME).value / 1000
         with self._nmt_multiple_master_timer_lock:
             self._cancel_timer(self._nmt_multiple_master_timer)
-            self._nmt_multiple_master_timer = IntervalTimer(nmt_multiple_master_detect_time, self._send, [NmtForceFlyingMasterRequest()])
+            self._nmt_multiple_master_timer = IntervalTimer(nmt_multiple_master_detect_time, self._send, [NmtForceFlyingMasterRequest()], on_lag=self._timer_lag_handler("nmt_multiple_master"))
             self._nmt_multiple_master_timer.start()
         threading.Thread(target=self.on_active_nmt_master_won, daemon=True).start()
 
@@ -631,8 +748,13 @@ class Node:
 
     def _on_sdo_download(self, odi, odsi, obj, subobj):
         # Handle special cases
-        if odi == ODI_PREDEFINED_ERROR_FIELD and subobj.value != 0:
-            raise SdoAbort(odi, odsi, SDO_ABORT_INVALID_VALUE)
+        if odi == ODI_PREDEFINED_ERROR_FIELD:
+            if odsi != ODSI_VALUE or subobj.value != 0:
+                if self.error_history is not None:
+                    obj.get(ODSI_VALUE).value = self.error_history.count
+                raise SdoAbort(odi, odsi, SDO_ABORT_INVALID_VALUE)
+            if self.error_history is not None:
+                self.error_history.clear()
         if odi == ODI_REQUEST_NMT:
             if not self.is_active_nmt_master:
                 logger.error("SDO Download to NMT Request aborted; device is not active NMT master")
@@ -655,6 +777,20 @@ class Node:
             # Update Object Dictionary and post-process
             obj.update({odsi: subobj})
             self.od.update({odi: obj})
+            if ODI_RPDO1_MAPPING_PARAMETER <= odi < ODI_RPDO1_MAPPING_PARAMETER + 0x200 or ODI_TPDO1_MAPPING_PARAMETER <= odi < ODI_TPDO1_MAPPING_PARAMETER + 0x200:
+                self._pdo_mappings.pop(odi, None)
+            elif odi == ODI_EMERGENCY_CONSUMER_OBJECT:
+                self._emcy_consumers = None
+            elif ODI_OBJECT_SCANNER_LIST <= odi < ODI_OBJECT_DISPATCHING_LIST:
+                self._pdo_mappings.pop(ODI_OBJECT_SCANNER_LIST, None)
+            elif ODI_OBJECT_DISPATCHING_LIST <= odi < ODI_OBJECT_DISPATCHING_LIST + 0x30:
+                self._pdo_mappings.pop(ODI_OBJECT_DISPATCHING_LIST, None)
+            if 0x1000 <= odi <= 0x1FFF:
+                self._invalidate_routes()
+            if ODI_TPDO1_COMMUNICATION_PARAMETER <= odi < ODI_TPDO1_COMMUNICATION_PARAMETER + 0x200 or ODI_TPDO1_MAPPING_PARAMETER <= odi < ODI_TPDO1_MAPPING_PARAMETER + 0x200:
+                self.tpdo_events.restart()
+            if ODI_RPDO1_COMMUNICATION_PARAMETER <= odi < ODI_RPDO1_COMMUNICATION_PARAMETER + 0x200:
+                self.rpdo_deadlines.restart()
             if odi in [ODI_SYNC, ODI_SYNC_TIME]:
                 self._process_sync()
             elif odi == ODI_HEARTBEAT_PRODUCER_TIME:
@@ -663,6 +799,18 @@ class Node:
 
     def _on_sync(self):
         self._sync_counter = (self._sync_counter + 1) % 241
+        if self.metrics is not None:
+            now = time.monotonic()
+            if self._last_sync_time is not None:
+                sync_time = 0
+                sync_time_object = self.od.get(ODI_SYNC_TIME)
+                if sync_time_object is not None:
+                    sync_time_value = sync_time_object.get(ODSI_VALUE)
+                    if sync_time_value is not None and sync_time_value.value is not None:
+                        sync_time = sync_time_value.value / 1000000
+                if sync_time:
+                    self.metrics.sync_jitter.observe(abs(now - self._last_sync_time - sync_time), self.id)
+            self._last_sync_time = now
 
         if (
             (self.active_bus.channel == self.default_bus.channel and self._nmt_state == NMT_STATE_OPERATIONAL)
@@ -671,20 +819,18 @@ class Node:
         ):
             for i in range(0, 0x200):
                 cp_odi = ODI_RPDO1_COMMUNICATION_PARAMETER + i
-                if odi not in self.od:
+                if cp_odi not in self.od:
                     continue
                 rpdo_cp = self.od.get(cp_odi)
-                rpdo_cob_id = self.rpdo_cp.get(ODSI_PDO_COMM_PARAM_ID).value
+                rpdo_cob_id = rpdo_cp.get(ODSI_PDO_COMM_PARAM_ID).value
                 if (rpdo_cob_id & 0x1FFFFFFF) not in self._rpdo_data:
                     continue
-                rpdo_data = self._rpdo_data[rpdo_cob_id]
-                del self._rpdo_data[rpdo_cob_id]
+                rpdo_data = self._rpdo_data.pop(rpdo_cob_id & 0x1FFFFFFF)
                 if rpdo_cob_id & 0x80000000:
                     continue
                 rpdo_type = rpdo_cp.get(ODSI_PDO_COMM_PARAM_TYPE).value
                 if rpdo_type > 0xF0:
                     continue
-                mp_odi = ODI_RPDO1_MAPPING_PARAMETER + i
                 self._activate_rpdo(i + 1, rpdo_data)
 
         for i in range(0, 0x200):
@@ -700,7 +846,8 @@ class Node:
                 tpdo_cp_type is None or
                 tpdo_cp_type.value is None or
                 ((tpdo_cp_type.value == 0 or tpdo_cp_type.value == 0xFC) and not self._tpdo_triggers.get(i, False)) or
-                ((tpdo_cp_type.value > 0 and tpdo_cp_type.value < 0xF1) and (self._sync_counter % tpdo_cp_type.value) != 0)
+                ((tpdo_cp_type.value > 0 and tpdo_cp_type.value < 0xF1) and (self._sync_counter % tpdo_cp_type.value) != 0) or
+                tpdo_cp_type.value > 0xFC # RTR-only and event-driven TPDOs are not sent on SYNC
             ):
                 continue
             self._send_pdo(i + 1)
@@ -727,9 +874,31 @@ class Node:
         with self._heartbeat_producer_timer_lock:
             self._cancel_timer(self._heartbeat_producer_timer)
             if heartbeat_producer_time != 0:
-                self._heartbeat_producer_timer = IntervalTimer(heartbeat_producer_time, self._send_heartbeat)
+                self._heartbeat_producer_timer = IntervalTimer(heartbeat_producer_time, self._send_heartbeat, on_lag=self._timer_lag_handler("heartbeat"))
                 self._heartbeat_producer_timer.start()
 
+    def _on_message_measured(self, msg: can.Message):
+        start = time.perf_counter()
+        self._on_message(msg)
+        elapsed = time.perf_counter() - start
+        function = None if msg.is_extended_id else Metrics.function_name(msg.arbitration_id)
+        self.metrics.frames_received.inc(self.id, function)
+        self.metrics.message_time.observe(elapsed, self.id, function)
+        if msg.is_remote_frame:
+            return
+        if function == "nmt_error_control":
+            producer_id = msg.arbitration_id & 0x7F
+            now = time.monotonic()
+            last = self._last_heartbeat_times.get(producer_id)
+            if last is not None:
+                self.metrics.heartbeat_interval.observe(now - last, self.id, producer_id)
+            self._last_heartbeat_times[producer_id] = now
+
+    def _timer_lag_handler(self, timer):
+        if self.metrics is None:
+            return None
+        return lambda lag: self.metrics.timer_lag.observe(lag, self.id, timer)
+
     def _on_message(self, msg: can.Message):
         can_id = msg.arbitration_id
         data = msg.data
@@ -743,8 +912,8 @@ class Node:
                     tpdo_cp = self.od.get(ODI_TPDO1_COMMUNICATION_PARAMETER + tpdo - 1)
                     if tpdo_cp is not None:
                         tpdo_cp_id = tpdo_cp.get(ODSI_PDO_COMM_PARAM_ID)
-                        if tpdo_cp_id is not None and (tpdo_cp_id >> TPDO_COMM_PARAM_ID_VALID_BITNUM) & 1 == 0 and (tpdo_cp_id >> TPDO_COMM_PARAM_ID_RTR_BITNUM) & 1 == 0:
-                            tpdo_cp_type = tpdo_cp.get(ODSI_PDO_COMM_PARAM_TYPE)
+                        if tpdo_cp_id is not None and (tpdo_cp_id.value >> TPDO_COMM_PARAM_ID_VALID_BITNUM) & 1 == 0 and (tpdo_cp_id.value >> TPDO_COMM_PARAM_ID_RTR_BITNUM) & 1 == 0:
+                            tpdo_cp_type = tpdo_cp.get(ODSI_PDO_COMM_PARAM_TYPE).value
                             if tpdo_cp_type == 0xFC:
                                 self._tpdo_triggers[tpdo - 1] = True; # Defer until SYNC event
                             elif tpdo_cp_type == 0xFD:
@@ -767,7 +936,7 @@ class Node:
                         self.reset_communication(msg.channel)
             elif command == NMT_MASTER_NODE_ID: # Response from either an NmtActiveMasterRequest, NmtFlyingMasterRequest, or unsolicited from non-Flying Master after bootup was indicated
                 if self.is_nmt_master_capable:
-                    logger.debug(f"Active NMT flying master detected with node-ID {data[1]}")
+                    logger.debug("Active NMT flying master detected with node-ID %s", data[1])
                     compare_priority = False
                     self._nmt_active_master_id = data[1]
                     with self._nmt_active_master_timer_lock:
@@ -819,7 +988,7 @@ class Node:
                     self._heartbeat_evaluation_counters[producer_id] += 1
                 else:
                     self._heartbeat_evaluation_counters[producer_id] = 1
-                logger.debug(f"Heartbeat evaluated for node-ID {producer_id} with count of {self._heartbeat_evaluation_counters[producer_id]}")
+                logger.debug("Heartbeat evaluated for node-ID %s with count of %s", producer_id, self._heartbeat_evaluation_counters[producer_id])
 
             if producer_id in self._heartbeat_consumer_timers:
                 with self._heartbeat_consumer_timers_lock:
@@ -907,19 +1076,12 @@ class Node:
             if self._nmt_state in [NMT_STATE_PREOPERATIONAL, NMT_STATE_OPERATIONAL]:
 
                 # EMCY
-                emcy_consumer_object= self.od.get(ODI_EMERGENCY_CONSUMER_OBJECT)
-                if emcy_consumer_object is not None:
-                    subobjs = 0
-                    for subindex, subobj in emcy_consumer_object.items():
-                        if subindex == 0:
-                            subobjs = subobj.value
-                            continue
-                        if subindex > subobjs:
-                            break
-                        if subobj.value == can_id:
-                            eec, er = struct.unpack("<HB", data[0:3])
-                            msef = int.from_bytes(data[3:], byteorder="little")
-                            self.on_emcy(can_id, eec, er, msef)
+                if self._emcy_consumers is None:
+                    self._emcy_consumers = self._build_emcy_consumers()
+                if (can_id | (0x20000000 if msg.is_extended_id else 0)) in self._emcy_consumers and len(data) >= 3:
+                    eec, er = struct.unpack("<HB", data[0:3])
+                    msef = int.from_bytes(data[3:], byteorder="little")
+                    self.on_emcy(can_id, eec, er, msef)
 
                 # TIME
                 if msg.channel == self.active_bus.channel: # CiA 302-6, Section 4.3.2.3
@@ -935,17 +1097,19 @@ class Node:
                    (msg.channel == self.default_bus.channel and self._nmt_state in [NMT_STATE_PREOPERATIONAL, NMT_STATE_OPERATIONAL])
                    or
                    (self.redundant_bus is not None and msg.channel == self.redundant_bus.channel and self._redundant_nmt_state in [NMT_STATE_PREOPERATIONAL, NMT_STATE_OPERATIONAL])
-               ) and len(data) == 8: # Ignore SDO if data is not 8 bytes
+               ) and (len(data) == 8 or msg.is_fd): # Ignore SDO if data is not 8 bytes, unless FD SDO
 
                 # SDO server (request)
                 sdo_server_object = self.od.get(ODI_SDO_SERVER)
                 if sdo_server_object is not None:
                     sdo_server_csid = sdo_server_object.get(ODSI_SDO_SERVER_DEFAULT_CSID)
-                    if sdo_server_csid is not None and (sdo_server_csid.value & 0x1FFFFFFF) == can_id:
+                    if sdo_server_csid is not None and (sdo_server_csid.value & 0x1FFFFFFF) == can_id and msg.is_fd and self.fd_sdo_server:
+                        self._on_fd_sdo_request(msg, sdo_server_object)
+                    elif sdo_server_csid is not None and (sdo_server_csid.value & 0x1FFFFFFF) == can_id and len(data) == 8:
                         try:
                             ccs = (data[0] & SDO_CS_MASK) >> SDO_CS_BITNUM
                             if self._sdo_cs == SDO_SCS_BLOCK_DOWNLOAD and self._sdo_seqno > 0:
-                                logger.info(f"SDO block download sub-block for mux 0x{self._sdo_odi:02X}{solf_sdo_osdi:04X}")
+                                logger.info("SDO block download sub-block for mux 0x%04X%02X", self._sdo_odi, self._sdo_odsi)
                                 c = data[0] >> 7
                                 seqno = data[0] & 0x7F
                                 if self._sdo_seqno != seqno:
@@ -978,7 +1142,8 @@ class Node:
                                     else:
                                         raise SdoAbort(odi, odsi, SDO_ABORT_OBJECT_DNE)
                                 if ccs == SDO_CS_ABORT:
-                                    logger.info(f"SDO abort request for mux 0x{odi:04X}{odsi:02X}")
+                                    logger.info("SDO abort request for mux 0x%04X%02X", odi, odsi)
+                                    self._count_sdo_abort("received", int.from_bytes(data[4:8], byteorder="little"))
                                     self._sdo_cs = None
                                     self._sdo_data = None
                                     self._sdo_len = None
@@ -988,7 +1153,7 @@ class Node:
                                     self._sdo_t = None
                                     return
                                 elif ccs == SDO_CCS_DOWNLOAD_INITIATE:
-                                    logger.info(f"SDO download initiate request for mux 0x{odi:04X}{odsi:02X}")
+                                    logger.info("SDO download initiate request for mux 0x%04X%02X", odi, odsi)
                                     if subobj.access_type in [AccessType.RO, AccessType.CONST]:
                                         raise SdoAbort(odi, odsi, SDO_ABORT_RO)
                                     scs = SDO_SCS_DOWNLOAD_INITIATE
@@ -997,7 +1162,7 @@ class Node:
                                     data_type_index = subobj.data_type
                                     if e == 1 and s == 1:
                                         n = (data[0] & SDO_INITIATE_N_MASK) >> SDO_INITIATE_N_BITNUM
-                                        subobj.value = subobj.from_bytes(data[4:8-n])
+                                        self._sdo_store(odi, odsi, subobj, data[4:8-n])
                                         self._on_sdo_download(odi, odsi, obj, subobj)
                                     elif e == 1 and s == 0:
                                         n = 0 # Unspecified number of bytes, default to all
@@ -1005,7 +1170,7 @@ class Node:
                                             data_type_object = self.od.get(data_type_index)
                                             if ODSI_VALUE in data_type_object:
                                                 n = 4 - max(1, data_type_object.get(ODSI_VALUE).value // 8)
-                                        subobj.value = subobj.from_bytes(data[4:8-n])
+                                        self._sdo_store(odi, odsi, subobj, data[4:8-n])
                                         self._on_sdo_download(odi, odsi, obj, subobj)
                                     elif e == 0 and s == 1: # Normal (non-expedited) SDO
                                         self._sdo_odi = odi
@@ -1024,7 +1189,7 @@ class Node:
                                     if self._sdo_data is None:
                                         logger.error("SDO Download Segment Request aborted, initate not received or aborted")
                                         raise SdoAbort(0, 0, SDO_ABORT_INVALID_CS) # Initiate not receieved or aborted
-                                    logger.info(f"SDO download segment request for mux 0x{self._sdo_odi:04X}{self._sdo_odsi:02X}")
+                                    logger.info("SDO download segment request for mux 0x%04X%02X", self._sdo_odi, self._sdo_odsi)
                                     scs = SDO_SCS_DOWNLOAD_SEGMENT
                                     t = (data[0] >> SDO_T_BITNUM) & 1
                                     if self._sdo_t != t:
@@ -1036,7 +1201,7 @@ class Node:
                                     if c == 1:
                                         obj = self.od.get(self._sdo_odi)
                                         subobj = obj.get(self._sdo_odsi)
-                                        subobj.value = subobj.from_bytes(self._sdo_data)
+                                        self._sdo_store(self._sdo_odi, self._sdo_odsi, subobj, bytes(self._sdo_data))
                                         self._on_sdo_download(self._sdo_odi, self._sdo_odsi, obj, subobj)
                                         self._sdo_data = None
                                         self._sdo_data_type = None
@@ -1046,7 +1211,7 @@ class Node:
                                         self._sdo_t = None
                                     data = struct.pack("<B7x", (scs << SDO_CS_BITNUM) + (t << SDO_T_BITNUM))
                                 elif ccs == SDO_CCS_UPLOAD_INITIATE:
-                                    logger.info(f"SDO upload initiate request for mux 0x{odi:04X}{odsi:02X}")
+                                    logger.info("SDO upload initiate request for mux 0x%04X%02X", odi, odsi)
                                     if subobj.access_type == AccessType.WO:
                                         raise SdoAbort(odi, odsi, SDO_ABORT_WO)
                                     if odsi != ODSI_VALUE and obj.get(ODSI_VALUE).value < odsi:
@@ -1084,12 +1249,12 @@ class Node:
                                         s = 1
                                         e = 1
                                         sdo_data = bytes(subobj)
-                                    data = struct.pack("<BHB4s", (scs << SDO_CS_BITNUM) + (n << SDO_INITIATE_N_BITNUM) + (e << SDO_E_BITNUM), odi, odsi, sdo_data)
+                                    data = struct.pack("<BHB4s", (scs << SDO_CS_BITNUM) + (n << SDO_INITIATE_N_BITNUM) + (e << SDO_E_BITNUM) + (s << SDO_S_BITNUM), odi, odsi, sdo_data)
                                 elif ccs == SDO_CCS_UPLOAD_SEGMENT:
                                     if self._sdo_data is None:
                                         logger.error("SDO upload initiate request aborted, initiate not received or aborted")
                                         raise SdoAbort(0, 0, SDO_ABORT_INVALID_CS) # Initiate not receieved or aborted
-                                    logger.info(f"SDO upload segment request for mux 0x{self._sdo_odi:04X}{self._sdo_odsi:02X}")
+                                    logger.info("SDO upload segment request for mux 0x%04X%02X", self._sdo_odi, self._sdo_odsi)
                                     scs = SDO_SCS_UPLOAD_SEGMENT
                                     t = (data[0] >> SDO_T_BITNUM) & 1
                                     if self._sdo_t != t:
@@ -1117,7 +1282,7 @@ class Node:
                                     scs = SDO_SCS_BLOCK_DOWNLOAD
                                     cs = data[0] & 0x01
                                     if cs == SDO_BLOCK_SUBCOMMAND_INITIATE:
-                                        logger.info(f"SDO block download initiate request for mux 0x{odi:04X}{odsi:02X}")
+                                        logger.info("SDO block download initiate request for mux 0x%04X%02X", odi, odsi)
                                         if subobj.access_type in [AccessType.RO, AccessType.CONST]:
                                             raise SdoAbort(odi, odsi, SDO_ABORT_RO)
                                         if odsi != ODSI_VALUE and obj.get(ODSI_VALUE).value < odsi:
@@ -1146,16 +1311,16 @@ class Node:
                                     else: # SDO_BLOCK_SUBCOMMAND_END
                                         if self._sdo_cs != SDO_SCS_BLOCK_DOWNLOAD:
                                             raise SdoAbort(0, 0, SDO_ABORT_INVALID_CS)
-                                        logger.info(f"SDO block download end request for mux 0x{self._sdo_odi:04X}{self._sdo_odsi:02X}")
+                                        logger.info("SDO block download end request for mux 0x%04X%02X", self._sdo_odi, self._sdo_odsi)
                                         n = (data[0] >> 2) & 0x07
-                                        self._sdo_data = self._sdo_data[0:-n]
+                                        self._sdo_data = self._sdo_data[0:len(self._sdo_data) - n]
                                         if self._sdo_t: # Check CRC
                                             crc, = struct.unpack("<H", data[1:3])
                                             if crc != crc_hqx(bytes(self._sdo_data), 0):
                                                 raise SdoAbort(self._sdo_odi, self._sdo_odsi, SDO_ABORT_CRC_ERROR)
                                         obj = self.od.get(self._sdo_odi)
                                         subobj = obj.get(self._sdo_odsi)
-                                        subobj.value = subobj.from_bytes(self._sdo_data)
+                                        self._sdo_store(self._sdo_odi, self._sdo_odsi, subobj, bytes(self._sdo_data))
                                         self._on_sdo_download(self._sdo_odi, self._sdo_odsi, obj, subobj)
                                         self._sdo_cs = None
                                         self._sdo_data = None
@@ -1180,7 +1345,7 @@ class Node:
                                             data_type_length = os.fstat(subobj.value.fileno()).st_size
                                         if data_type_index in self.od:
                                             data_type_object = self.od.get(data_type_index)
-                                            if ODSI_VALUE in data_type_object:
+                                            if ODSI_VALUE in data_type_object and data_type_object.get(ODSI_VALUE).value: # Zero for variable length
                                                 data_type_length = data_type_object.get(ODSI_VALUE).value // 8
                                         if data_type_length is None:
                                             s = 0
@@ -1198,12 +1363,12 @@ class Node:
                                         self._sdo_len = blksize
                                         self._sdo_odi = odi
                                         self._sdo_odsi = odsi
-                                        logger.info(f"SDO block upload initiate request for mux 0x{self._sdo_odi:04X}{self._sdo_odsi:02X}")
+                                        logger.info("SDO block upload initiate request for mux 0x%04X%02X", self._sdo_odi, self._sdo_odsi)
                                         data = struct.pack("<BHBI", (scs << SDO_CS_BITNUM) + (sc << SDO_BLOCK_SC_BITNUM) + (s << SDO_BLOCK_S_BITNUM) + SDO_BLOCK_SUBCOMMAND_INITIATE, self._sdo_odi, self._sdo_odsi, size)
                                     elif cs == SDO_BLOCK_SUBCOMMAND_START:
                                         if self._sdo_cs != SDO_SCS_BLOCK_UPLOAD:
                                             raise SdoAbort(0, 0, SDO_ABORT_INVALID_CS);
-                                        logger.info(f"SDO block upload start request for mux 0x{self._sdo_odi:04X}{self._sdo_odsi:02X}")
+                                        logger.info("SDO block upload start request for mux 0x%04X%02X", self._sdo_odi, self._sdo_odsi)
                                         self._sdo_seqno = 1
                                         if hasattr(self._sdo_data, "fileno"):
                                             data_len = os.fstat(self._sdo_data.fileno()).st_size
@@ -1262,9 +1427,9 @@ class Node:
                                             data_len = os.fstat(self._sdo_data.fileno()).st_size - self._sdo_data.tell()
                                         else:
                                             data_len = len(self._sdo_data)
-                                        logger.info(f"SDO block upload response for mux 0x{self._sdo_odi:04X}{self._sdo_odsi:02X}, {data_len} bytes remaining")
+                                        logger.info("SDO block upload response for mux 0x%04X%02X, %s bytes remaining", self._sdo_odi, self._sdo_odsi, data_len)
                                         if data_len <= 0:
-                                            logging.info(self._sdo_data)
+                                            logger.debug("SDO block upload data: %s", self._sdo_data)
                                             if hasattr(self._sdo_data, "seek"):
                                                 self._sdo_data.seek(0, io.SEEK_SET)
                                                 crc = crc_hqx(self._sdo_data.read(), 0)
@@ -1298,9 +1463,9 @@ class Node:
                                             return
                                     else: # SDO_BLOCK_SUBCOMMAND_END
                                         if self._sdo_cs != SDO_SCS_BLOCK_UPLOAD:
-                                            logger.error(f"SDO Request aborted, invalid cs: {ccs:d}")
+                                            logger.error("SDO Request aborted, invalid cs: %d", ccs)
                                             raise SdoAbort(0, 0, SDO_ABORT_INVALID_CS);
-                                        logger.info(f"SDO block upload end request for mux 0x{self._sdo_odi:04X}{self._sdo_odsi:02X}")
+                                        logger.info("SDO block upload end request for mux 0x%04X%02X", self._sdo_odi, self._sdo_odsi)
                                         self._sdo_cs = None
                                         self._sdo_data = None
                                         self._sdo_len = None
@@ -1312,7 +1477,8 @@ class Node:
                                 else:
                                     raise SdoAbort(0, 0, SDO_ABORT_INVALID_CS)
                         except SdoAbort as a:
-                            logger.error(f"SDO aborted for mux 0x{a.index:04X}{a.subindex:02X} with error code 0x{a.code:08X}")
+                            logger.error("SDO aborted for mux 0x%04X%02X with error code 0x%08X", a.index, a.subindex, a.code)
+                            self._count_sdo_abort("sent", a.code)
                             self._sdo_seqno = 0
                             self._sdo_data = None
                             self._sdo_len = None
@@ -1349,7 +1515,7 @@ class Node:
                     if sdo_request is not None:
                         sdo_request.respond(msg.data)
                     else:
-                        logger.warning(f"SDO message discarded with CAN ID {can_id:03X}, no match for {sdo_client_rx_can_id:03X}")
+                        logger.warning("SDO message discarded with CAN ID %03X, no match for %03X", can_id, sdo_client_rx_can_id)
 
             # RPDO
             if (
@@ -1359,11 +1525,12 @@ class Node:
             ):
                 for i in range(0, 0x200):
                     cp_odi = ODI_RPDO1_COMMUNICATION_PARAMETER + i
-                    if odi in self.od:
+                    if cp_odi in self.od:
                         rpdo_cp = self.od.get(cp_odi)
-                        rpdo_cob_id = self.rpdo_cp.get(ODSI_PDO_COMM_PARAM_ID).value
+                        rpdo_cob_id = rpdo_cp.get(ODSI_PDO_COMM_PARAM_ID).value
                         if rpdo_cob_id & 0x80000000 or msg.arbitration_id != (rpdo_cob_id & 0x1FFFFFFF):
                             continue
+                        self.rpdo_deadlines.received(msg.arbitration_id)
                         rpdo_type = rpdo_cp.get(ODSI_PDO_COMM_PARAM_TYPE).value
                         if rpdo_type < 0xF1:
                             self._rpdo_data[msg.arbitration_id] = msg.data
@@ -1372,6 +1539,127 @@ class Node:
 
             threading.Thread(target=self.on_message, args=(msg,), daemon=True).start()
 
+    def _sdo_store(self, odi, odsi, subobj, data):
+        # Writes downloaded data; aborts if it does not fit, e.g. an object bound to a process image
+        try:
+            subobj.value = subobj.from_bytes(data)
+        except OverflowError:
+            raise SdoAbort(odi, odsi, SDO_ABORT_PARAMETER_LENGTH)
+
+    def _on_fd_sdo_request(self, msg, sdo_server_object):
+        data = msg.data
+        cs = data[0]
+        session = data[1]
+        odi = self._fd_sdo_odi or 0
+        odsi = self._fd_sdo_odsi or 0
+        try:
+            if cs in [FD_SDO_CS_ABORT, FD_SDO_CS_DOWNLOAD_EXPEDITED, FD_SDO_CS_DOWNLOAD_INITIATE, FD_SDO_CS_UPLOAD_EXPEDITED]:
+                _, _, odi, odsi = struct.unpack_from(FD_SDO_HEADER_FORMAT, data)
+                obj = self.od.get(odi)
+                if obj is None:
+                    raise SdoAbort(odi, odsi, SDO_ABORT_OBJECT_DNE)
+                subobj = obj.get(odsi)
+                if subobj is None:
+                    raise SdoAbort(odi, odsi, SDO_ABORT_SUBINDEX_DNE)
+            if cs == FD_SDO_CS_ABORT:
+                logger.info("FD SDO abort request for mux 0x%04X%02X", odi, odsi)
+                self._count_sdo_abort("received", int.from_bytes(data[5:9], byteorder="little"))
+                self._fd_sdo_data = None
+                self._fd_sdo_session = None
+                return
+            elif cs in [FD_SDO_CS_DOWNLOAD_EXPEDITED, FD_SDO_CS_DOWNLOAD_INITIATE]:
+                logger.info("FD SDO download request for mux 0x%04X%02X", odi, odsi)
+                if subobj.access_type in [AccessType.RO, AccessType.CONST]:
+                    raise SdoAbort(odi, odsi, SDO_ABORT_RO)
+                if cs == FD_SDO_CS_DOWNLOAD_EXPEDITED:
+                    size = data[5]
+                    if size > len(data) - 6 or (subobj.size is not None and size != subobj.size):
+                        raise SdoAbort(odi, odsi, SDO_ABORT_PARAMETER_LENGTH)
+                    self._sdo_store(odi, odsi, subobj, bytes(data[6:6 + size]))
+                    self._on_sdo_download(odi, odsi, obj, subobj)
+                else:
+                    self._fd_sdo_len = struct.unpack_from("<I", data, 5)[0]
+                    if self._fd_sdo_len == 0 or (subobj.size is not None and self._fd_sdo_len != subobj.size):
+                        raise SdoAbort(odi, odsi, SDO_ABORT_PARAMETER_LENGTH)
+                    self._fd_sdo_data = bytearray()
+                    self._fd_sdo_odi = odi
+                    self._fd_sdo_odsi = odsi
+                    self._fd_sdo_seqno = 0
+                    self._fd_sdo_session = session
+                response = struct.pack(FD_SDO_HEADER_FORMAT, cs | FD_SDO_CS_RESPONSE, session, odi, odsi)
+            elif cs & ~FD_SDO_CS_LAST_SEGMENT == FD_SDO_CS_DOWNLOAD_SEGMENT:
+                _, _, seqno, size = struct.unpack_from(FD_SDO_SEGMENT_HEADER_FORMAT, data)
+                if self._fd_sdo_session != session or not isinstance(self._fd_sdo_data, bytearray):
+                    raise SdoAbort(odi, odsi, SDO_ABORT_INVALID_CS) # Initiate not received or aborted
+                if seqno != self._fd_sdo_seqno:
+                    raise SdoAbort(odi, odsi, SDO_ABORT_INVALID_SEQNO)
+                self._fd_sdo_seqno = (seqno + 1) & 0xFF
+                self._fd_sdo_data += data[4:4 + size]
+                if cs & FD_SDO_CS_LAST_SEGMENT:
+                    if len(self._fd_sdo_data) != self._fd_sdo_len:
+                        raise SdoAbort(odi, odsi, SDO_ABORT_PARAMETER_LENGTH)
+                    obj = self.od.get(odi)
+                    subobj = obj.get(odsi)
+                    self._sdo_store(odi, odsi, subobj, bytes(self._fd_sdo_data))
+                    self._fd_sdo_data = None
+                    self._fd_sdo_session = None
+                    self._on_sdo_download(odi, odsi, obj, subobj)
+                response = struct.pack(FD_SDO_SEGMENT_HEADER_FORMAT, cs | FD_SDO_CS_RESPONSE, session, seqno, 0)
+            elif cs == FD_SDO_CS_UPLOAD_EXPEDITED:
+                logger.info("FD SDO upload request for mux 0x%04X%02X", odi, odsi)
+                if subobj.access_type == AccessType.WO:
+                    raise SdoAbort(odi, odsi, SDO_ABORT_WO)
+                if odsi != ODSI_VALUE and obj.get(ODSI_VALUE).value < odsi:
+                    raise SdoAbort(odi, odsi, SDO_ABORT_NO_DATA)
+                if hasattr(subobj.value, "read"):
+                    subobj.value.seek(0)
+                    fd_sdo_data = subobj.value.read()
+                else:
+                    fd_sdo_data = bytes(subobj)
+                if len(fd_sdo_data) <= FD_SDO_MAX_EXPEDITED_SIZE:
+                    response = struct.pack(FD_SDO_HEADER_FORMAT + "B", cs | FD_SDO_CS_RESPONSE, session, odi, odsi, len(fd_sdo_data)) + fd_sdo_data
+                else:
+                    self._fd_sdo_data = fd_sdo_data
+                    self._fd_sdo_len = len(fd_sdo_data)
+                    self._fd_sdo_odi = odi
+                    self._fd_sdo_odsi = odsi
+                    self._fd_sdo_seqno = 0
+                    self._fd_sdo_session = session
+                    response = struct.pack(FD_SDO_HEADER_FORMAT + "I", FD_SDO_CS_UPLOAD_INITIATE | FD_SDO_CS_RESPONSE, session, odi, odsi, len(fd_sdo_data))
+            elif cs == FD_SDO_CS_UPLOAD_SEGMENT:
+                seqno = data[2]
+                if self._fd_sdo_session != session or not isinstance(self._fd_sdo_data, bytes):
+                    raise SdoAbort(odi, odsi, SDO_ABORT_INVALID_CS) # Initiate not received or aborted
+                if seqno != self._fd_sdo_seqno:
+                    raise SdoAbort(odi, odsi, SDO_ABORT_INVALID_SEQNO)
+                self._fd_sdo_seqno = (seqno + 1) & 0xFF
+                segment = self._fd_sdo_data[:FD_SDO_MAX_SEGMENT_SIZE]
+                self._fd_sdo_data = self._fd_sdo_data[FD_SDO_MAX_SEGMENT_SIZE:]
+                if not self._fd_sdo_data:
+                    cs |= FD_SDO_CS_LAST_SEGMENT
+                    self._fd_sdo_data = None
+                    self._fd_sdo_session = None
+                response = struct.pack(FD_SDO_SEGMENT_HEADER_FORMAT, cs | FD_SDO_CS_RESPONSE, session, seqno, len(segment)) + segment
+            else:
+                raise SdoAbort(odi, odsi, SDO_ABORT_INVALID_CS)
+        except SdoAbort as a:
+            logger.error("FD SDO aborted for mux 0x%04X%02X with error code 0x%08X", a.index, a.subindex, a.code)
+            self._count_sdo_abort("sent", a.code)
+            self._fd_sdo_data = None
+            self._fd_sdo_session = None
+            response = struct.pack(FD_SDO_HEADER_FORMAT + "I", FD_SDO_CS_ABORT, session, a.index, a.subindex, a.code)
+        sdo_server_scid = sdo_server_object.get(ODSI_SDO_SERVER_DEFAULT_SCID)
+        if sdo_server_scid is None:
+            raise ValueError("SDO Server SCID not specified")
+        self._send(can.Message(
+            arbitration_id=sdo_server_scid.value & 0x1FFFFFFF,
+            is_extended_id=bool(sdo_server_scid.value & 0x20000000),
+            is_fd=True,
+            bitrate_switch=True,
+            data=response.ljust(fd_length(len(response)), b"\x00"),
+            channel=msg.channel
+        ), msg.channel)
+
     def _process_sync(self):
         sync_object = self.od.get(ODI_SYNC)
         if sync_object is not None:
@@ -1392,13 +1680,11 @@ class Node:
         with self._sync_timer_lock:
             self._cancel_timer(self._sync_timer)
             if is_sync_producer and sync_time != 0:
-                self._sync_timer = IntervalTimer(sync_time, self._send_sync)
+                self._sync_timer = IntervalTimer(sync_time, self._send_sync, on_lag=self._timer_lag_handler("sync"))
                 self._sync_timer.start()
 
     def _reset_timers(self):
-        with self._message_timers_lock:
-            for t in self._message_timers:
-                self._cancel_timer(t)
+        self._inhibit.reset()
         with self._heartbeat_consumer_timers_lock:
             for i, t in self._heartbeat_consumer_timers.items():
                 self._cancel_timer(t)
@@ -1418,8 +1704,19 @@ class Node:
             self._cancel_timer(self._nmt_multiple_master_timer)
 
     def _sdo_block_upload_request(self, node_id, index, subindex):
+        if self.fd and node_id in self.fd_sdo_servers: # FD SDO has no block transfer
+            return self._fd_sdo_upload_request(node_id, index, subindex)
         blk_size = 0x7F
-        response = self._sdo_request(index, subindex, SdoBlockUploadInitiateRequest(node_id, index, subindex, blk_size=blk_size))
+        request = self._prepare_sdo_request(index, subindex, SdoBlockUploadInitiateRequest(node_id, index, subindex, blk_size=blk_size))
+        event = self._sdo_requests[request.arbitration_id] # Kept until the transfer ends, so no segment is missed
+        try:
+            return self._sdo_block_upload(node_id, index, subindex, blk_size, request, event)
+        finally:
+            if self._sdo_requests.get(request.arbitration_id) is event:
+                del self._sdo_requests[request.arbitration_id]
+
+    def _sdo_block_upload(self, node_id, index, subindex, blk_size, request, event):
+        response = self._sdo_request(index, subindex, request, event)
         if (response[0] >> SDO_CS_BITNUM) == SDO_SCS_UPLOAD_INITIATE: # Protocol switch
             return self._on_sdo_upload_response(node_id, index, subindex, response)
         if (response[0] >> SDO_CS_BITNUM) != SDO_SCS_BLOCK_UPLOAD:
@@ -1433,41 +1730,40 @@ class Node:
             size = None
         ackseq = 1
         data = []
-        dummy_request = SdoBlockUploadResponse(node_id, ackseq, blk_size)
-        response = self._sdo_request(index, subindex, SdoBlockUploadStartRequest(node_id))
+        response = self._sdo_request(index, subindex, SdoBlockUploadStartRequest(node_id), event)
         while True:
             complete = (response[0] & SDO_BLOCK_C_MASK) >> SDO_BLOCK_C_BITNUM
             seqno = response[0] & SDO_BLOCK_SEQNO_MASK
             if seqno != ackseq:
-                logger.error(f"SDO Abort for node-ID {node_id} @ mux {index:04X}{subindex:02X}, expected seqno {ackseq}, received {seqno}")
+                logger.error("SDO Abort for node-ID %s @ mux %04X%02X, expected seqno %s, received %s", node_id, index, subindex, ackseq, seqno)
                 raise SdoAbort(index, subindex, SDO_ABORT_INVALID_SEQNO)
             data += response[1:8]
             if complete:
-                response = self._sdo_request(index, subindex, SdoBlockUploadResponse(node_id, ackseq, blk_size))
+                response = self._sdo_request(index, subindex, SdoBlockUploadResponse(node_id, ackseq, blk_size), event)
                 break
             if ackseq == blk_size:
-                response = self._sdo_request(index, subindex, SdoBlockUploadResponse(node_id, ackseq, blk_size))
+                response = self._sdo_request(index, subindex, SdoBlockUploadResponse(node_id, ackseq, blk_size), event)
                 ackseq = 1
             else:
                 ackseq += 1
-                self._prepare_sdo_request(index, subindex, dummy_request) # Enable listener
-                response = self._sdo_response(index, subindex, dummy_request) # Wait for message
+                response = self._sdo_response(index, subindex, request, event) # Next segment
         if (response[0] >> SDO_CS_BITNUM) != SDO_SCS_BLOCK_UPLOAD:
             raise SdoAbort(index, subindex, SDO_ABORT_INVALID_CS)
         if (response[0] & SDO_BLOCK_SS_MASK) >> SDO_BLOCK_SS_BITNUM != SDO_BLOCK_SUBCOMMAND_END:
             raise SdoAbort(index, subindex, SDO_ABORT_INVALID_CS)
         n = (response[0] & SDO_BLOCK_N_MASK) >> SDO_BLOCK_N_BITNUM
-        data = data[0:-n]
+        data = data[0:len(data) - n]
         if size is not None and size != len(data):
             raise SdoAbort(index, subindex, SDO_ABORT_PARAMETER_LENGTH)
         crc = struct.unpack("<H", response[1:3])[0]
         if crc != crc_hqx(bytes(data), 0):
-            logger.error(f"SDO aborted, calculated 0x{crc_hqx(bytes(data), 0):04X}, received 0x{crc:04X}")
+            logger.error("SDO aborted, calculated 0x%04X, received 0x%04X", crc_hqx(bytes(data), 0), crc)
             raise SdoAbort(index, subindex, SDO_ABORT_CRC_ERROR)
-        self._send(SdoBlockUploadEndResponse(node_id))
+        self._send(SdoBlockUploadEndResponse(node_id), block=True)
         return data
 
-    def _prepare_sdo_request(self, index, subindex, request):
+    def _prepare_sdo_request(self, index, subindex, request, event=None):
+        # With the event of a transfer in progress, only the CAN-ID is set
         # Check for client COB-IDs
         for odi in range(ODI_SDO_CLIENT, ODI_SDO_CLIENT + 0x80):
             if odi in self.od:
@@ -1479,34 +1775,56 @@ class Node:
                         raise SdoAbort(index, subindex, SDO_ABORT_CONNECTION) # SDO is not valid
                     request.arbitration_id = sdo_client_rx_cob_id & 0x1FFFFFFF
                     break
+        if event is not None:
+            return request
         if self._sdo_requests.get(request.arbitration_id) is not None:
             self._send(SdoAbortResponse(request.arbitration_id, index, subindex, SDO_ABORT_GENERAL))
+            self._count_sdo_abort("sent", SDO_ABORT_GENERAL)
         self._sdo_requests[request.arbitration_id] = SdoRequestEvent(index, subindex)
         return request
 
-    def _sdo_request(self, index, subindex, request):
-        request = self._prepare_sdo_request(index, subindex, request)
-        logger.info(f"Sending SDO request with CAN ID {request.arbitration_id:03X}")
-        self._send(request)
-        return self._sdo_response(index, subindex, request)
+    def _sdo_request(self, index, subindex, request, event=None):
+        request = self._prepare_sdo_request(index, subindex, request, event)
+        logger.info("Sending SDO request with CAN ID %03X", request.arbitration_id)
+        if self.metrics is None:
+            self._send(request, block=True)
+            return self._sdo_response(index, subindex, request, event)
+        start = time.perf_counter()
+        self._send(request, block=True)
+        response = self._sdo_response(index, subindex, request, event)
+        self.metrics.sdo_round_trip_time.observe(time.perf_counter() - start, self.id, request.node_id)
+        return response
 
-    def _sdo_response(self, index, subindex, request):
+    def _sdo_response(self, index, subindex, request, event=None):
+        # event, of a transfer in progress, is kept for further responses
         response = None
-        try:
-            self._sdo_requests[request.arbitration_id].wait(self.SDO_TIMEOUT)
-            response = self._sdo_requests[request.arbitration_id].response
-            del self._sdo_requests[request.arbitration_id]
-        except KeyError:
-            pass
+        request_event = self._sdo_requests.get(request.arbitration_id) if event is None else event
+        if request_event is not None:
+            response = request_event.next_response(self.SDO_TIMEOUT)
+            if event is None and self._sdo_requests.get(request.arbitration_id) is request_event:
+                del self._sdo_requests[request.arbitration_id]
         if response is None:
-            logger.error(f"SDO timeout for CAN ID {request.arbitration_id:03X}")
+            logger.error("SDO timeout for CAN ID %03X", request.arbitration_id)
             raise SdoTimeout(index, subindex)
-        logger.info(f"Received SDO response for CAN ID {request.arbitration_id:03X}")
-        if (response[0] >> SDO_CS_BITNUM) == SDO_CS_ABORT:
+        logger.info("Received SDO response for CAN ID %03X", request.arbitration_id)
+        if request.is_fd:
+            if response[0] == FD_SDO_CS_ABORT:
+                self._count_sdo_abort("received", int.from_bytes(response[5:9], byteorder="little"))
+                raise SdoAbort(index, subindex, int.from_bytes(response[5:9], byteorder="little"))
+            if response[0] & FD_SDO_CS_RESPONSE == 0 or response[1] != request.data[1]:
+                raise SdoAbort(index, subindex, SDO_ABORT_INVALID_CS)
+        elif response[0] == SDO_CS_ABORT << SDO_CS_BITNUM: # Not a last block segment, whose sequence number is never 0
+            self._count_sdo_abort("received", int.from_bytes(response[4:8], byteorder="little"))
             raise SdoAbort(index, subindex, int.from_bytes(response[4:8], byteorder="little"))
         return response
 
+    def _count_sdo_abort(self, direction, code):
+        if self.metrics is not None:
+            self.metrics.sdo_aborts.inc(self.id, direction, f"0x{code:08X}")
+
     def _sdo_download_request(self, node_id, index, subindex, sdo_data):
+        if self.fd and node_id in self.fd_sdo_servers:
+            return self._fd_sdo_download_request(node_id, index, subindex, sdo_data)
         sdo_data = sdo_data.ljust(4, b'\x00')
         response = self._sdo_request(index, subindex, SdoDownloadInitiateRequest(node_id, 0, 1, 0, index, subindex, sdo_data))
         if (response[0] >> SDO_CS_BITNUM) != SDO_SCS_DOWNLOAD_INITIATE:
@@ -1514,6 +1832,8 @@ class Node:
         return response[4:8]
 
     def _sdo_upload_request(self, node_id, index, subindex):
+        if self.fd and node_id in self.fd_sdo_servers:
+            return self._fd_sdo_upload_request(node_id, index, subindex)
         response = self._sdo_request(index, subindex, SdoUploadInitiateRequest(node_id, index, subindex))
         if (response[0] >> SDO_CS_BITNUM) != SDO_SCS_UPLOAD_INITIATE:
             raise SdoAbort(index, subindex, SDO_ABORT_INVALID_CS)
@@ -1543,7 +1863,57 @@ class Node:
             raise SdoAbort(index, subindex, SDO_ABORT_PARAMETER_LENGTH)
         return data
 
-    def _send(self, msg: can.Message, channel=None):
+    def _fd_sdo_download_request(self, node_id, index, subindex, fd_sdo_data):
+        fd_sdo_data = bytes(fd_sdo_data)
+        session = self._next_fd_sdo_session()
+        if len(fd_sdo_data) <= FD_SDO_MAX_EXPEDITED_SIZE:
+            response = self._sdo_request(index, subindex, FdSdoDownloadExpeditedRequest(node_id, session, index, subindex, fd_sdo_data))
+            if response[0] != FD_SDO_CS_DOWNLOAD_EXPEDITED | FD_SDO_CS_RESPONSE:
+                raise SdoAbort(index, subindex, SDO_ABORT_INVALID_CS)
+            return
+        response = self._sdo_request(index, subindex, FdSdoDownloadInitiateRequest(node_id, session, index, subindex, len(fd_sdo_data)))
+        if response[0] != FD_SDO_CS_DOWNLOAD_INITIATE | FD_SDO_CS_RESPONSE:
+            raise SdoAbort(index, subindex, SDO_ABORT_INVALID_CS)
+        for seqno, offset in enumerate(range(0, len(fd_sdo_data), FD_SDO_MAX_SEGMENT_SIZE)):
+            last = offset + FD_SDO_MAX_SEGMENT_SIZE >= len(fd_sdo_data)
+            request = FdSdoDownloadSegmentRequest(node_id, session, seqno & 0xFF, fd_sdo_data[offset:offset + FD_SDO_MAX_SEGMENT_SIZE], last)
+            response = self._sdo_request(index, subindex, request)
+            if response[0] & ~FD_SDO_CS_LAST_SEGMENT != FD_SDO_CS_DOWNLOAD_SEGMENT | FD_SDO_CS_RESPONSE:
+                raise SdoAbort(index, subindex, SDO_ABORT_INVALID_CS)
+            if response[2] != seqno & 0xFF:
+                raise SdoAbort(index, subindex, SDO_ABORT_INVALID_SEQNO)
+
+    def _fd_sdo_upload_request(self, node_id, index, subindex):
+        session = self._next_fd_sdo_session()
+        response = self._sdo_request(index, subindex, FdSdoUploadRequest(node_id, session, index, subindex))
+        if response[0] == FD_SDO_CS_UPLOAD_EXPEDITED | FD_SDO_CS_RESPONSE:
+            return response[6:6 + response[5]]
+        if response[0] != FD_SDO_CS_UPLOAD_INITIATE | FD_SDO_CS_RESPONSE:
+            raise SdoAbort(index, subindex, SDO_ABORT_INVALID_CS)
+        size = struct.unpack_from("<I", response, 5)[0]
+        data = bytearray()
+        seqno = 0
+        while True:
+            response = self._sdo_request(index, subindex, FdSdoUploadSegmentRequest(node_id, session, seqno))
+            cs, _, response_seqno, length = struct.unpack_from(FD_SDO_SEGMENT_HEADER_FORMAT, response)
+            if cs & ~FD_SDO_CS_LAST_SEGMENT != FD_SDO_CS_UPLOAD_SEGMENT | FD_SDO_CS_RESPONSE:
+                raise SdoAbort(index, subindex, SDO_ABORT_INVALID_CS)
+            if response_seqno != seqno:
+                raise SdoAbort(index, subindex, SDO_ABORT_INVALID_SEQNO)
+            data += response[4:4 + length]
+            if cs & FD_SDO_CS_LAST_SEGMENT:
+                break
+            seqno = (seqno + 1) & 0xFF
+        if len(data) != size:
+            raise SdoAbort(index, subindex, SDO_ABORT_PARAMETER_LENGTH)
+        return data
+
+    def _next_fd_sdo_session(self):
+        self._fd_sdo_client_session = (self._fd_sdo_client_session + 1) & 0xFF
+        return self._fd_sdo_client_session
+
+    def _send(self, msg: can.Message, channel=None, block=False, lock=None):
+        # With a transmit scheduler, only SDO clients block on a full queue; lock is that of a reused msg, see _tx_template()
         if channel is None:
             bus = self.active_bus
         elif self.redundant_bus is not None and channel == self.redundant_bus.channel:
@@ -1552,11 +1922,26 @@ class Node:
             bus = self.default_bus
         max_tx_delay = None
         if ODI_REDUNDANCY_CONFIGURATION in self.od: # CiA 302-6, 4.1.2.2(b)
+            max_tx_delay = self.od.get(ODI_REDUNDANCY_CONFIGURATION).get(0x01).value / 1000
+        if self.transmit_scheduler is not None:
+            if not self.transmit_scheduler.submit(self._transmit, bus, msg, max_tx_delay, block=block, block_timeout=self.SDO_TIMEOUT, lock=lock):
+                logger.warning("Transmit queue full, dropped frame with CAN-ID 0x%X", msg.arbitration_id)
+                if self.metrics is not None:
+                    self.metrics.send_errors.inc(self.id)
+        else:
+            self._transmit(bus, msg, max_tx_delay)
+
+    def _transmit(self, bus: can.BusABC, msg: can.Message, max_tx_delay):
+        if max_tx_delay is not None:
             redundancy_cfg = self.od.get(ODI_REDUNDANCY_CONFIGURATION)
-            max_tx_delay = redundancy_cfg.get(0x01).value / 1000
         try:
             bus.send(msg, max_tx_delay)
+            if self.metrics is not None:
+                function = None if msg.is_extended_id else Metrics.function_name(msg.arbitration_id)
+                self.metrics.frames_sent.inc(self.id, function)
         except can.CanError as e:
+            if self.metrics is not None:
+                self.metrics.send_errors.inc(self.id)
             self._on_can_error(bus.channel)
             if bus == self.default_bus and max_tx_delay is not None: # CiA 302-6, Section 7.1.2.2(d)
                 err_threshold = redundancy_cfg.get(0x04)
@@ -1567,7 +1952,7 @@ class Node:
                 if self.active_bus == self.default_bus and err_counter.value == err_threshold.value:
                     self._default_bus_heartbeat_disabled = True
                     self.active_bus = self.redundant_bus
-                    self.send_nmt(NmtIndicateActiveInterfaceMessage())
+                    self._transmit(self.active_bus, NmtIndicateActiveInterfaceMessage(), max_tx_delay) # Not queued behind the failed frame
         else:
             if bus == self.default_bus and max_tx_delay is not None: # CiA 302-6, Section 7.1.2.2(e)
                 err_counter = redundancy_cfg.get(0x05)
@@ -1595,104 +1980,117 @@ class Node:
         if er_value.value is None:
             return
         self.on_emcy(emcy_id_value, eec, er_value, msef)
-        msg = EmcyMessage(emcy_id_value.value, eec, er_value.value, msef)
-        if self._nmt_state == NMT_STATE_STOPPED and self._redundant_nmt_state == NMT_STATE_STOPPED:
+        self._send_emcy_msg(EmcyMessage(emcy_id_value.value, eec, er_value.value, msef))
+
+    def _send_emcy_msg(self, msg):
+        if self._nmt_state == NMT_STATE_STOPPED and self._redundant_nmt_state in [None, NMT_STATE_STOPPED]:
             self._pending_emcy_msgs.append(msg)
             return
+        emcy_inhibit_time = 0
         emcy_inhibit_time_obj = self.od.get(ODI_INHIBIT_TIME_EMCY)
         if emcy_inhibit_time_obj is not None:
-            emcy_inhibit_time_subobj = emcy_inhibit_time_obj.get(ODSI_VALUE)
-            if emcy_inhibit_time_subobj.value != 0:
-                emcy_inhibit_time = emcy_inhibit_time_subobj.value / 10000
-                if self._emcy_inhibit_time + emcy_inhibit_time < time.time():
-                    logger.info("EMCY inhibit time violation, delaying message")
-                    self._emcy_inhibit_time += emcy_inhibit_time
-                    if self._nmt_state == NMT_STATE_PREOPERATIONAL or self._nmt_state == NMT_STATE_OPERATIONAL:
-                        with self._message_timers_lock:
-                            t = threading.Timer(time.time() - self._emcy_inhibit_time, self._send, [msg, self.default_bus.channel])
-                            t.start()
-                            self._message_timers.append(t)
-                    if self._redundant_nmt_state == NMT_STATE_PREOPERATIONAL or self._redundant_nmt_state == NMT_STATE_OPERATIONAL:
-                        with self._message_timers_lock:
-                            t = threading.Timer(time.time() - self._emcy_inhibit_time, self._send, [msg, self.redundant_bus.channel])
-                            t.start()
-                            self._message_timers.append(t)
-                    return
+            emcy_inhibit_time = emcy_inhibit_time_obj.get(ODSI_VALUE).value / 10000 # 100 us units
+        if not self._inhibit.send(msg.arbitration_id, emcy_inhibit_time, self._send_emcy_now, msg, coalesce=False):
+            logger.info("EMCY inhibit time violation, delaying message")
+
+    def _send_emcy_now(self, msg):
         if self._nmt_state == NMT_STATE_PREOPERATIONAL or self._nmt_state == NMT_STATE_OPERATIONAL:
             self._send(msg, channel=self.default_bus.channel)
         if self._redundant_nmt_state == NMT_STATE_PREOPERATIONAL or self._redundant_nmt_state == NMT_STATE_OPERATIONAL:
             self._send(msg, channel=self.redundant_bus.channel)
 
     def _send_heartbeat(self):
-        msg = HeartbeatMessage(self.id, self.nmt_state)
-        if not self._default_bus_heartbeat_disabled:
-            self._send(msg, self.default_bus.channel)
-        if self.redundant_bus is not None:
-            self._send(msg, self.redundant_bus.channel)
+        msg, lock = self._tx_template("heartbeat", (FUNCTION_CODE_NMT_ERROR_CONTROL << FUNCTION_CODE_BITNUM) + self.id, 1)
+        with lock:
+            msg.data[0] = self.nmt_state
+            if not self._default_bus_heartbeat_disabled:
+                self._send(msg, self.default_bus.channel, lock=lock)
+            if self.redundant_bus is not None:
+                self._send(msg, self.redundant_bus.channel, lock=lock)
+
+    def _rpdo_timeout(self, rpdo):
+        logger.warning("RPDO%s not received within its event timer", rpdo)
+        self.emcy(EMCY_RPDO_TIMEOUT)
+        threading.Thread(target=self.on_rpdo_timeout, args=(rpdo,), daemon=True).start()
+
+    def _receive_mpdo(self, data):
+        if len(data) != 8:
+            logger.debug("MPDO discarded with length %s", len(data))
+            return
+        address = data[0]
+        index = data[1] + (data[2] << 8)
+        subindex = data[3]
+        if address >> MPDO_ADDRESS_TYPE_BITNUM:
+            if address & 0x7F not in [0, self.id]:
+                return
+            obj = self.od.get(index)
+            subobj = None if obj is None else obj.get(subindex)
+            if subobj is not None and subobj.access_type not in [AccessType.RW, AccessType.WO, AccessType.RWR, AccessType.RWW]:
+                subobj = None
+        else:
+            subobj = self._get_mpdo_dispatcher().get(address, index, subindex)
+        if subobj is None:
+            logger.debug("MPDO discarded for 0x%04Xsub%d", index, subindex)
+            return
+        size = subobj.size
+        if size is None or size > 4:
+            logger.debug("MPDO discarded for 0x%04Xsub%d, which does not fit in an MPDO", index, subindex)
+            return
+        value = subobj.from_bytes(bytes(data[4:4 + size]))
+        if (subobj.low_limit is not None and value < subobj.low_limit) or (subobj.high_limit is not None and value > subobj.high_limit):
+            logger.debug("MPDO discarded for 0x%04Xsub%d, value %s is out of range", index, subindex, value)
+            return
+        subobj.value = value
 
-    def _send_pdo(self, i):
+    def _send_pdo(self, i, data=None):
+        # data is the packed mapping if the caller already has it, see TpdoEventEngine.scan()
         i = i - 1
-        data = bytes()
-        tpdo_mp = self.od.get(ODI_TPDO1_MAPPING_PARAMETER + i)
-        if tpdo_mp is not None:
-            tpdo_mp_length = tpdo_mp.get(ODSI_VALUE)
-            if tpdo_mp_length is not None and tpdo_mp_length.value is not None:
-                for j in range(tpdo_mp_length.value):
-                    mapping_param = tpdo_mp.get(j + 1)
-                    if mapping_param is not None and mapping_param.value is not None:
-                        mapped_obj = self.od.get(mapping_param.value >> 16)
-                        if mapped_obj is not None:
-                             mapped_subobj = mapped_obj.get((mapping_param.value >> 8) & 0xFF)
-                        else:
-                            raise ValueError("Mapped PDO object does not exist")
-                        if mapped_subobj is not None:
-                            mapped_bytes = bytes(mapped_subobj)
-                            if len(mapped_bytes) != ((mapping_param.value & 0xFF) // 8):
-                                raise ValueError("PDO Mapping length mismatch")
-                            data = data + mapped_bytes
+        tpdo_mp_odi = ODI_TPDO1_MAPPING_PARAMETER + i
+        if tpdo_mp_odi in self.od:
+            tpdo_mp_length = self.od.get(tpdo_mp_odi).get(ODSI_VALUE)
+            if tpdo_mp_length is not None and tpdo_mp_length.value in [PDO_MAPPING_DAM_MPDO, PDO_MAPPING_SAM_MPDO]:
+                self.send_mpdo(i + 1)
+            elif tpdo_mp_length is not None and tpdo_mp_length.value is not None:
+                if data is None:
+                    if self.metrics is None:
+                        data = self._get_pdo_mapping(tpdo_mp_odi).pack()
                     else:
-                        raise ValueError("Mapped PDO object does not exist")
+                        start = time.perf_counter()
+                        data = self._get_pdo_mapping(tpdo_mp_odi).pack()
+                        self.metrics.tpdo_build_time.observe(time.perf_counter() - start, self.id, i + 1)
                 tpdo_cp = self.od.get(ODI_TPDO1_COMMUNICATION_PARAMETER + i)
                 if tpdo_cp is not None:
                     tpdo_cp_id = tpdo_cp.get(ODSI_PDO_COMM_PARAM_ID)
                     if tpdo_cp_id is not None and tpdo_cp_id.value is not None:
-                        arbitration_id = tpdo_cp_id.value & 0x1FFFFFFF
-                        is_extended_id = bool(tpdo_cp_id.value & 0x20000000)
-                        msg = can.Message(arbitration_id=arbitration_id, data=data, is_extended_id=is_extended_id)
                         self._tpdo_triggers[i] = False
-                        if ODSI_PDO_COMM_PARAM_INHIBIT_TIME in tpdo_cp:
-                            tpdo_inhibit_time = tpdo_cp.get(ODSI_PDO_COMM_PARAM_INHIBIT_TIME).value / 10000
-                            if i not in self._tpdo_inibit_time:
-                                self._tpdo_inhibit_times[i] = 0
-                            if self._tpdo_inhibit_times[i] + tpdo_inhibit_time < time.time():
-                                logger.info(f"TPDO{i} inhibit time violation, delaying message")
-                                self._tpdo_inhibit_times[i] += tpdo_inhibit_time
-                                # CiA 302-6, 4.1.2.2(a)
-                                if self._nmt_state == NMT_STATE_OPERATIONAL:
-                                    with self._message_timers_lock:
-                                        t = threading.Timer(time.time() - self._tpdo_inhibit_times[i], self._send, [msg, self.default_bus.channel])
-                                        t.start()
-                                        self._message_timers.append(t)
-                                if self._redundant_nmt_state == NMT_STATE_OPERATIONAL:
-                                    with self._message_timers_lock:
-                                        t = threading.Timer(time.time() - self._tpdo_inhibit_times[i], self._send, [msg, self.redundant_bus.channel])
-                                        t.start()
-                                        self._message_timers.append(t)
-                        else:
-                            if self._nmt_state == NMT_STATE_OPERATIONAL:
-                                 self._send(msg, self.default_bus.channel)
-                            if self._redundant_nmt_state == NMT_STATE_OPERATIONAL:
-                                 self._send(msg, self.redundant_bus.channel)
+                        self.tpdo_events.sent(i + 1, data)
+                        # Only the latest data is sent once the inhibit time elapses, CiA 302-6, 4.1.2.2(a)
+                        if not self._inhibit.send(tpdo_cp_id.value & 0x3FFFFFFF, self._tpdo_inhibit_time(tpdo_cp), self._send_pdo_data, tpdo_mp_odi, tpdo_cp_id.value, data):
+                            logger.debug("TPDO%s inhibit time violation, delaying message", i + 1)
+
+    @staticmethod
+    def _tpdo_inhibit_time(tpdo_cp):
+        tpdo_inhibit_time_subobj = tpdo_cp.get(ODSI_PDO_COMM_PARAM_INHIBIT_TIME)
+        if tpdo_inhibit_time_subobj is not None and tpdo_inhibit_time_subobj.value:
+            return tpdo_inhibit_time_subobj.value / 10000 # 100 us units
+        return 0
+
+    def _send_pdo_data(self, tpdo_mp_odi, cob_id, data):
+        msg, lock = self._tx_template(tpdo_mp_odi, cob_id, len(data))
+        with lock:
+            msg.data[:len(data)] = data # CAN FD frames may be padded
+            if self._nmt_state == NMT_STATE_OPERATIONAL:
+                 self._send(msg, self.default_bus.channel, lock=lock)
+            if self._redundant_nmt_state == NMT_STATE_OPERATIONAL:
+                 self._send(msg, self.redundant_bus.channel, lock=lock)
 
     def _send_sync(self):
         sync_object = self.od.get(ODI_SYNC)
         if sync_object is not None:
             sync_value = sync_object.get(ODSI_VALUE)
             if sync_value is not None and sync_value.value is not None:
-                arbitration_id = sync_value.value & 0x1FFFFFFF
-                is_extended_id = bool(sync_value.value & 0x20000000)
                 sync_overflow_object = self.od.get(ODI_SYNCHRONOUS_COUNTER_OVERFLOW_VALUE)
-                data = []
+                counter = None
                 if sync_overflow_object is not None:
                     sync_overflow = sync_overflow_object.get(ODSI_VALUE)
                     if sync_overflow is not None and sync_overflow.value > 1 and sync_overflow.value < 241:
@@ -1700,14 +2098,87 @@ class Node:
                             self._sync_producer_counter = 1
                         else:
                             self._sync_producer_counter += 1
-                        data = [self._sync_producer_counter]
-                msg = can.Message(arbitration_id=arbitration_id, is_extended_id=is_extended_id, data=data)
-                if self._nmt_state == NMT_STATE_PREOPERATIONAL or self._nmt_state == NMT_STATE_OPERATIONAL:
-                    self._send(msg, self.default_bus.channel)
-                if self._redundant_nmt_state is not None and self._redundant_nmt_state == NMT_STATE_PREOPERATIONAL or self._redundant_nmt_state == NMT_STATE_OPERATIONAL:
-                    self._send(msg, self.redundant_bus.channel)
+                        counter = self._sync_producer_counter
+                msg, lock = self._tx_template("sync", sync_value.value, 0 if counter is None else 1)
+                with lock:
+                    if counter is not None:
+                        msg.data[0] = counter
+                    if self._nmt_state == NMT_STATE_PREOPERATIONAL or self._nmt_state == NMT_STATE_OPERATIONAL:
+                        self._send(msg, self.default_bus.channel, lock=lock)
+                    if self._redundant_nmt_state is not None and self._redundant_nmt_state == NMT_STATE_PREOPERATIONAL or self._redundant_nmt_state == NMT_STATE_OPERATIONAL:
+                        self._send(msg, self.redundant_bus.channel, lock=lock)
                 self._on_sync()
 
+    def _accepts(self, can_id, is_extended_id=False):
+        # Whether _on_message() acts on data frames with this CAN-ID; NodeHost builds its routing table from this.
+        # NMT node control, RTRs and pre-defined SDO responses are routed by the host without asking.
+        if is_extended_id:
+            return (can_id | 0x20000000) in self._consumed_cob_ids()
+        fc = (can_id & FUNCTION_CODE_MASK) >> FUNCTION_CODE_BITNUM
+        if fc == FUNCTION_CODE_NMT:
+            return True
+        if fc == FUNCTION_CODE_NMT_ERROR_CONTROL:
+            producers = self._consumed_heartbeats()
+            return producers is None or (can_id & 0x7F) in producers
+        return can_id in self._consumed_cob_ids()
+
+    def _consumed_heartbeats(self):
+        # Node-IDs whose heartbeats are consumed, or None for all
+        if self.is_nmt_master_capable or ODI_REDUNDANCY_CONFIGURATION in self.od or ODI_REQUEST_NMT in self.od:
+            return None
+        producers = set()
+        heartbeat_consumer_time_object = self.od.get(ODI_HEARTBEAT_CONSUMER_TIME)
+        if heartbeat_consumer_time_object is not None:
+            for subindex, subobj in heartbeat_consumer_time_object.items():
+                if subindex > 0 and subobj.value is not None:
+                    producers.add((subobj.value >> 16) & 0x7F)
+        return producers
+
+    def _build_emcy_consumers(self):
+        # Valid EMCY consumer COB-IDs (0x1028), with bit 29 set for extended frames: node-ID
+        emcy_consumers = {}
+        emcy_consumer_object = self.od.get(ODI_EMERGENCY_CONSUMER_OBJECT)
+        if emcy_consumer_object is not None:
+            subobjs = emcy_consumer_object.get(ODSI_VALUE).value
+            for subindex in range(1, subobjs + 1):
+                subobj = emcy_consumer_object.get(subindex)
+                if subobj is not None and subobj.value is not None and not subobj.value & 0x80000000:
+                    emcy_consumers[subobj.value & 0x3FFFFFFF] = subindex
+        return emcy_consumers
+
+    def _consumed_cob_ids(self):
+        # CAN-IDs of consumed non-restricted objects, with bit 29 set for extended frames
+        cob_ids = []
+        for odi, odsi in [(ODI_SYNC, ODSI_VALUE), (ODI_TIME_STAMP, ODSI_VALUE), (ODI_SDO_SERVER, ODSI_SDO_SERVER_DEFAULT_CSID)]:
+            obj = self.od.get(odi)
+            if obj is not None and obj.get(odsi) is not None:
+                cob_ids.append(obj.get(odsi).value)
+        emcy_consumer_object = self.od.get(ODI_EMERGENCY_CONSUMER_OBJECT)
+        if emcy_consumer_object is not None:
+            cob_ids += [subobj.value for subindex, subobj in emcy_consumer_object.items() if subindex > 0]
+        for odi in range(ODI_SDO_CLIENT, ODI_SDO_CLIENT + 0x80):
+            if odi in self.od and self.od.get(odi).get(ODSI_SDO_CLIENT_TX) is not None:
+                cob_ids.append(self.od.get(odi).get(ODSI_SDO_CLIENT_TX).value)
+        for odi in range(ODI_RPDO1_COMMUNICATION_PARAMETER, ODI_RPDO1_COMMUNICATION_PARAMETER + 0x200):
+            if odi in self.od and self.od.get(odi).get(ODSI_PDO_COMM_PARAM_ID) is not None:
+                cob_ids.append(self.od.get(odi).get(ODSI_PDO_COMM_PARAM_ID).value)
+        return {cob_id & 0x3FFFFFFF for cob_id in cob_ids if cob_id is not None}
+
+    def _remote_cob_ids(self):
+        # CAN-IDs of valid TPDOs that may be requested by RTR, with bit 29 set for extended frames
+        cob_ids = set()
+        for odi in range(ODI_TPDO1_COMMUNICATION_PARAMETER, ODI_TPDO1_COMMUNICATION_PARAMETER + 0x200):
+            tpdo_cp = self.od.get(odi)
+            tpdo_cp_id = None if tpdo_cp is None else tpdo_cp.get(ODSI_PDO_COMM_PARAM_ID)
+            if tpdo_cp_id is not None and tpdo_cp_id.value is not None and (tpdo_cp_id.value >> TPDO_COMM_PARAM_ID_VALID_BITNUM) & 1 == 0 and (tpdo_cp_id.value >> TPDO_COMM_PARAM_ID_RTR_BITNUM) & 1 == 0:
+                cob_ids.add(tpdo_cp_id.value & 0x3FFFFFFF)
+        return cob_ids
+
+    def _invalidate_routes(self):
+        for notifier in [self._notifier, self._redundant_notifier]:
+            if hasattr(notifier, "invalidate"): # Hosted
+                notifier.invalidate()
+
     def _start_listening(self, channel):
         if channel == self.default_bus.channel:
             self._notifier.add_listener(self._listener)
@@ -1739,22 +2210,8 @@ class Node:
         self._active_bus = bus
 
     def emcy(self, eec, msef=0):
-        errors_obj = self.od.get(ODI_PREDEFINED_ERROR_FIELD)
-        if errors_obj is not None:
-            errors_length_subobj = errors_obj.get(ODSI_VALUE)
-            errors_length_subobj.value = max(0xFF, errors_length_subobj.value + 1)
-            errors_obj.update({ODSI_VALUE: errors_length_subobj})
-            for si in range(1, errors_length_subobj.value):
-                errors_obj.update({(si + 1): errors_obj.get(si)})
-            errors_obj.update({0x01: SubObject(
-                parameter_name="Standard error field",
-                access_type=AccessType.RO,
-                data_type=ODI_DATA_TYPE_UNSIGNED32,
-                low_limit=0x00000000,
-                high_limit=0xFFFFFFF,
-                default_value=((msef & 0xFFFF) << 16) + eec
-            )})
-            self.od.update({ODI_PREDEFINED_ERROR_FIELD: errors_obj})
+        if self.error_history is not None and eec != EMCY_NONE:
+            self.error_history.push(eec, msef)
         self._send_emcy(eec, msef)
 
     @property
@@ -1784,8 +2241,15 @@ class Node:
                 self._redundant_run_indicator.set_state(nmt_state)
             except AttributeError:
                 pass
-        for msg in self._pending_emcy_msgs:
-            self.send_emcy(msg)
+        pending_emcy_msgs, self._pending_emcy_msgs = self._pending_emcy_msgs, []
+        for msg in pending_emcy_msgs:
+            self._send_emcy_msg(msg)
+        if NMT_STATE_OPERATIONAL in [self._nmt_state, self._redundant_nmt_state]:
+            self.tpdo_events.start()
+            self.rpdo_deadlines.start()
+        else:
+            self.tpdo_events.stop()
+            self.rpdo_deadlines.stop()
 
         # End of NMT startup, part 2
         if self.is_active_nmt_master and nmt_state == NMT_STATE_OPERATIONAL and channel == self.active_bus.channel:
@@ -1832,6 +2296,9 @@ class Node:
     def on_node_bootup(self, id, in_network): # CiA 302-2 section 4.3
         pass
 
+    def on_rpdo_timeout(self, rpdo):
+        pass
+
     def on_sdo_download(self, odi, odsi, obj, sub_obj):
         pass
 
@@ -1874,13 +2341,16 @@ class Node:
         logger.info(f"Device reset communication on {channel}")
         self._stop_listening(channel)
         self.nmt_state = (NMT_STATE_INITIALISATION, channel)
-        for can_id, request in self._sdo_requests.items():
-            request.set() # Resolve pending SDO requests
+        for can_id, request in list(self._sdo_requests.items()):
+            request.respond(None) # Resolve pending SDO requests
         self._reset_timers()
+        self._pdo_mappings = {}
+        self._emcy_consumers = None
+        self._invalidate_routes()
         if self._err_indicator is not None:
             with self._err_indicator_timer_lock:
                 self._cancel_timer(self._err_indicator_timer)
-                self._err_indicator_timer = IntervalTimer(self._err_indicator.interval, self._process_err_indicator)
+                self._err_indicator_timer = IntervalTimer(self._err_indicator.interval, self._process_err_indicator, on_lag=self._timer_lag_handler("err_indicator"))
                 self._err_indicator_timer.start()
         for odi, obj in self.od.items():
             if odi < 0x1000 or odi > 0x1FFF:
@@ -1889,6 +2359,8 @@ class Node:
                 subobj.value = subobj.default_value
                 obj.update({odsi: subobj})
             self.od.update({odi: obj})
+        if self.error_history is not None:
+            self.error_history.clear()
         self._heartbeat_evaluation_counters = {}
         if ODI_REDUNDANCY_CONFIGURATION in self.od and channel == self.active_bus.channel:
             logger.info("Node is configured for redundancy")
@@ -1914,21 +2386,47 @@ class Node:
     def reset_emcy(self):
         self._send_emcy(0)
 
+    def send_mpdo(self, tpdo, node_id=0):
+        # Sends every object in the object scanner list if the TPDO is mapped as a source address mode MPDO, or
+        # the mapped object to node_id (0 for all) if destination address mode
+        tpdo_cp = self.od.get(ODI_TPDO1_COMMUNICATION_PARAMETER + tpdo - 1)
+        tpdo_mp_odi = ODI_TPDO1_MAPPING_PARAMETER + tpdo - 1
+        tpdo_mp = self.od.get(tpdo_mp_odi)
+        if tpdo_cp is None or tpdo_mp is None:
+            raise ValueError(f"TPDO{tpdo} does not exist")
+        tpdo_cp_id = tpdo_cp.get(ODSI_PDO_COMM_PARAM_ID)
+        if tpdo_cp_id is None or tpdo_cp_id.value is None or (tpdo_cp_id.value >> TPDO_COMM_PARAM_ID_VALID_BITNUM) & 1:
+            return
+        mapping_type = tpdo_mp.get(ODSI_VALUE).value
+        if mapping_type == PDO_MAPPING_SAM_MPDO:
+            frames = self._get_mpdo_scanner().frames()
+        elif mapping_type == PDO_MAPPING_DAM_MPDO:
+            mapping_param = tpdo_mp.get(1)
+            if mapping_param is None or mapping_param.value is None:
+                raise ValueError(f"TPDO{tpdo} has no mapped object")
+            index = mapping_param.value >> 16
+            subindex = (mapping_param.value >> 8) & 0xFF
+            mapped_obj = self.od.get(index)
+            mapped_subobj = None if mapped_obj is None else mapped_obj.get(subindex)
+            if mapped_subobj is None:
+                raise ValueError(f"Mapped object 0x{index:04X}sub{subindex} does not exist")
+            if mapped_subobj.size is None or mapped_subobj.size > 4:
+                raise ValueError(f"Mapped object 0x{index:04X}sub{subindex} does not fit in an MPDO")
+            frames = [MpdoMessage(tpdo_cp_id.value, node_id, index, subindex, bytes(mapped_subobj), dam=True).data]
+        else:
+            raise ValueError(f"TPDO{tpdo} is not mapped as an MPDO")
+        self.tpdo_events.sent(tpdo, None)
+        tpdo_inhibit_time = self._tpdo_inhibit_time(tpdo_cp)
+        for data in frames: # Every multiplexed object is sent, one inhibit time apart
+            self._inhibit.send(tpdo_cp_id.value & 0x3FFFFFFF, tpdo_inhibit_time, self._send_pdo_data, tpdo_mp_odi, tpdo_cp_id.value, data, coalesce=False)
+
     def send_nmt(self, msg):
+        nmt_inhibit_time = 0
         nmt_inhibit_time_obj = self.od.get(ODI_NMT_INHIBIT_TIME)
         if nmt_inhibit_time_obj is not None:
-            nmt_inhibit_time_subobj = nmt_inhibit_time_obj.get(ODSI_VALUE)
-            if nmt_inhibit_time_subobj.value != 0:
-                nmt_inhibit_time = nmt_inhibit_time_subobj.value / 1000
-                if self._nmt_inhibit_time + nmt_inhibit_time < time.time():
-                    logger.info("NMT inhibit time violation, delaying message")
-                    self._nmt_inhibit_time += nmt_inhibit_time
-                    with self._message_timers_lock:
-                        t = threading.Timer(time.time() - self._nmt_inhibit_time, self._send, [msg])
-                        t.start()
-                        self._message_timers.append(t)
-                    return
-        return self._send(msg)
+            nmt_inhibit_time = nmt_inhibit_time_obj.get(ODSI_VALUE).value / 10000 # 100 us units
+        if not self._inhibit.send(msg.arbitration_id, nmt_inhibit_time, self._send, msg, coalesce=False):
+            logger.info("NMT inhibit time violation, delaying message")
 
     def send_time(self, ts=None):
         if ts is None:
@@ -1943,16 +2441,14 @@ class Node:
         time_cob_id = time_obj.get(ODSI_VALUE).value
         if time_cob_id & 0x40000000:
             td = ts - EPOCH
-            arbitration_id = time_cob_id & 0x1FFFFFFF
-            data = struct.pack("<IH", round(td.seconds * 1000 + td.microseconds / 1000), td.days)
-            is_extended_id = bool(time_cob_id & 0x20000000)
-            msg = can.Message(arbitration_id=arbitration_id, data=data, is_extended_id=is_extended_id)
-            max_tx_delay = None
-            if self._nmt_state == NMT_STATE_OPERATIONAL or self._nmt_state == NMT_STATE_PREOPERATIONAL:
-                self._send(msg, channel=self.default_bus.channel)
-            if self._redundant_nmt_state == NMT_STATE_OPERATIONAL or self._redundant_nmt_state == NMT_STATE_PREOPERATIONAL:
-                self._send(msg, channel=self.redundant_bus.channel)
-            logger.info(f"Sent TIME object with {ts}")
+            msg, lock = self._tx_template("time", time_cob_id, 6)
+            with lock:
+                struct.pack_into("<IH", msg.data, 0, round(td.seconds * 1000 + td.microseconds / 1000), td.days)
+                if self._nmt_state == NMT_STATE_OPERATIONAL or self._nmt_state == NMT_STATE_PREOPERATIONAL:
+                    self._send(msg, channel=self.default_bus.channel, lock=lock)
+                if self._redundant_nmt_state == NMT_STATE_OPERATIONAL or self._redundant_nmt_state == NMT_STATE_PREOPERATIONAL:
+                    self._send(msg, channel=self.redundant_bus.channel, lock=lock)
+            logger.debug("Sent TIME object with %s", ts)
 
     @property
     def timestamp(self):
@@ -1971,12 +2467,12 @@ class Node:
         tpdo_cp = self.od.get(ODI_TPDO1_COMMUNICATION_PARAMETER + tpdo - 1)
         if tpdo_cp is not None:
             tpdo_cp_id = tpdo_cp.get(ODSI_PDO_COMM_PARAM_ID)
-            if tpdo_cp_id is not None and (tpdo_cp_id >> TPDO_COMM_PARAM_ID_VALID_BITNUM) & 1 == 0:
+            if tpdo_cp_id is not None and tpdo_cp_id.value is not None and (tpdo_cp_id.value >> TPDO_COMM_PARAM_ID_VALID_BITNUM) & 1 == 0:
                 tpdo_cp_type = tpdo_cp.get(ODSI_PDO_COMM_PARAM_TYPE)
-                if tpdo_cp_type is not None and (tpdo_cp_type == 0xFE or tpdo_cp_type == 0xFF):
+                if tpdo_cp_type is not None and tpdo_cp_type.value in [0xFE, 0xFF]:
                     self._send_pdo(tpdo)
                 else:
-                    self._tpdo_triggers[tpdo] = True # Defer until SYNC event
+                    self._tpdo_triggers[tpdo - 1] = True # Defer until SYNC event
 
     def update_configuration(self, slave_id):
         # Per CiA 302-3
@@ -1,14 +1,69 @@
+from array import array
 from collections.abc import Mapping, MutableMapping
 from configparser import ConfigParser
 import copy
 import datetime
 from enum import Enum, IntEnum, unique
+import io
 import struct
 from threading import Lock
 
 from .constants import *
 
 
+def _array_typecode(typecodes, size):
+    for typecode in typecodes:
+        if array(typecode).itemsize == size:
+            return typecode
+    return None
+
+
+class _Filename(str):
+    # Pickled in place of a file value, such as the EDS that ObjectDictionary.from_eds() stores in 0x1021
+    pass
+
+
+# array.array type codes for homogeneous numeric ranges, see ObjectDictionary.get_array()
+ARRAY_TYPECODES = {
+    ODI_DATA_TYPE_BOOLEAN: "B",
+    ODI_DATA_TYPE_INTEGER8: "b",
+    ODI_DATA_TYPE_INTEGER16: _array_typecode("hil", 2),
+    ODI_DATA_TYPE_INTEGER32: _array_typecode("hilq", 4),
+    ODI_DATA_TYPE_INTEGER64: _array_typecode("ilq", 8),
+    ODI_DATA_TYPE_UNSIGNED8: "B",
+    ODI_DATA_TYPE_UNSIGNED16: _array_typecode("HIL", 2),
+    ODI_DATA_TYPE_UNSIGNED32: _array_typecode("HILQ", 4),
+    ODI_DATA_TYPE_UNSIGNED64: _array_typecode("ILQ", 8),
+    ODI_DATA_TYPE_REAL32: "f",
+    ODI_DATA_TYPE_REAL64: "d",
+}
+
+# Encoded size in bytes of fixed-length data types
+DATA_TYPE_SIZES = {
+    ODI_DATA_TYPE_BOOLEAN: 1,
+    ODI_DATA_TYPE_INTEGER8: 1,
+    ODI_DATA_TYPE_INTEGER16: 2,
+    ODI_DATA_TYPE_INTEGER24: 3,
+    ODI_DATA_TYPE_INTEGER32: 4,
+    ODI_DATA_TYPE_INTEGER40: 5,
+    ODI_DATA_TYPE_INTEGER48: 6,
+    ODI_DATA_TYPE_INTEGER56: 7,
+    ODI_DATA_TYPE_INTEGER64: 8,
+    ODI_DATA_TYPE_UNSIGNED8: 1,
+    ODI_DATA_TYPE_UNSIGNED16: 2,
+    ODI_DATA_TYPE_UNSIGNED24: 3,
+    ODI_DATA_TYPE_UNSIGNED32: 4,
+    ODI_DATA_TYPE_UNSIGNED40: 5,
+    ODI_DATA_TYPE_UNSIGNED48: 6,
+    ODI_DATA_TYPE_UNSIGNED56: 7,
+    ODI_DATA_TYPE_UNSIGNED64: 8,
+    ODI_DATA_TYPE_REAL32: 4,
+    ODI_DATA_TYPE_REAL64: 8,
+    ODI_DATA_TYPE_TIME_OF_DAY: 6,
+    ODI_DATA_TYPE_TIME_DIFFERENCE: 6,
+}
+
+
 class ObjectDictionary(MutableMapping):
     def __init__(self, other=None, **kwargs):
         self._store = { # Defaults
@@ -382,6 +437,83 @@ class ObjectDictionary(MutableMapping):
             for index, obj in kwargs.items():
                 self[index] = obj
 
+    def _resolve(self, index, subindex):
+        # Bypasses the per-object locks of Object.__getitem__(); sub-objects are never replaced during bulk access
+        try:
+            return self._store[index]._store[subindex]
+        except (KeyError, AttributeError):
+            raise KeyError(f"Object 0x{index:04X}sub{subindex:X} does not exist") from None
+
+    def get_many(self, keys):
+        """Return the values of many (index, subindex) pairs in a single pass:
+
+                inputs = od.get_many([(0x6000, 1), (0x6000, 2), (0x6401, 1)])
+        """
+        return [self._resolve(index, subindex).value for index, subindex in keys]
+
+    def set_many(self, items):
+        """Set the values of many sub-objects in a single pass.
+
+        items is a mapping of (index, subindex) to value, or an iterable of ((index, subindex), value) pairs.
+        All sub-objects are resolved and all values checked before any value is written, so if one raises,
+        none is written.
+        """
+        if isinstance(items, Mapping):
+            items = items.items()
+        resolved = []
+        for (index, subindex), value in items:
+            subobj = self._resolve(index, subindex)
+            resolved.append((subobj, value, subobj._encode(value)))
+        for subobj, value, data in resolved:
+            subobj._set(value, data)
+
+    def _array_range(self, index, subindices):
+        obj = self._store.get(index)
+        if obj is None:
+            raise KeyError(f"Object 0x{index:04X} does not exist")
+        if subindices is None:
+            if obj.sub_number is None:
+                subindices = [ODSI_VALUE]
+            else:
+                subindices = range(1, obj._store[ODSI_VALUE].value + 1)
+        subobjs = [self._resolve(index, subindex) for subindex in subindices]
+        data_types = set(subobj.data_type for subobj in subobjs)
+        if len(data_types) != 1:
+            raise TypeError(f"Object 0x{index:04X} is not a homogeneous range")
+        data_type = data_types.pop()
+        if data_type not in ARRAY_TYPECODES or ARRAY_TYPECODES[data_type] is None:
+            raise TypeError(f"Data type 0x{data_type:04X} of object 0x{index:04X} has no array representation")
+        return subobjs, data_type
+
+    def get_array(self, index, subindices=None, out=None):
+        """Return a homogeneous numeric range as an array.array, e.g. the digital inputs of 0x6000.
+
+        subindices defaults to 1 through the value of sub-index 0 (or sub-index 0 for VAR objects).
+        If out is given (an array.array, list, or NumPy array of sufficient length) it is filled in place and returned,
+        so a process image can be exchanged every cycle without allocation.  An array.array supports the buffer
+        protocol, so numpy.frombuffer(od.get_array(index)) is a zero-copy NumPy view.
+        """
+        subobjs, data_type = self._array_range(index, subindices)
+        if out is None:
+            out = array(ARRAY_TYPECODES[data_type], bytes(array(ARRAY_TYPECODES[data_type]).itemsize * len(subobjs)))
+        for i, subobj in enumerate(subobjs):
+            out[i] = subobj.value
+        return out
+
+    def set_array(self, index, values, subindices=None):
+        """Write a homogeneous numeric range from any sequence (array.array, list, NumPy array, ...)"""
+        subobjs, data_type = self._array_range(index, subindices)
+        if len(values) != len(subobjs):
+            raise ValueError(f"Expected {len(subobjs)} values for object 0x{index:04X}, got {len(values)}")
+        if data_type == ODI_DATA_TYPE_BOOLEAN:
+            cast = bool
+        elif data_type in [ODI_DATA_TYPE_REAL32, ODI_DATA_TYPE_REAL64]:
+            cast = float
+        else:
+            cast = int # Also converts NumPy scalars, which the SubObject.value setter rejects
+        for subobj, value in zip(subobjs, values):
+            subobj.value = cast(value)
+
     @classmethod
     def from_eds(cls, filename, node_id=None):
         eds = ConfigParser()
@@ -536,6 +668,27 @@ class ProtoObject(MutableMapping):
             self.high_limit = None
         self._lock = Lock()
 
+    def __getstate__(self):
+        # File values are pickled by filename and reopened for reading when unpickled
+        state = self.__dict__.copy()
+        del state["_lock"]
+        for key, value in state.items():
+            if isinstance(value, io.IOBase):
+                if not isinstance(getattr(value, "name", None), str):
+                    raise TypeError(f"Cannot pickle {self.parameter_name!r}, its value is a file without a filename")
+                state[key] = _Filename(value.name)
+        return state
+
+    def __setstate__(self, state):
+        files = {}
+        for key, value in state.items():
+            if isinstance(value, _Filename):
+                if value not in files:
+                    files[value] = open(value, "rb")
+                state[key] = files[value]
+        self.__dict__.update(state)
+        self._lock = Lock()
+
     def __delitem__(self, sub_index):
         with self._lock:
             del self._store[sub_index]
@@ -587,7 +740,7 @@ class ProtoObject(MutableMapping):
         else:
             default_value = None
         if 'PDOMapping' in cfg:
-            pdo_mapping = bool(cfg['PDOMapping'])
+            pdo_mapping = bool(ProtoObject._int_from_config_str(cfg['PDOMapping']))
         else:
             pdo_mapping = None
         if 'LowLimit' in cfg:
@@ -683,59 +836,73 @@ class SubObject(ProtoObject):
         #kwargs["object_type"] = ObjectType.VAR
         super().__init__(**kwargs)
         self._value = self.default_value
+        self._image = None
+        self._image_offset = None
+        self._image_size = None
+
+    def __getstate__(self):
+        if self._image is not None:
+            raise TypeError(f"Cannot pickle {self.parameter_name!r} while it is bound to a process image, unbind() the image first")
+        return super().__getstate__()
 
     def __bytes__(self):
+        image = self._image
+        if image is not None:
+            return image.read(self._image_offset, self._image_size)
+        return self.to_bytes(self.value)
+
+    def to_bytes(self, value):
         if self.data_type == ODI_DATA_TYPE_BOOLEAN:
-            return bytes([bool(self.value)])
-        if isinstance(self.value, int):
+            return bytes([bool(value)])
+        if isinstance(value, int):
             if self.data_type == ODI_DATA_TYPE_INTEGER8:
-                return self.value.to_bytes(1, byteorder='little', signed=True)
+                return value.to_bytes(1, byteorder='little', signed=True)
             if self.data_type == ODI_DATA_TYPE_INTEGER16:
-                return self.value.to_bytes(2, byteorder='little', signed=True)
+                return value.to_bytes(2, byteorder='little', signed=True)
             if self.data_type == ODI_DATA_TYPE_INTEGER24:
-                return self.value.to_bytes(3, byteorder='little', signed=True)
+                return value.to_bytes(3, byteorder='little', signed=True)
             if self.data_type == ODI_DATA_TYPE_INTEGER32:
-                return self.value.to_bytes(4, byteorder='little', signed=True)
+                return value.to_bytes(4, byteorder='little', signed=True)
             if self.data_type == ODI_DATA_TYPE_INTEGER40:
-                return self.value.to_bytes(5, byteorder='little', signed=True)
+                return value.to_bytes(5, byteorder='little', signed=True)
             if self.data_type == ODI_DATA_TYPE_INTEGER48:
-                return self.value.to_bytes(6, byteorder='little', signed=True)
+                return value.to_bytes(6, byteorder='little', signed=True)
             if self.data_type == ODI_DATA_TYPE_INTEGER56:
-                return self.value.to_bytes(7, byteorder='little', signed=True)
+                return value.to_bytes(7, byteorder='little', signed=True)
             if self.data_type == ODI_DATA_TYPE_INTEGER64:
-                return self.value.to_bytes(8, byteorder='little', signed=True)
+                return value.to_bytes(8, byteorder='little', signed=True)
             if self.data_type == ODI_DATA_TYPE_UNSIGNED8:
-                return self.value.to_bytes(1, byteorder='little')
+                return value.to_bytes(1, byteorder='little')
             if self.data_type == ODI_DATA_TYPE_UNSIGNED16:
-                return self.value.to_bytes(2, byteorder='little')
+                return value.to_bytes(2, byteorder='little')
             if self.data_type == ODI_DATA_TYPE_UNSIGNED24:
-                return self.value.to_bytes(3, byteorder='little')
+                return value.to_bytes(3, byteorder='little')
             if self.data_type == ODI_DATA_TYPE_UNSIGNED32:
-                return self.value.to_bytes(4, byteorder='little')
+                return value.to_bytes(4, byteorder='little')
             if self.data_type == ODI_DATA_TYPE_UNSIGNED40:
-                return self.value.to_bytes(5, byteorder='little')
+                return value.to_bytes(5, byteorder='little')
             if self.data_type == ODI_DATA_TYPE_UNSIGNED48:
-                return self.value.to_bytes(6, byteorder='little')
+                return value.to_bytes(6, byteorder='little')
             if self.data_type == ODI_DATA_TYPE_UNSIGNED56:
-                return self.value.to_bytes(7, byteorder='little')
+                return value.to_bytes(7, byteorder='little')
             if self.data_type == ODI_DATA_TYPE_UNSIGNED64:
-                return self.value.to_bytes(8, byteorder='little')
-        if isinstance(self.value, float):
+                return value.to_bytes(8, byteorder='little')
+        if isinstance(value, float):
             if self.data_type == ODI_DATA_TYPE_REAL32:
-              return struct.pack("<f", self.value)
+              return struct.pack("<f", value)
             if self.data_type == ODI_DATA_TYPE_REAL64:
-              return struct.pack("<d", self.value)
-        if isinstance(self.value, str):
+              return struct.pack("<d", value)
+        if isinstance(value, str):
             if self.data_type == ODI_DATA_TYPE_VISIBLE_STRING:
-                return bytes(self.value, 'ascii') # CANopen Visible String encoding is ISO 646-1974 (ASCII)
+                return bytes(value, 'ascii') # CANopen Visible String encoding is ISO 646-1974 (ASCII)
             if self.data_type == ODI_DATA_TYPE_UNICODE_STRING:
-                return bytes(self.value, 'utf_16') # CANopen Unicode Strings are arrays of UNSIGNED16, assuming UTF-16
-        if isinstance(self.value, datetime.datetime):
-            td = self.value - EPOCH
+                return bytes(value, 'utf_16') # CANopen Unicode Strings are arrays of UNSIGNED16, assuming UTF-16
+        if isinstance(value, datetime.datetime):
+            td = value - EPOCH
             return struct.pack("<IH", int(td.seconds * 1000 + td.microseconds / 1000) << 4, td.days)
-        if isinstance(self.value, datetime.timedelta):
-            return struct.pack("<IH", int(self.value.seconds * 1000 + self.value.microseconds / 1000) << 4, self.value.days)
-        return bytes(self.value) # Try casting if nothing else worked; custom data types should implement __bytes__()
+        if isinstance(value, datetime.timedelta):
+            return struct.pack("<IH", int(value.seconds * 1000 + value.microseconds / 1000) << 4, value.days)
+        return bytes(value) # Try casting if nothing else worked; custom data types should implement __bytes__()
 
     def from_bytes(self, b):
         if self.data_type == ODI_DATA_TYPE_BOOLEAN:
@@ -789,16 +956,56 @@ class SubObject(ProtoObject):
 
     @property
     def value(self):
+        image = self._image
+        if image is not None:
+            return self.from_bytes(image.read(self._image_offset, self._image_size))
         with self._lock:
             return self._value
 
     @value.setter
     def value(self, value):
+        self._set(value, self._encode(value))
+
+    def _encode(self, value):
+        # Raises as the value setter would; returns value in wire format if bound to a process image, else None
         if type(value) not in [bool, int, float, str, bytes, bytearray, datetime.datetime, datetime.timedelta] and not hasattr(value, "read"):
             raise TypeError("CANopen objects can only be set to one of bool, int, float, str, bytes, bytearray, datetime, timedelta, or file-like object")
+        if self._image is not None:
+            return self.to_bytes(value)
+        return None
+
+    def _set(self, value, data):
+        # data is from _encode()
+        image = self._image
+        if image is not None and data is not None:
+            image.write(self._image_offset, data)
+            return
         with self._lock:
             self._value = value
 
+    @property
+    def size(self):
+        return DATA_TYPE_SIZES.get(self.data_type)
+
+    def bind(self, image, offset):
+        """Back the value with a slice of a ProcessImage, in wire format; None to unbind"""
+        if image is None:
+            if self._image is not None:
+                value = self.value
+                self._image = None
+                self._value = value
+            return
+        size = self.size
+        if size is None:
+            raise TypeError(f"Data type {self.data_type} is not of fixed size")
+        value = self.value
+        with self._lock:
+            self._image_offset = offset
+            self._image_size = size
+            self._image = image
+        if value is not None:
+            self.value = value
+
     @classmethod
     def from_config(cls, cfg, node_id):
         po = super().from_config(cfg, node_id)
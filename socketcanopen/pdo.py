@@ -0,0 +1,357 @@
+import struct
+import threading
+import time
+
+from .constants import *
+from .object_dictionary import *
+
+
+class PdoMapping:
+    """Compiled PDO mapping parameter (0x1600-0x17FF or 0x1A00-0x1BFF)
+
+    Mapped sub-objects are resolved once.  Entries that are adjacent in the same ProcessImage are merged
+    into a single segment, so packing a TPDO is a slice copy and applying an RPDO is a slice assignment.
+    Dummy entries (indices below 0x1000) are transmitted as zeros and skipped on reception.  Mappings are
+    limited to max_length bytes, 8 for classic CAN or 64 for CAN FD.
+    """
+
+    def __init__(self, od: ObjectDictionary, mp_odi, max_length=8):
+        self.index = mp_odi
+        self.entries = []
+        mp = od.get(mp_odi)
+        if mp is None:
+            raise ValueError(f"PDO mapping parameter 0x{mp_odi:04X} does not exist")
+        mp_length = mp.get(ODSI_VALUE)
+        if mp_length is None or mp_length.value is None:
+            raise ValueError(f"PDO mapping parameter 0x{mp_odi:04X} has no length")
+        for odsi in range(1, mp_length.value + 1):
+            mapping_param = mp.get(odsi)
+            if mapping_param is None or mapping_param.value is None:
+                raise ValueError("Mapped PDO object does not exist")
+            index = mapping_param.value >> 16
+            subindex = (mapping_param.value >> 8) & 0xFF
+            bit_length = mapping_param.value & 0xFF
+            if bit_length % 8:
+                raise NotImplementedError("PDO mapping of bit fields is not supported")
+            length = bit_length // 8
+            if index < 0x1000: # Dummy mapping
+                self.entries.append((None, length))
+                continue
+            mapped_obj = od.get(index)
+            if mapped_obj is None:
+                raise ValueError("Mapped PDO object does not exist")
+            mapped_subobj = mapped_obj.get(subindex)
+            if mapped_subobj is None:
+                raise ValueError("Mapped PDO object does not exist")
+            if mapped_subobj.size is not None and mapped_subobj.size != length:
+                raise ValueError("PDO Mapping length mismatch")
+            self.entries.append((mapped_subobj, length))
+        self.length = sum(length for _, length in self.entries)
+        if self.length > max_length:
+            raise ValueError(f"PDO mapping parameter 0x{mp_odi:04X} maps {self.length} bytes, more than {max_length}")
+        self._segments = self._compile(self.entries)
+        images = [source for source, offset, _ in self._segments if offset is not None]
+        self._image = images[0] if images else None
+
+    @staticmethod
+    def _compile(entries):
+        # Segments are (image, offset, length) for process image runs, or (subobj, None, length)
+        segments = []
+        for subobj, length in entries:
+            image = None if subobj is None else subobj._image
+            if image is not None:
+                offset = subobj._image_offset
+                if segments and segments[-1][0] is image and segments[-1][1] is not None and segments[-1][1] + segments[-1][2] == offset:
+                    segments[-1] = (image, segments[-1][1], segments[-1][2] + length)
+                else:
+                    segments.append((image, offset, length))
+            else:
+                segments.append((subobj, None, length))
+        return segments
+
+    @property
+    def is_contiguous(self):
+        return len(self._segments) == 1 and self._segments[0][1] is not None
+
+    def pack(self):
+        if self.is_contiguous:
+            image, offset, length = self._segments[0]
+            return image.read(offset, length)
+        if self._image is not None:
+            return self._image.consistent(self._pack)
+        return self._pack()
+
+    def _pack(self):
+        data = bytearray()
+        for source, offset, length in self._segments:
+            if offset is not None:
+                data += source.read(offset, length)
+            elif source is None:
+                data += bytes(length)
+            else:
+                mapped_bytes = bytes(source)
+                if len(mapped_bytes) != length:
+                    raise ValueError("PDO Mapping length mismatch")
+                data += mapped_bytes
+        return bytes(data)
+
+    def unpack(self, data):
+        if len(data) < self.length:
+            raise ValueError(f"PDO length {len(data)} is less than mapped length {self.length}")
+        if self._image is not None:
+            with self._image.transaction():
+                self._unpack(data)
+        else:
+            self._unpack(data)
+
+    def _unpack(self, data):
+        position = 0
+        for source, offset, length in self._segments:
+            if offset is not None:
+                source.write(offset, data[position:position + length])
+            elif source is not None:
+                source.value = source.from_bytes(data[position:position + length])
+            position += length
+
+
+class TpdoEventEngine:
+    """Sends a Node's event-driven TPDOs (transmission types 0xFE and 0xFF) on change of state and on expiry
+    of the event timer (sub-index 5 of the communication parameter, in ms)
+
+    The node starts the engine on entering NMT state Operational and stops it on leaving it.  Every
+    scan_interval seconds, each TPDO's mapped data is packed with its compiled mapping and sent if it
+    differs from the last data sent; scan() checks immediately, e.g. after writing inputs.  Any
+    transmission of the TPDO restarts its event timer, and the inhibit time still applies.
+    """
+
+    def __init__(self, node, scan_interval=0.01):
+        self.node = node
+        self.scan_interval = scan_interval
+        self.running = False
+        self._lock = threading.Lock()
+        self._tpdos = {} # TPDO number: [last data sent, event time, event timer handle, whether scanned]
+        self._scan_handle = None
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            od = self.node.od
+            for i in range(0x200):
+                tpdo_cp = od.get(ODI_TPDO1_COMMUNICATION_PARAMETER + i)
+                tpdo_mp = od.get(ODI_TPDO1_MAPPING_PARAMETER + i)
+                if tpdo_cp is None or tpdo_mp is None:
+                    continue
+                tpdo_cp_id = tpdo_cp.get(ODSI_PDO_COMM_PARAM_ID)
+                tpdo_cp_type = tpdo_cp.get(ODSI_PDO_COMM_PARAM_TYPE)
+                if tpdo_cp_id is None or tpdo_cp_id.value is None or (tpdo_cp_id.value >> TPDO_COMM_PARAM_ID_VALID_BITNUM) & 1:
+                    continue
+                if tpdo_cp_type is None or tpdo_cp_type.value not in [0xFE, 0xFF]:
+                    continue
+                event_timer = tpdo_cp.get(ODSI_PDO_COMM_PARAM_EVENT_TIMER)
+                event_time = event_timer.value / 1000 if event_timer is not None and event_timer.value else 0
+                handle = None
+                if event_time:
+                    handle = self.node.scheduler.call_later(event_time, self._event_timer_expired, i + 1)
+                tpdo_mp_length = tpdo_mp.get(ODSI_VALUE)
+                mpdo = tpdo_mp_length is not None and tpdo_mp_length.value in [PDO_MAPPING_DAM_MPDO, PDO_MAPPING_SAM_MPDO]
+                self._tpdos[i + 1] = [None, event_time, handle, not mpdo]
+            if self.scan_interval and self._tpdos:
+                self._scan_handle = self.node.scheduler.call_later(0, self._scheduled_scan)
+
+    def stop(self):
+        with self._lock:
+            self.running = False
+            self.node.scheduler.cancel(self._scan_handle)
+            self._scan_handle = None
+            for _, _, handle, _ in self._tpdos.values():
+                self.node.scheduler.cancel(handle)
+            self._tpdos = {}
+
+    def restart(self):
+        # Re-reads the communication and mapping parameters
+        if self.running:
+            self.stop()
+            self.start()
+
+    def scan(self):
+        with self._lock:
+            tpdos = [(tpdo, state[0]) for tpdo, state in self._tpdos.items() if state[3]]
+        for tpdo, last_data in tpdos:
+            try:
+                data = self.node._get_pdo_mapping(ODI_TPDO1_MAPPING_PARAMETER + tpdo - 1).pack()
+            except (ValueError, NotImplementedError):
+                continue
+            if data != last_data:
+                self.node._send_pdo(tpdo, data)
+
+    def _scheduled_scan(self):
+        if not self.running:
+            return
+        self.scan()
+        with self._lock:
+            if self.running:
+                self._scan_handle = self.node.scheduler.call_later(self.scan_interval, self._scheduled_scan)
+
+    def sent(self, tpdo, data):
+        # Called by the node for every transmission of the TPDO
+        with self._lock:
+            state = self._tpdos.get(tpdo)
+            if state is None:
+                return
+            state[0] = data
+            if state[1]:
+                self.node.scheduler.cancel(state[2])
+                state[2] = self.node.scheduler.call_later(state[1], self._event_timer_expired, tpdo)
+
+    def _event_timer_expired(self, tpdo):
+        if self.running and tpdo in self._tpdos:
+            self.node._send_pdo(tpdo)
+
+
+class RpdoDeadlineMonitor:
+    """Detects RPDOs that stop arriving within their event timer (sub-index 5 of the communication parameter,
+    in ms), for a Node
+
+    Monitoring of an RPDO starts with its first reception after the node enters NMT state Operational.  A
+    reception only records the time; a single scheduled check per RPDO moves itself to the deadline of the
+    latest reception, so the timer is not re-armed per frame.  On timeout the node sends EMCY 0x8250 and
+    calls on_rpdo_timeout(rpdo), and monitoring resumes with the next reception.
+    """
+
+    def __init__(self, node):
+        self.node = node
+        self.running = False
+        self._lock = threading.Lock()
+        self._rpdos = {} # CAN-ID: [RPDO number, deadline time, last reception time, check handle]
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            for i in range(0x200):
+                rpdo_cp = self.node.od.get(ODI_RPDO1_COMMUNICATION_PARAMETER + i)
+                if rpdo_cp is None:
+                    continue
+                rpdo_cp_id = rpdo_cp.get(ODSI_PDO_COMM_PARAM_ID)
+                event_timer = rpdo_cp.get(ODSI_PDO_COMM_PARAM_EVENT_TIMER)
+                if rpdo_cp_id is None or rpdo_cp_id.value is None or rpdo_cp_id.value & 0x80000000:
+                    continue
+                if event_timer is None or not event_timer.value:
+                    continue
+                self._rpdos[rpdo_cp_id.value & 0x1FFFFFFF] = [i + 1, event_timer.value / 1000, 0, None]
+
+    def stop(self):
+        with self._lock:
+            self.running = False
+            for _, _, _, handle in self._rpdos.values():
+                self.node.scheduler.cancel(handle)
+            self._rpdos = {}
+
+    def restart(self):
+        # Re-reads the communication parameters
+        if self.running:
+            self.stop()
+            self.start()
+
+    def received(self, can_id):
+        state = self._rpdos.get(can_id)
+        if state is None:
+            return
+        state[2] = time.monotonic()
+        if state[3] is None:
+            with self._lock:
+                if self.running and state[3] is None:
+                    state[3] = self.node.scheduler.call_at(state[2] + state[1], self._check, can_id)
+
+    def _check(self, can_id):
+        with self._lock:
+            state = self._rpdos.get(can_id)
+            if not self.running or state is None:
+                return
+            deadline = state[2] + state[1]
+            if time.monotonic() < deadline:
+                state[3] = self.node.scheduler.call_at(deadline, self._check, can_id)
+                return
+            state[3] = None
+        self.node._rpdo_timeout(state[0])
+
+
+class MpdoScanner:
+    """Compiled object scanner list (0x1FA0-0x1FCF) of a source address mode MPDO producer
+
+    Each entry (block size << 24 | index << 8 | sub-index) lists block size consecutive sub-indices, or one
+    if the block size is 0.  The multiplexer (node-ID, index and sub-index) of every listed object is
+    packed once, so a scan only copies values.
+    """
+
+    def __init__(self, od: ObjectDictionary, node_id):
+        self.entries = [] # (multiplexer, sub-object)
+        for odi in range(ODI_OBJECT_SCANNER_LIST, ODI_OBJECT_DISPATCHING_LIST):
+            obj = od.get(odi)
+            if obj is None:
+                continue
+            count = obj.get(ODSI_VALUE)
+            if count is None or not count.value:
+                continue
+            for odsi in range(1, count.value + 1):
+                entry = obj.get(odsi)
+                if entry is None or not entry.value:
+                    continue
+                index = (entry.value >> 8) & 0xFFFF
+                first_subindex = entry.value & 0xFF
+                scanned_obj = od.get(index)
+                for subindex in range(first_subindex, first_subindex + max(entry.value >> 24, 1)):
+                    scanned_subobj = None if scanned_obj is None else scanned_obj.get(subindex)
+                    if scanned_subobj is None:
+                        raise ValueError(f"Scanned object 0x{index:04X}sub{subindex} does not exist")
+                    if scanned_subobj.size is None or scanned_subobj.size > 4:
+                        raise ValueError(f"Scanned object 0x{index:04X}sub{subindex} does not fit in an MPDO")
+                    self.entries.append((struct.pack("<BHB", node_id, index, subindex), scanned_subobj))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def frames(self):
+        # Yields the data of one MPDO per listed object
+        for multiplexer, subobj in self.entries:
+            yield multiplexer + bytes(subobj).ljust(4, b"\x00")
+
+
+class MpdoDispatcher:
+    """Compiled object dispatching list (0x1FD0-0x1FFF) of a source address mode MPDO consumer
+
+    Each entry (block size << 56 | local index << 40 | local sub-index << 32 | producer node-ID << 24 |
+    producer index << 8 | producer sub-index) routes block size consecutive sub-indices, or one if the block
+    size is 0, of the producer's object to the local object.
+    """
+
+    def __init__(self, od: ObjectDictionary):
+        self.routes = {} # (producer node-ID, index, sub-index): local sub-object
+        for odi in range(ODI_OBJECT_DISPATCHING_LIST, ODI_OBJECT_DISPATCHING_LIST + 0x30):
+            obj = od.get(odi)
+            if obj is None:
+                continue
+            count = obj.get(ODSI_VALUE)
+            if count is None or not count.value:
+                continue
+            for odsi in range(1, count.value + 1):
+                entry = obj.get(odsi)
+                if entry is None or not entry.value:
+                    continue
+                local_index = (entry.value >> 40) & 0xFFFF
+                local_subindex = (entry.value >> 32) & 0xFF
+                producer_id = (entry.value >> 24) & 0x7F
+                producer_index = (entry.value >> 8) & 0xFFFF
+                producer_subindex = entry.value & 0xFF
+                local_obj = od.get(local_index)
+                for k in range(max(entry.value >> 56, 1)):
+                    local_subobj = None if local_obj is None else local_obj.get(local_subindex + k)
+                    if local_subobj is None:
+                        raise ValueError(f"Dispatched object 0x{local_index:04X}sub{local_subindex + k} does not exist")
+                    self.routes[(producer_id, producer_index, producer_subindex + k)] = local_subobj
+
+    def get(self, node_id, index, subindex):
+        return self.routes.get((node_id, index, subindex))
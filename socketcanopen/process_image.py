@@ -0,0 +1,210 @@
+from contextlib import contextmanager
+import multiprocessing
+from multiprocessing import shared_memory
+import struct
+import threading
+import time
+
+from .constants import *
+from .object_dictionary import *
+
+
+class ProcessImage:
+    """Contiguous storage for PDO-mappable sub-objects, in wire (little-endian) format:
+
+            image = ProcessImage(od)
+            image.read(*image.layout[(0x6000, 1)])
+            image.unbind()    # values return to the individual sub-objects
+
+    The layout maps (index, subindex) to (offset, size) and defaults to all fixed-size sub-objects
+    with pdo_mapping=True, in index/sub-index order, so consecutive array entries are adjacent.
+    """
+
+    def __init__(self, od: ObjectDictionary, buffer=None, layout=None):
+        if layout is None:
+            layout = self.build_layout(od)
+        self.layout = dict(layout)
+        self.size = max([offset + size for offset, size in self.layout.values()], default=0)
+        if buffer is None:
+            buffer = bytearray(self.size)
+        self._buffer = memoryview(buffer).cast("B")
+        if len(self._buffer) < self.size:
+            raise ValueError(f"Process image requires {self.size} bytes, buffer has {len(self._buffer)}")
+        self.od = od
+        self._bind()
+
+    @staticmethod
+    def build_layout(od: ObjectDictionary, offset=0, entries=None):
+        # entries selects (index, subindex) pairs explicitly; by default all PDO-mappable sub-objects are included
+        if entries is not None:
+            entries = set(entries)
+        layout = {}
+        for index in sorted(od):
+            obj = od.get(index)
+            if obj is None or index < 0x1000: # Skip data type definitions
+                continue
+            for subindex in sorted(obj):
+                subobj = obj.get(subindex)
+                if subobj is None:
+                    continue
+                if entries is None and not subobj.pdo_mapping:
+                    continue
+                if entries is not None and (index, subindex) not in entries:
+                    continue
+                size = subobj.size
+                if size is None:
+                    continue
+                layout[(index, subindex)] = (offset, size)
+                offset += size
+        return layout
+
+    def _bind(self):
+        for (index, subindex), (offset, size) in self.layout.items():
+            subobj = self.od.get(index).get(subindex)
+            if subobj.size != size:
+                raise ValueError(f"Process image size mismatch for 0x{index:04X}sub{subindex:X}")
+            subobj.bind(self, offset)
+
+    def unbind(self):
+        for index, subindex in self.layout:
+            self.od.get(index).get(subindex).bind(None, None)
+
+    @property
+    def buffer(self):
+        return self._buffer
+
+    def read(self, offset, size):
+        return bytes(self._buffer[offset:offset + size])
+
+    def write(self, offset, data):
+        self._buffer[offset:offset + len(data)] = data
+
+    def view(self, index, subindex):
+        offset, size = self.layout[(index, subindex)]
+        return self._buffer[offset:offset + size]
+
+    @contextmanager
+    def transaction(self):
+        yield self
+
+    def consistent(self, function):
+        return function()
+
+
+class SharedProcessImage(ProcessImage):
+    """ProcessImage in multiprocessing.shared_memory, for exchanging process data with another process:
+
+            image = SharedProcessImage(od, entries=[(0x6000, 1), (0x6200, 1)])
+            node = Node(bus, node_id, od, process_image=image)
+            multiprocessing.Process(target=control_loop, args=(image.descriptor,)).start()
+
+            def control_loop(descriptor):
+                image = SharedProcessImage(descriptor=descriptor)
+                inputs = image.snapshot()
+                image.set(0x6200, 1, 0xFF)
+
+    The first 8 bytes are a sequence counter (seqlock): writers make it odd while writing and even when done,
+    and readers retry until they copied the data between two equal, even counter values.  Writers in both
+    processes are serialized by a multiprocessing lock, so the attaching process must be started with
+    multiprocessing from the creating one.
+    """
+
+    HEADER_SIZE = 8
+
+    def __init__(self, od: ObjectDictionary = None, entries=None, descriptor=None):
+        self._local = threading.local() # Transaction depth of the current thread
+        if descriptor is None:
+            if od is None:
+                raise ValueError("Either an object dictionary or a descriptor is required")
+            layout = self.build_layout(od, self.HEADER_SIZE, entries)
+            size = max([offset + size for offset, size in layout.values()], default=self.HEADER_SIZE)
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+            self._owner = True
+            self._write_lock = multiprocessing.RLock()
+            self._data_types = {key: od.get(key[0]).get(key[1]).data_type for key in layout}
+            super().__init__(od, self._shm.buf, layout)
+        else:
+            try:
+                self._shm = shared_memory.SharedMemory(name=descriptor["name"], track=False) # Python 3.13+
+            except TypeError:
+                self._shm = shared_memory.SharedMemory(name=descriptor["name"])
+            self._owner = False
+            self._write_lock = descriptor["lock"]
+            self._data_types = dict(descriptor["data_types"])
+            self.layout = dict(descriptor["layout"])
+            self.size = max([offset + size for offset, size in self.layout.values()], default=self.HEADER_SIZE)
+            self._buffer = self._shm.buf
+            self.od = None
+        self._codecs = {key: SubObject(parameter_name=None, access_type=AccessType.RW, data_type=data_type) for key, data_type in self._data_types.items()}
+
+    @property
+    def descriptor(self):
+        # Picklable; pass to the other process when starting it
+        return {
+            "name": self._shm.name,
+            "lock": self._write_lock,
+            "layout": self.layout,
+            "data_types": self._data_types,
+        }
+
+    @property
+    def sequence(self):
+        return struct.unpack_from("<Q", self._buffer, 0)[0]
+
+    def _increment_sequence(self):
+        struct.pack_into("<Q", self._buffer, 0, (self.sequence + 1) & 0xFFFFFFFFFFFFFFFF)
+
+    @contextmanager
+    def transaction(self):
+        # Groups several writes, e.g. all entries of an RPDO, into one consistent update
+        with self._write_lock:
+            depth = getattr(self._local, "depth", 0)
+            self._local.depth = depth + 1
+            if depth == 0:
+                self._increment_sequence() # Odd: write in progress
+            try:
+                yield self
+            finally:
+                self._local.depth = depth
+                if depth == 0:
+                    self._increment_sequence() # Even: consistent
+
+    def consistent(self, function):
+        if getattr(self._local, "depth", 0): # Reading own writes
+            return function()
+        while True:
+            start = self.sequence
+            if start & 1:
+                time.sleep(0) # Yield to the writer
+                continue
+            result = function()
+            if self.sequence == start:
+                return result
+
+    def read(self, offset, size):
+        return self.consistent(lambda: bytes(self._buffer[offset:offset + size]))
+
+    def write(self, offset, data):
+        with self.transaction():
+            self._buffer[offset:offset + len(data)] = data
+
+    def get(self, index, subindex):
+        offset, size = self.layout[(index, subindex)]
+        return self._codecs[(index, subindex)].from_bytes(self.read(offset, size))
+
+    def set(self, index, subindex, value):
+        offset, size = self.layout[(index, subindex)]
+        self.write(offset, self._codecs[(index, subindex)].to_bytes(value))
+
+    def snapshot(self):
+        data = self.consistent(lambda: bytes(self._buffer[:self.size]))
+        return {key: self._codecs[key].from_bytes(data[offset:offset + size]) for key, (offset, size) in self.layout.items()}
+
+    def close(self):
+        if self.od is not None:
+            self.unbind()
+            self._buffer.release()
+        self._buffer = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
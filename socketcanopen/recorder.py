@@ -0,0 +1,204 @@
+import can
+import mmap
+import struct
+import threading
+import time
+
+MAGIC = b"SCOREC\x00\x01"
+HEADER_FORMAT = "<8sHHH" # Magic, record size, header size, number of channels
+HEADER_SIZE = 256
+CHANNEL_NAME_SIZE = 30
+MAX_CHANNELS = (HEADER_SIZE - struct.calcsize(HEADER_FORMAT)) // CHANNEL_NAME_SIZE
+RECORD_FORMAT = "<dIBBBx64s" # Timestamp, arbitration ID, channel index, flags, data length, padding, data
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+FLAG_EXTENDED_ID = 0x01
+FLAG_REMOTE_FRAME = 0x02
+FLAG_ERROR_FRAME = 0x04
+FLAG_FD = 0x08
+FLAG_BITRATE_SWITCH = 0x10
+FLAG_ERROR_STATE_INDICATOR = 0x20
+FLAG_RX = 0x40
+
+
+class Recorder(can.Listener):
+    """Writes frames to a binary log of fixed-size records, readable with RecordReader:
+
+            recorder = Recorder("capture.bin")
+            notifier.add_listener(recorder)
+            ...
+            recorder.stop()
+
+    The file starts with a HEADER_SIZE-byte header holding the record size and channel names (up to
+    MAX_CHANNELS), followed by RECORD_SIZE-byte records, so record i is at HEADER_SIZE + i * RECORD_SIZE.
+    """
+
+    def __init__(self, path, buffering=1 << 16):
+        self.path = path
+        self.channels = []
+        self._file = open(path, "wb", buffering=buffering)
+        self._lock = threading.Lock()
+        self._record = struct.Struct(RECORD_FORMAT)
+        self._write_header()
+
+    def _write_header(self):
+        header = struct.pack(HEADER_FORMAT, MAGIC, RECORD_SIZE, HEADER_SIZE, len(self.channels))
+        for channel in self.channels:
+            header += channel.encode()[:CHANNEL_NAME_SIZE].ljust(CHANNEL_NAME_SIZE, b"\x00")
+        position = self._file.tell()
+        self._file.seek(0)
+        self._file.write(header.ljust(HEADER_SIZE, b"\x00"))
+        if position:
+            self._file.seek(position)
+
+    def _channel_index(self, channel):
+        channel = str(channel)
+        try:
+            return self.channels.index(channel)
+        except ValueError:
+            if len(self.channels) == MAX_CHANNELS:
+                raise ValueError(f"Recorder supports up to {MAX_CHANNELS} channels")
+            self.channels.append(channel)
+            self._write_header()
+            return len(self.channels) - 1
+
+    def on_message_received(self, msg: can.Message):
+        flags = (
+            (FLAG_EXTENDED_ID if msg.is_extended_id else 0)
+            | (FLAG_REMOTE_FRAME if msg.is_remote_frame else 0)
+            | (FLAG_ERROR_FRAME if msg.is_error_frame else 0)
+            | (FLAG_FD if msg.is_fd else 0)
+            | (FLAG_BITRATE_SWITCH if msg.bitrate_switch else 0)
+            | (FLAG_ERROR_STATE_INDICATOR if msg.error_state_indicator else 0)
+            | (FLAG_RX if msg.is_rx else 0)
+        )
+        length = msg.dlc if msg.is_remote_frame else len(msg.data)
+        with self._lock:
+            self._file.write(self._record.pack(msg.timestamp, msg.arbitration_id, self._channel_index(msg.channel), flags, length, bytes(msg.data)))
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def stop(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+class RecordReader:
+    """Memory-maps a Recorder log; supports len(), indexing, slicing and iteration, yielding can.Message"""
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, record_size, header_size, channel_count = struct.unpack_from(HEADER_FORMAT, self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a socketcanopen recording")
+        if record_size != RECORD_SIZE:
+            raise ValueError(f"Unsupported record size {record_size}")
+        self.header_size = header_size
+        offset = struct.calcsize(HEADER_FORMAT)
+        self.channels = []
+        for i in range(channel_count):
+            name = self._mmap[offset + i * CHANNEL_NAME_SIZE:offset + (i + 1) * CHANNEL_NAME_SIZE]
+            self.channels.append(name.rstrip(b"\x00").decode())
+        self._record = struct.Struct(RECORD_FORMAT)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return (len(self._mmap) - self.header_size) // RECORD_SIZE
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.message(*self._record.unpack_from(self._mmap, self.header_size + i * RECORD_SIZE))
+
+    def __iter__(self):
+        with memoryview(self._mmap) as view: # Released when iteration ends, as close() requires
+            for fields in self._record.iter_unpack(view[self.header_size:self.header_size + len(self) * RECORD_SIZE]):
+                yield self.message(*fields)
+
+    def message(self, timestamp, arbitration_id, channel, flags, length, data):
+        is_remote_frame = bool(flags & FLAG_REMOTE_FRAME)
+        return can.Message(
+            timestamp=timestamp,
+            arbitration_id=arbitration_id,
+            is_extended_id=bool(flags & FLAG_EXTENDED_ID),
+            is_remote_frame=is_remote_frame,
+            is_error_frame=bool(flags & FLAG_ERROR_FRAME),
+            is_fd=bool(flags & FLAG_FD),
+            bitrate_switch=bool(flags & FLAG_BITRATE_SWITCH),
+            error_state_indicator=bool(flags & FLAG_ERROR_STATE_INDICATOR),
+            is_rx=bool(flags & FLAG_RX),
+            channel=self.channels[channel] if channel < len(self.channels) else channel,
+            dlc=length,
+            data=None if is_remote_frame else data[:length],
+        )
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+
+class Replayer:
+    """Feeds recorded frames into a Node's _on_message(), or any callable taking a can.Message:
+
+            with RecordReader("capture.bin") as reader:
+                Replayer(reader, node).run()                  # As fast as possible
+                Replayer(reader, node, speed=1).run()         # With original timing
+                Replayer(reader, node, speed=10).run()        # Ten times real time
+
+    Recorded channels are mapped, in order of appearance, to the node's default and redundant bus channels
+    unless channel_map is given.  Timestamps are rewritten to the replay time unless keep_timestamps is set.
+    """
+
+    def __init__(self, reader, target, speed=None, channel_map=None, keep_timestamps=False):
+        self.reader = reader
+        self.speed = speed
+        self.keep_timestamps = keep_timestamps
+        if callable(target):
+            self.handler = target
+        else:
+            self.handler = target._on_message
+            if channel_map is None:
+                channels = [target.default_bus.channel]
+                if target.redundant_bus is not None:
+                    channels.append(target.redundant_bus.channel)
+                channel_map = dict(zip(reader.channels, channels))
+        self.channel_map = channel_map or {}
+        self._stopped = threading.Event()
+
+    def run(self, start=0, stop=None):
+        # Returns the number of frames replayed
+        count = 0
+        replay_start = time.monotonic()
+        first_timestamp = None
+        for msg in self.reader if start == 0 and stop is None else self.reader[start:stop]:
+            if self._stopped.is_set():
+                break
+            if self.speed:
+                if first_timestamp is None:
+                    first_timestamp = msg.timestamp
+                delay = (msg.timestamp - first_timestamp) / self.speed - (time.monotonic() - replay_start)
+                if delay > 0:
+                    self._stopped.wait(delay)
+            if msg.channel in self.channel_map:
+                msg.channel = self.channel_map[msg.channel]
+            if not self.keep_timestamps:
+                msg.timestamp = time.time()
+            self.handler(msg)
+            count += 1
+        return count
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,144 @@
+from collections import deque
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    """Calls functions at deadlines on the monotonic clock, from one thread shared by any number of timers:
+
+            scheduler = Scheduler()
+            handle = scheduler.call_later(0.01, function, arg)
+            scheduler.cancel(handle)
+
+    The thread is started on first use.  Functions should return quickly, since they delay later deadlines.
+    """
+
+    def __init__(self, name="Scheduler"):
+        self.name = name
+        self._heap = []
+        self._sequence = itertools.count() # Keeps equal deadlines in order and avoids comparing functions
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def call_at(self, deadline, function, *args):
+        # Returns a handle for cancel()
+        handle = [deadline, next(self._sequence), function, args]
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("Scheduler is stopped")
+            heapq.heappush(self._heap, handle)
+            if self._heap[0] is handle:
+                self._condition.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        return handle
+
+    def call_later(self, delay, function, *args):
+        return self.call_at(time.monotonic() + delay, function, *args)
+
+    def cancel(self, handle):
+        if handle is not None:
+            handle[2] = None # Left in the heap and skipped when due
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._stopped:
+                        return
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    delay = self._heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        _, _, function, args = heapq.heappop(self._heap)
+                        if function is not None:
+                            break
+                        continue
+                    self._condition.wait(delay)
+            try:
+                function(*args)
+            except Exception:
+                logger.exception("Error in scheduled function %s", function)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._heap.clear()
+            self._condition.notify()
+        if self._thread is not None and threading.current_thread() is not self._thread:
+            self._thread.join()
+
+
+class InhibitEngine:
+    """Enforces a minimum time between frames with the same key, usually the COB-ID, on the monotonic clock:
+
+            inhibit = InhibitEngine(scheduler)
+            inhibit.send(cob_id, 0.001, send_function, data)
+
+    A frame within the inhibit time of the previous one is held and released by the scheduler once the
+    inhibit time has elapsed.  With coalesce, only the most recent held frame per key is kept (for PDOs,
+    where a newer value replaces an older one); otherwise held frames are released in order, one per
+    inhibit time (for EMCY and NMT, where every frame matters).
+    """
+
+    def __init__(self, scheduler: Scheduler):
+        self.scheduler = scheduler
+        self._lock = threading.Lock()
+        self._next_times = {} # Key: earliest monotonic time for the next frame
+        self._inhibit_times = {}
+        self._pending = {} # Key: (scheduler handle, deque of (function, args))
+
+    def send(self, key, inhibit_time, function, *args, coalesce=True):
+        # Calls function(*args) now, or once the inhibit time for key has elapsed; returns True if called now
+        now = time.monotonic()
+        with self._lock:
+            self._inhibit_times[key] = inhibit_time
+            pending = self._pending.get(key)
+            if pending is not None:
+                if coalesce:
+                    pending[1].clear()
+                pending[1].append((function, args))
+                return False
+            next_time = self._next_times.get(key, 0)
+            if now < next_time:
+                handle = self.scheduler.call_at(next_time, self._release, key)
+                self._pending[key] = (handle, deque([(function, args)]))
+                return False
+            self._next_times[key] = now + inhibit_time
+        function(*args)
+        return True
+
+    def pending(self, key):
+        with self._lock:
+            pending = self._pending.get(key)
+            return 0 if pending is None else len(pending[1])
+
+    def _release(self, key):
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                return
+            function, args = pending[1].popleft()
+            next_time = time.monotonic() + self._inhibit_times[key]
+            self._next_times[key] = next_time
+            if pending[1]:
+                self._pending[key] = (self.scheduler.call_at(next_time, self._release, key), pending[1])
+            else:
+                del self._pending[key]
+        function(*args)
+
+    def reset(self):
+        # Discards held frames
+        with self._lock:
+            for handle, _ in self._pending.values():
+                self.scheduler.cancel(handle)
+            self._pending.clear()
+            self._next_times.clear()
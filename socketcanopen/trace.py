@@ -0,0 +1,65 @@
+from collections import deque
+import logging
+import sys
+
+
+class TraceHandler(logging.Handler):
+    """Keeps the most recent log records in a ring buffer and formats them only when dumped:
+
+            trace = enable_trace(100000)
+            ...
+            trace.dump()    # e.g. from an exception handler or signal handler
+
+    Records keep references to their arguments, so mutable arguments show their value at dump time.
+    """
+
+    def __init__(self, capacity=10000, level=logging.DEBUG):
+        super().__init__(level)
+        self.records = deque(maxlen=capacity)
+        self.setFormatter(logging.Formatter("%(created).6f %(threadName)s %(name)s %(levelname)s %(message)s"))
+
+    def handle(self, record):
+        # deque.append is thread-safe; skip the handler lock on the hot path
+        if record.levelno >= self.level and self.filter(record):
+            self.records.append(record)
+        return True
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def clear(self):
+        self.records.clear()
+
+    def lines(self):
+        return [self.format(record) for record in list(self.records)]
+
+    def dump(self, file=None):
+        file = sys.stderr if file is None else file
+        for line in self.lines():
+            print(line, file=file)
+
+
+class _ForwardHandler(logging.Handler):
+    # Passes records at or above level on to the root logger's handlers, standing in for propagation
+
+    def emit(self, record):
+        for handler in logging.getLogger().handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+def enable_trace(capacity=10000, level=logging.DEBUG, name="socketcanopen"):
+    """Records log records of the socketcanopen loggers at level and above into a TraceHandler.
+
+    Records below the previously effective level are only traced, not passed on to the root logger's handlers.
+    """
+    log = logging.getLogger(name)
+    previous_level = log.getEffectiveLevel()
+    handler = TraceHandler(capacity, level)
+    log.addHandler(handler)
+    if level < previous_level:
+        log.setLevel(level)
+        if log.propagate:
+            log.propagate = False
+            log.addHandler(_ForwardHandler(previous_level))
+    return handler
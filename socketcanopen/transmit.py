@@ -0,0 +1,185 @@
+from collections import deque
+import can
+import logging
+import threading
+import time
+
+from .constants import *
+
+logger = logging.getLogger(__name__)
+
+# Transmit priority classes, highest first
+PRIORITY_NMT = 0
+PRIORITY_SYNC = 1 # Also TIME
+PRIORITY_EMCY = 2
+PRIORITY_PDO = 3
+PRIORITY_SDO = 4
+PRIORITY_HEARTBEAT = 5
+PRIORITY_NAMES = ["nmt", "sync", "emcy", "pdo", "sdo", "heartbeat"]
+
+FUNCTION_CODE_PRIORITIES = {
+    FUNCTION_CODE_NMT: PRIORITY_NMT,
+    FUNCTION_CODE_TIME_STAMP: PRIORITY_SYNC,
+    FUNCTION_CODE_SDO_TX: PRIORITY_SDO,
+    FUNCTION_CODE_SDO_RX: PRIORITY_SDO,
+    FUNCTION_CODE_NMT_ERROR_CONTROL: PRIORITY_HEARTBEAT,
+}
+
+
+def frame_priority(msg: can.Message):
+    # Classifies by pre-defined connection set function code; extended and other CAN-IDs are treated as PDOs
+    if msg.is_extended_id:
+        return PRIORITY_PDO
+    fc = (msg.arbitration_id & FUNCTION_CODE_MASK) >> FUNCTION_CODE_BITNUM
+    if fc == FUNCTION_CODE_SYNC:
+        return PRIORITY_SYNC if msg.arbitration_id & 0x7F == 0 else PRIORITY_EMCY
+    return FUNCTION_CODE_PRIORITIES.get(fc, PRIORITY_PDO)
+
+
+def frame_bits(msg: can.Message):
+    # Worst-case length of a classic CAN data frame including stuff bits
+    n = 8 * len(msg.data)
+    if msg.is_extended_id:
+        return n + 67 + (54 + n - 1) // 4
+    return n + 47 + (34 + n - 1) // 4
+
+
+class TransmitScheduler:
+    """Sends the frames of one or more nodes from a single thread, highest priority class first:
+
+            scheduler = TransmitScheduler(bitrate=500000, max_bus_load=0.6)
+            node = Node(bus, node_id, od, transmit_scheduler=scheduler)
+
+    Classes are, highest first: NMT, SYNC/TIME, EMCY, PDO, SDO and heartbeat, by the pre-defined connection
+    set function code.  Frames within a class are sent in order.  When bitrate and max_bus_load are given,
+    frames of the throttled classes are held back while the bus time used by sent frames exceeds
+    max_bus_load; other classes are never held back but count toward the load.  Each class queues at most
+    max_queued frames.  Further frames are dropped, unless the sender asks to block, which only bulk senders
+    such as SDO clients should do: threads that handle received frames or run timers must not wait for the
+    scheduler.
+    """
+
+    def __init__(self, bitrate=None, max_bus_load=None, max_queued=64, throttled=(PRIORITY_SDO, PRIORITY_HEARTBEAT), burst=0.01):
+        if (bitrate is None) != (max_bus_load is None):
+            raise ValueError("bitrate and max_bus_load must be given together")
+        if max_bus_load is not None and not 0 < max_bus_load <= 1:
+            raise ValueError("max_bus_load must be in (0, 1]")
+        self.bitrate = bitrate
+        self.max_bus_load = max_bus_load
+        self.max_queued = max_queued
+        self.throttled = set(throttled)
+        self.burst = burst # Seconds of bus time throttled frames may run ahead of the budget
+        self.stats = {"sent": [0] * len(PRIORITY_NAMES), "errors": 0, "blocked": 0, "dropped": 0, "coalesced": 0, "throttled": 0}
+        self._queues = [deque() for _ in PRIORITY_NAMES]
+        self._queued_reused = set() # (id(msg), id(bus)) of queued messages that their senders reuse
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._budget_time = 0 # Monotonic time until which the bus time budget is used up
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="TransmitScheduler", daemon=True)
+        self._thread.start()
+
+    def pending(self, priority=None):
+        with self._lock:
+            if priority is None:
+                return sum(len(queue) for queue in self._queues)
+            return len(self._queues[priority])
+
+    @property
+    def congested(self):
+        # Whether bulk senders should back off
+        return self.pending(PRIORITY_SDO) >= self.max_queued // 2
+
+    def submit(self, transmit, bus: can.BusABC, msg: can.Message, timeout=None, priority=None, block=False, block_timeout=None, lock=None):
+        """Queues transmit(bus, msg, timeout) to be called from the scheduler thread; returns False if dropped
+
+        If the class queue is full, the frame is dropped, or with block the caller waits up to block_timeout
+        seconds and can.CanOperationError is raised when it expires.  Calls from the scheduler thread never block.
+
+        lock is given for a message that the sender reuses and updates in place while holding lock, see
+        Node._tx_template().  Such a message is not copied, but transmitted while holding lock, and it is queued
+        at most once per bus, so an update made before it is sent replaces the queued frame.
+        """
+        if priority is None:
+            priority = frame_priority(msg)
+        if threading.current_thread() is self._thread:
+            block = False
+        with self._lock:
+            if self._stopped:
+                raise can.CanOperationError("Transmit scheduler is stopped")
+            key = None
+            if lock is not None:
+                key = (id(msg), id(bus))
+                if key in self._queued_reused:
+                    self.stats["coalesced"] += 1
+                    return True
+            queue = self._queues[priority]
+            if len(queue) >= self.max_queued:
+                if not block:
+                    self.stats["dropped"] += 1
+                    return False
+                self.stats["blocked"] += 1
+                if not self._not_full.wait_for(lambda: len(queue) < self.max_queued or self._stopped, block_timeout) or self._stopped:
+                    raise can.CanOperationError(f"Transmit queue for {PRIORITY_NAMES[priority]} frames is full")
+            if key is not None:
+                self._queued_reused.add(key)
+            queue.append((transmit, bus, msg, timeout, lock))
+            self._not_empty.notify()
+        return True
+
+    def _next(self):
+        # Returns (priority, item), or (None, seconds to wait) when only throttled frames are queued and over budget
+        now = time.monotonic()
+        wait = None
+        for priority, queue in enumerate(self._queues):
+            if not queue:
+                continue
+            if self.max_bus_load is not None and priority in self.throttled and self._budget_time - now > self.burst:
+                wait = self._budget_time - now - self.burst
+                continue
+            item = queue.popleft()
+            if item[4] is not None:
+                self._queued_reused.discard((id(item[2]), id(item[1])))
+            return priority, item
+        if wait is not None:
+            self.stats["throttled"] += 1
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while True:
+                    if self._stopped:
+                        return
+                    priority, item = self._next()
+                    if priority is not None:
+                        break
+                    self._not_empty.wait(item)
+                self._not_full.notify_all()
+            transmit, bus, msg, timeout, lock = item
+            try:
+                if lock is None:
+                    transmit(bus, msg, timeout)
+                else:
+                    with lock:
+                        transmit(bus, msg, timeout)
+                self.stats["sent"][priority] += 1
+            except Exception:
+                self.stats["errors"] += 1
+                logger.exception("Error transmitting frame with CAN-ID 0x%X", msg.arbitration_id)
+            if self.max_bus_load is not None:
+                now = time.monotonic()
+                self._budget_time = max(self._budget_time, now) + frame_bits(msg) / self.bitrate / self.max_bus_load
+
+    def stop(self):
+        # Queued frames are discarded
+        with self._lock:
+            self._stopped = True
+            for queue in self._queues:
+                queue.clear()
+            self._queued_reused.clear()
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()